@@ -0,0 +1,152 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabase:
+    """
+    Awaitable facade over Database.
+    Every query runs on a small dedicated thread pool so a slow write or a
+    locked database never blocks the event loop. Each worker thread keeps
+    its own pooled connection (see Database.get_connection).
+    """
+    def __init__(self, db, max_workers=4):
+        self.sync = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        logger.info(f"Async database facade started with {max_workers} workers")
+    
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking callable on the database executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.sync.close()
+    
+    async def add_user(self, user_id, username, first_name, last_name):
+        return await self.run(self.sync.add_user, user_id, username, first_name, last_name)
+    
+    async def get_user(self, user_id):
+        return await self.run(self.sync.get_user, user_id)
+    
+    @property
+    def catalog_version(self):
+        return self.sync.catalog.version()
+    
+    # Catalog reads skip the executor while the in-memory cache is current;
+    # the check is one primary-key read, which never waits on a writer under WAL
+    async def get_products(self, category=None):
+        if self.sync.catalog.is_fresh():
+            return self.sync.get_products(category)
+        return await self.run(self.sync.get_products, category)
+    
+    async def get_product(self, product_id):
+        if self.sync.catalog.is_fresh():
+            return self.sync.get_product(product_id)
+        return await self.run(self.sync.get_product, product_id)
+    
+    async def get_products_page(self, category=None, after_id=None, before_id=None, limit=10):
+        if self.sync.catalog.is_fresh():
+            return self.sync.get_products_page(category, after_id, before_id, limit)
+        return await self.run(self.sync.get_products_page, category, after_id, before_id, limit)
+    
+    async def get_categories(self):
+        if self.sync.catalog.is_fresh():
+            return self.sync.get_categories()
+        return await self.run(self.sync.get_categories)
+    
+    async def create_order(self, user_id, product_id, quantity, total_amount):
+        return await self.run(self.sync.create_order, user_id, product_id, quantity, total_amount)
+    
+    async def update_order_status(self, order_id, status, transaction_id=None):
+        return await self.run(self.sync.update_order_status, order_id, status, transaction_id)
+    
+    async def add_digital_keys(self, product_id, keys):
+        return await self.run(self.sync.add_digital_keys, product_id, keys)
+    
+    async def get_order_keys(self, order_id):
+        return await self.run(self.sync.get_order_keys, order_id)
+    
+    async def search_products(self, query, limit=10):
+        return await self.run(self.sync.search_products, query, limit)
+    
+    async def get_orders_chunk(self, after_id=0, limit=1000, since=None, until=None, status=None):
+        return await self.run(self.sync.get_orders_chunk, after_id, limit, since, until, status)
+    
+    async def get_order_status(self, order_id):
+        return await self.run(self.sync.get_order_status, order_id)
+    
+    async def get_order_items(self, order_id):
+        return await self.run(self.sync.get_order_items, order_id)
+    
+    async def add_to_cart(self, user_id, product_id, quantity, max_units):
+        return await self.run(self.sync.add_to_cart, user_id, product_id, quantity, max_units)
+    
+    async def get_cart(self, user_id):
+        return await self.run(self.sync.get_cart, user_id)
+    
+    async def remove_from_cart(self, user_id, product_id):
+        return await self.run(self.sync.remove_from_cart, user_id, product_id)
+    
+    async def clear_cart(self, user_id):
+        return await self.run(self.sync.clear_cart, user_id)
+    
+    async def checkout_cart(self, user_id):
+        return await self.run(self.sync.checkout_cart, user_id)
+    
+    async def wallet_purchase(self, user_id, product_id, quantity=1):
+        return await self.run(self.sync.wallet_purchase, user_id, product_id, quantity)
+    
+    async def get_wallet_balance(self, user_id):
+        return await self.run(self.sync.get_wallet_balance, user_id)
+    
+    async def create_topup(self, user_id, amount_cents):
+        return await self.run(self.sync.create_topup, user_id, amount_cents)
+    
+    async def get_pending_topups(self):
+        return await self.run(self.sync.get_pending_topups)
+    
+    async def complete_topup(self, topup_id, transaction_id):
+        return await self.run(self.sync.complete_topup, topup_id, transaction_id)
+    
+    async def fail_topup(self, topup_id):
+        return await self.run(self.sync.fail_topup, topup_id)
+    
+    async def get_pending_orders(self):
+        return await self.run(self.sync.get_pending_orders)
+    
+    async def expire_pending_orders(self, ttl_seconds, limit=500):
+        return await self.run(self.sync.expire_pending_orders, ttl_seconds, limit)
+    
+    async def create_broadcast(self, text):
+        return await self.run(self.sync.create_broadcast, text)
+    
+    async def get_running_broadcast(self):
+        return await self.run(self.sync.get_running_broadcast)
+    
+    async def claim_broadcast_batch(self, broadcast_id, limit=100):
+        return await self.run(self.sync.claim_broadcast_batch, broadcast_id, limit)
+    
+    async def record_broadcast_progress(self, broadcast_id, sent, failed):
+        return await self.run(self.sync.record_broadcast_progress, broadcast_id, sent, failed)
+    
+    async def settle_broadcast_claims(self, broadcast_id):
+        return await self.run(self.sync.settle_broadcast_claims, broadcast_id)
+    
+    async def finish_broadcast(self, broadcast_id, status='completed'):
+        return await self.run(self.sync.finish_broadcast, broadcast_id, status)
+    
+    async def get_user_orders(self, user_id, before_id=None, after_id=None, limit=10):
+        return await self.run(self.sync.get_user_orders, user_id, before_id, after_id, limit)
+    
+    async def get_all_orders(self, before_id=None, after_id=None, limit=10):
+        return await self.run(self.sync.get_all_orders, before_id, after_id, limit)
+    
+    async def get_stats(self):
+        return await self.run(self.sync.get_stats)
+    
+    async def rebuild_stats(self):
+        return await self.run(self.sync.rebuild_stats)
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Show that one slow query no longer stalls other handlers.
+
+Run from the repository root:
+    python -m benchmarks.bench_async_db
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+from async_database import AsyncDatabase
+
+SLOW_QUERY = '''
+    WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c LIMIT 5000000)
+    SELECT SUM(x) FROM c
+'''
+HANDLERS = 50
+
+def slow_query(db):
+    return db.get_connection().execute(SLOW_QUERY).fetchone()[0]
+
+async def fast_handler(adb, arrived):
+    await adb.get_user_orders(1)
+    return time.perf_counter() - arrived
+
+async def measure(adb, blocking):
+    if blocking:
+        # Old behaviour: the query runs directly on the event loop thread
+        async def slow():
+            slow_query(adb.sync)
+    else:
+        async def slow():
+            await adb.run(slow_query, adb.sync)
+    
+    started = time.perf_counter()
+    slow_task = asyncio.create_task(slow())
+    # Other users' updates arrive just after the slow one
+    latencies = await asyncio.gather(*(fast_handler(adb, started) for _ in range(HANDLERS)))
+    await slow_task
+    return max(latencies), time.perf_counter() - started
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        adb = AsyncDatabase(Database(os.path.join(tmp, "bench.db")), max_workers=4)
+        try:
+            blocking_worst, blocking_total = await measure(adb, blocking=True)
+            async_worst, async_total = await measure(adb, blocking=False)
+        finally:
+            adb.close()
+    
+    print(f"slow query on event loop : worst handler {blocking_worst * 1000:8.1f} ms (total {blocking_total:.2f}s)")
+    print(f"slow query on executor   : worst handler {async_worst * 1000:8.1f} ms (total {async_total:.2f}s)")
+    
+    if async_worst > blocking_total / 4:
+        print("FAIL: fast handlers were delayed by the slow query")
+        return 1
+    print("OK: fast handlers were not delayed by the slow query")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,108 @@
+"""
+Broadcast to a synthetic users table through MessageDispatcher and a fake
+bot, crash part-way through (the broadcaster task is killed without a clean
+stop), then resume from the checkpoint with a fresh Broadcaster, as a
+restarted bot would. Checks that nobody is messaged twice, that at most one
+claimed batch is lost to the crash, that the final sent and failed counts
+add up to every user and that memory stays flat, and reports throughput.
+
+Run from the repository root:
+    python -m benchmarks.bench_broadcast [users] [rate] [batch_size]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+from async_database import AsyncDatabase
+from broadcaster import Broadcaster
+from database import Database
+from message_dispatcher import MessageDispatcher
+
+class FakeBot:
+    def __init__(self):
+        self.received = Counter()
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.005)
+        self.received[chat_id] += 1
+
+def seed_users(db, users):
+    conn = db.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
+            ((1000 + n * 7, f"user{n}", f"User{n}", "") for n in range(users))
+        )
+
+async def wait_for_progress(broadcaster, done):
+    while broadcaster.progress()["sent"] + broadcaster.progress()["failed"] < done:
+        await asyncio.sleep(0.01)
+
+async def main(users=5000, rate=2000, batch_size=200):
+    workdir = tempfile.TemporaryDirectory()
+    db = AsyncDatabase(Database(os.path.join(workdir.name, "broadcast.db")))
+    seed_users(db.sync, users)
+    
+    bot = FakeBot()
+    outbox = MessageDispatcher("admin", global_rate=rate * 2, chat_rate=1, concurrency=64)
+    outbox.start(bot)
+    finished = []
+    
+    async def on_finished(progress):
+        finished.append(progress)
+    
+    tracemalloc.start()
+    try:
+        first = Broadcaster(db, outbox, rate=rate, batch_size=batch_size, on_finished=on_finished)
+        await first.begin("Big sale this weekend!")
+        await wait_for_progress(first, users // 2)
+        # Crash: kill the task mid-batch, no clean stop, no cancel recorded
+        first._task.cancel()
+        await asyncio.gather(first._task, return_exceptions=True)
+        crashed_at = sum(bot.received.values())
+        
+        started = time.perf_counter()
+        second = Broadcaster(db, outbox, rate=rate, batch_size=batch_size, on_finished=on_finished)
+        await second.start()
+        while second.running():
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await outbox.stop()
+        db.close()
+        workdir.cleanup()
+    
+    duplicates = sum(1 for count in bot.received.values() if count > 1)
+    missed = users - len(bot.received)
+    resumed = sum(bot.received.values()) - crashed_at
+    print(f"{users} users, {rate}/sec broadcast rate, batches of {batch_size}")
+    print(f"crashed after {crashed_at} messages; resumed run sent {resumed} in {elapsed:.2f}s "
+          f"({resumed / elapsed:,.0f} msgs/sec)")
+    print(f"reached {len(bot.received)} users, {duplicates} messaged twice, {missed} skipped by the crash")
+    if finished:
+        print(f"reported {finished[0]['sent']} sent, {finished[0]['failed']} failed")
+    print(f"peak traced memory {peak / 1024:.0f} KiB")
+    
+    failures = []
+    if duplicates:
+        failures.append(f"{duplicates} users were messaged more than once")
+    if missed > batch_size:
+        failures.append(f"{missed} users missed, more than one batch")
+    if len(finished) != 1 or finished[0]["running"]:
+        failures.append("the resumed broadcast did not report completion")
+    elif finished[0]["sent"] + finished[0]["failed"] != users:
+        failures.append(f"sent {finished[0]['sent']} + failed {finished[0]['failed']} != {users} users")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
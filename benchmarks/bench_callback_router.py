@@ -0,0 +1,96 @@
+"""
+Check CallbackRouter's matching rules (overlapping prefixes, typed
+arguments, trailing parameters containing '_') and show that dispatch cost
+stays flat as routes are added, next to an if/elif startswith chain of the
+same size.
+
+Run from the repository root:
+    python -m benchmarks.bench_callback_router [lookups]
+"""
+import asyncio
+import logging
+import sys
+import time
+
+from callback_router import CallbackRouter
+
+class FakeUpdate:
+    callback_query = None
+
+async def noop(query, **kwargs):
+    return kwargs
+
+def check_rules():
+    router = CallbackRouter()
+    router.add("buy_{product_id:int}", noop)
+    router.add("confirm_buy_{product_id:int}", noop)
+    router.add("products_next_{after_id:int}_{category}", noop)
+    router.add("admin_products_next_{after_id:int}", noop)
+    router.add("view_products", noop)
+    
+    def resolved(data):
+        route, args = router.resolve(data)
+        return (route.pattern if route else None), args
+    
+    assert resolved("buy_3") == ("buy_{product_id:int}", {"product_id": 3})
+    assert resolved("confirm_buy_3") == ("confirm_buy_{product_id:int}", {"product_id": 3})
+    assert resolved("products_next_7_") == ("products_next_{after_id:int}_{category}", {"after_id": 7, "category": ""})
+    assert resolved("products_next_7_gift_cards")[1] == {"after_id": 7, "category": "gift_cards"}
+    assert resolved("admin_products_next_9")[0] == "admin_products_next_{after_id:int}"
+    assert resolved("view_products") == ("view_products", {})
+    assert resolved("buy_abc") == (None, None)
+    assert resolved("view_products_extra") == (None, None)
+    try:
+        router.add("buy_{other:int}", noop)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("clashing prefix was accepted")
+    print("matching rules passed (prefix overlap, typed args, '_' in trailing args, clashes)")
+
+def build(routes):
+    router = CallbackRouter()
+    chain = []
+    for n in range(routes):
+        router.add(f"feature{n}_action_{{item_id:int}}", noop)
+        chain.append(f"feature{n}_action_")
+    return router, chain
+
+def chain_dispatch(chain, data):
+    # What button_handler used to do: test each prefix in turn, then slice off the argument
+    for prefix in chain:
+        if data.startswith(prefix):
+            return int(data.replace(prefix, ""))
+    return None
+
+def time_per_lookup(func, lookups):
+    started = time.perf_counter()
+    for _ in range(lookups):
+        func()
+    return (time.perf_counter() - started) / lookups * 1e6
+
+async def main(lookups=20000):
+    check_rules()
+    print(f"{'routes':>6}  {'router resolve':>15}  {'router dispatch':>16}  {'if/elif chain':>14}")
+    for routes in (20, 100, 500):
+        router, chain = build(routes)
+        # The worst case for the chain: the last route registered
+        data = f"feature{routes - 1}_action_42"
+        resolve_us = time_per_lookup(lambda: router.resolve(data), lookups)
+        chain_us = time_per_lookup(lambda: chain_dispatch(chain, data), lookups)
+        
+        update = FakeUpdate()
+        started = time.perf_counter()
+        for _ in range(lookups):
+            await router.dispatch(data, update, None)
+        dispatch_us = (time.perf_counter() - started) / lookups * 1e6
+        print(f"{routes:>6}  {resolve_us:>12.2f}us  {dispatch_us:>13.2f}us  {chain_us:>11.2f}us")
+    
+    stats = router.stats()
+    assert sum(row["calls"] for row in stats) == lookups, "calls were not counted"
+    print(f"per-route metrics: {stats[0]['route']} {stats[0]['calls']} calls, {stats[0]['mean_ms'] * 1000:.2f}us mean")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
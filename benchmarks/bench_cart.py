@@ -0,0 +1,79 @@
+"""
+Buying N products: N separate orders (one reservation, KHQR payload and
+payment round-trip each) against one cart checkout (a single transaction
+reserving every line, one KHQR for the total). Payment round-trips are
+counted rather than waited for. Checks that every line's stock is reserved
+and that an out-of-stock line rolls the whole checkout back.
+
+Run from the repository root:
+    python -m benchmarks.bench_cart [rounds]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+from khqr import MockKHQRPayment
+
+LINES = (1, 5, 10)
+
+def separate_orders(db, khqr, user_id, products):
+    for product_id in products:
+        price = db.get_product(product_id)[3]
+        order_id = db.create_order(user_id, product_id, 1, price)
+        khqr.build_payment_string(price, order_id)
+    return len(products)
+
+def cart_checkout(db, khqr, user_id, products):
+    for product_id in products:
+        db.add_to_cart(user_id, product_id, 1, len(products))
+    order_id, total_amount, _ = db.checkout_cart(user_id)
+    khqr.build_payment_string(total_amount, order_id)
+    return 1
+
+def main(rounds=200):
+    khqr = MockKHQRPayment()
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        products = [row[0] for row in db.get_products()]
+        for product_id in products:
+            db.add_digital_keys(product_id, [f"CART-{product_id}-{n}" for n in range(rounds * 2 * max(LINES))])
+        
+        print(f"{'lines':>5} {'flow':>16} {'ms/basket':>12} {'payments':>9}")
+        for lines in LINES:
+            basket = [products[n % len(products)] for n in range(lines)]
+            # Repeated products become one line with a larger quantity in the cart
+            for name, flow in (("separate orders", separate_orders), ("cart checkout", cart_checkout)):
+                payments = 0
+                started = time.perf_counter()
+                for user_id in range(rounds):
+                    payments += flow(db, khqr, user_id, basket)
+                elapsed = time.perf_counter() - started
+                print(f"{lines:5} {name:>16} {elapsed / rounds * 1000:12.3f} {payments / rounds:9.0f}")
+        
+        # All-or-nothing: one line short of stock leaves every product untouched
+        before = db.get_product(products[0])[5]
+        db.add_to_cart(-1, products[0], 1, 100)
+        db.add_to_cart(-1, products[1], 1, 100)
+        conn = db.get_connection()
+        with conn:
+            conn.execute("DELETE FROM digital_keys WHERE product_id = ? AND order_id IS NULL", (products[1],))
+        order_id, _, error = db.checkout_cart(-1)
+        if order_id is not None or error != "out_of_stock":
+            failures.append(f"checkout with a short line returned {order_id}, {error}")
+        if db.get_product(products[0])[5] != before:
+            failures.append("a failed checkout left stock reserved")
+        if len(db.get_cart(-1)) != 2:
+            failures.append("a failed checkout emptied the cart")
+        db.close()
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
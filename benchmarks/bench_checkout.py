@@ -0,0 +1,75 @@
+"""
+Checkout throughput with concurrent buyers: the old on-loop render to a PNG
+file versus in-memory rendering on the QR worker pool.
+
+Run from the repository root:
+    python -m benchmarks.bench_checkout [concurrent_checkouts]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+from async_database import AsyncDatabase
+from khqr import MockKHQRPayment, render_qr_png, shutdown_render_pool
+
+async def reply_photo(photo):
+    # Stand-in for the Telegram upload: consume the bytes, yield once
+    photo.read()
+    await asyncio.sleep(0)
+
+async def checkout_file(db, khqr, user_id):
+    """The pre-change flow: render on the loop, write, reopen, delete"""
+    order_id = await db.create_order(user_id, 1, 1, 15.99)
+    qr_filename = f"khqr_{order_id}.png"
+    with open(qr_filename, "wb") as qr_file:
+        qr_file.write(render_qr_png(khqr.build_payment_string(15.99, order_id)))
+    with open(qr_filename, "rb") as qr_file:
+        await reply_photo(qr_file)
+    os.remove(qr_filename)
+
+async def checkout_memory(db, khqr, user_id):
+    order_id = await db.create_order(user_id, 1, 1, 15.99)
+    qr_image, _ = await khqr.generate_payment_qr_async(15.99, order_id)
+    await reply_photo(qr_image)
+
+async def heartbeat(lags, stop):
+    # How late the event loop wakes up while checkouts are running
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+async def run(db, khqr, checkout, concurrent):
+    lags, stop = [], asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(checkout(db, khqr, n) for n in range(concurrent)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+    return concurrent / elapsed, max(lags, default=0)
+
+async def main(concurrent=50):
+    khqr = MockKHQRPayment()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        db = AsyncDatabase(Database(os.path.join(tmp, "bench.db")))
+        await db.add_digital_keys(1, [f"BENCH-{n}" for n in range(4 * concurrent)])
+        # Start the worker processes outside the timed section
+        await khqr.generate_payment_qr_async(1, 0)
+        try:
+            for name, checkout in (("file on loop", checkout_file), ("in-memory pool", checkout_memory)):
+                rate, lag = await run(db, khqr, checkout, concurrent)
+                print(f"{name:15}: {rate:7.1f} checkouts/sec, worst loop stall {lag * 1000:6.1f} ms")
+        finally:
+            shutdown_render_pool()
+            db.close()
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
@@ -0,0 +1,67 @@
+"""
+Hammer create_order from many threads and check that stock never oversells.
+
+Run from the repository root:
+    python -m benchmarks.bench_create_order [threads] [attempts_per_thread] [stock]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from database import Database
+
+def main(threads=16, attempts=200, stock=1000):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        conn = db.get_connection()
+        # Product 1 is digital, so its stock is the number of free keys
+        current = db.get_product(1)[5]
+        db.add_digital_keys(1, [f"BENCH-{n:06d}" for n in range(stock - current)])
+        
+        created = []
+        start = threading.Barrier(threads + 1)
+        
+        def buyer(user_id):
+            start.wait()
+            mine = 0
+            for _ in range(attempts):
+                if db.create_order(user_id, 1, 1, 15.99):
+                    mine += 1
+            created.append(mine)
+        
+        workers = [threading.Thread(target=buyer, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        
+        remaining = db.get_product(1)[5]
+        orders = conn.execute("SELECT COUNT(*) FROM orders WHERE product_id = 1").fetchone()[0]
+        reserved = conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT order_id) FROM digital_keys WHERE order_id IS NOT NULL"
+        ).fetchone()
+        db.close()
+    
+    attempted = threads * attempts
+    print(f"threads={threads} attempts={attempted} initial_stock={stock}")
+    print(f"orders created : {sum(created)} (rows in orders: {orders})")
+    print(f"stock remaining: {remaining}")
+    print(f"keys reserved  : {reserved[0]} across {reserved[1]} orders")
+    print(f"throughput     : {attempted / elapsed:,.0f} attempts/sec, {orders / elapsed:,.0f} orders/sec")
+    
+    oversold = orders - stock
+    if remaining < 0 or oversold > 0 or orders + remaining != stock or reserved != (orders, orders):
+        print(f"FAIL: oversold by {max(oversold, -remaining)} units")
+        return 1
+    print("OK: zero oversells")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
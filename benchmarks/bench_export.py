@@ -0,0 +1,118 @@
+"""
+Stream the orders table to CSV the way /export_orders does, at a quarter of
+the table and then all of it, plain and gzipped, and build each part's
+upload the way python-telegram-bot does (InputFile reads the file whole).
+Reports rows/sec, parts, output size and peak traced memory, and fails if
+exporting the whole table takes noticeably more memory than exporting a
+quarter of it (once that quarter spans several parts), or if an upload
+holds much more than one part.
+
+Run from the repository root:
+    python -m benchmarks.bench_export [orders] [chunk_size] [part_size]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from telegram import InputFile
+
+from async_database import AsyncDatabase
+from database import Database
+from orders_export import export_orders, spool_bytes
+
+STATUSES = ("completed", "completed", "completed", "pending", "failed", "expired")
+# Orders are spread evenly over this many days from FIRST_DAY
+DAYS = 400
+FIRST_DAY = date(2024, 1, 1)
+
+def seed_orders(db, orders):
+    conn = db.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
+            ((n, f"user{n}", f"User{n}", "") for n in range(1, 1001))
+        )
+        conn.executemany(
+            '''INSERT INTO orders (user_id, product_id, quantity, total_amount, khqr_transaction_id, status, created_at)
+               VALUES (?, ?, 1, ?, ?, ?, datetime(?, ?))''',
+            (
+                (n % 1000 + 1, n % 6 + 1, 9.99, f"txn_{n}", STATUSES[n % len(STATUSES)],
+                 FIRST_DAY.isoformat(), f"+{n * DAYS // orders} days")
+                for n in range(orders)
+            )
+        )
+        conn.execute('''
+            INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+            SELECT id, product_id, quantity, total_amount FROM orders
+        ''')
+
+async def run(db, limit_until, compress, chunk_size, part_size):
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = parts = size = 0
+    try:
+        async for document, part_rows in export_orders(
+            db, until=limit_until, compress=compress, chunk_size=chunk_size, part_size=part_size
+        ):
+            with document:
+                size += spool_bytes(document)
+                # What reply_document sends: the part's bytes in a multipart field
+                upload = InputFile(document.read(), filename="orders.csv").field_tuple
+                del upload
+            rows += part_rows
+            parts += 1
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return rows, parts, elapsed, size, peak
+
+async def main(orders=1_000_000, chunk_size=1000, part_size=10 * 1024 * 1024):
+    workdir = tempfile.TemporaryDirectory()
+    db = AsyncDatabase(Database(os.path.join(workdir.name, "export.db")))
+    started = time.perf_counter()
+    seed_orders(db.sync, orders)
+    print(f"seeded {orders} orders in {time.perf_counter() - started:.1f}s, "
+          f"chunks of {chunk_size}, parts of {part_size / 1024 / 1024:.0f}MB")
+    
+    # The first quarter of the days holds the first quarter of the orders
+    quarter_until = (FIRST_DAY + timedelta(days=DAYS // 4 - 1)).isoformat()
+    
+    failures = []
+    try:
+        print(f"{'export':18} {'rows':>9} {'parts':>6} {'rows/sec':>10} {'size':>10} {'peak mem':>10}")
+        for compress in (False, True):
+            peaks = []
+            quarter_parts = 0
+            for label, until in (("quarter", quarter_until), ("all", None)):
+                rows, parts, elapsed, size, peak = await run(db, until, compress, chunk_size, part_size)
+                peaks.append(peak)
+                quarter_parts = quarter_parts or parts
+                name = f"{label} {'csv.gz' if compress else 'csv'}"
+                print(f"{name:18} {rows:9} {parts:6} {rows / elapsed:10,.0f} {size / 1024 / 1024:8.1f}MB "
+                      f"{peak / 1024:8.0f}KiB")
+                if rows == 0:
+                    failures.append(f"{name} exported nothing")
+                # One part plus the chunk that carried it over the limit
+                if peak > part_size * 1.25 + 1024 * 1024:
+                    failures.append(f"{name} held {peak // 1024} KiB for {part_size // 1024} KiB parts")
+            # Memory is bounded by the part size, so a quarter that fits in one
+            # small part says nothing about growth
+            if quarter_parts > 1 and peaks[1] > peaks[0] * 1.5 + 256 * 1024:
+                failures.append(f"memory grew with the export size ({peaks[0] // 1024} -> {peaks[1] // 1024} KiB)")
+    finally:
+        db.close()
+        workdir.cleanup()
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
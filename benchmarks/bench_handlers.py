@@ -0,0 +1,226 @@
+"""
+Load-test JomNenhBot's handlers with synthetic updates. Each scenario builds
+Update/CallbackQuery objects and feeds them to Application.process_update with
+a fixed number in flight, against a temporary database, MockKHQRPayment and a
+stub Bot API transport that answers every call locally. Reports p50/p95/p99
+latency and updates/sec per scenario and writes them to a JSON file; pass an
+earlier file as the baseline to see the change for each scenario.
+
+Run from the repository root:
+    python -m benchmarks.bench_handlers [updates] [concurrency] [output.json] [baseline.json]
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from bot import JomNenhBot
+from khqr import shutdown_render_pool
+
+TOKEN = "123456:HANDLERBENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "JomNenh", "username": "jomnenh_bot"}
+
+class StubRequest(BaseRequest):
+    """Bot API transport that never leaves the process: every call succeeds immediately"""
+    def __init__(self):
+        self.calls = 0
+        self.message_ids = 0
+    
+    @property
+    def read_timeout(self):
+        return None
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "sendPhoto", "editMessageText"):
+            self.message_ids += 1
+            chat_id = params.get("chat_id", 0)
+            result = {
+                "message_id": params.get("message_id", self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+def command_update(update_id, user_id, command):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user(user_id),
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        },
+    }
+
+# name -> builds the update for (update id, user id)
+SCENARIOS = {
+    "start": lambda n, uid: command_update(n, uid, "/start"),
+    "browse_categories": lambda n, uid: command_update(n, uid, "/products"),
+    "browse_all_products": lambda n, uid: callback_update(n, uid, "view_all_products"),
+    "browse_category": lambda n, uid: callback_update(n, uid, "category_software"),
+    "product_detail": lambda n, uid: callback_update(n, uid, "buy_1"),
+    "confirm_buy": lambda n, uid: callback_update(n, uid, "confirm_buy_1"),
+    "confirm_buy_qty": lambda n, uid: callback_update(n, uid, "confirm_buy_qty_1_3"),
+    "add_to_cart": lambda n, uid: callback_update(n, uid, "cart_add_2_1"),
+    "cart_checkout": lambda n, uid: callback_update(n, uid, "cart_checkout"),
+    "show_orders": lambda n, uid: command_update(n, uid, "/orders"),
+    "admin_view_orders": lambda n, uid: callback_update(n, uid, "admin_view_orders"),
+    "admin_view_products": lambda n, uid: callback_update(n, uid, "admin_view_products"),
+    "admin_stats": lambda n, uid: callback_update(n, uid, "admin_stats"),
+}
+
+def percentile(sorted_values, p):
+    return sorted_values[max(0, math.ceil(p * len(sorted_values)) - 1)]
+
+async def run_scenario(app, build, updates, concurrency, users, first_update_id, errors):
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+    
+    async def one(n):
+        # Spread the load over many customers, as a sale would
+        update = Update.de_json(build(first_update_id + n, (n % users) + 1), app.bot)
+        async with slots:
+            started = time.perf_counter()
+            await app.process_update(update)
+            latencies.append((time.perf_counter() - started) * 1000)
+    
+    errors.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(updates)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "updates": updates,
+        "errors": len(errors),
+        "updates_per_sec": updates / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"\nchange against {baseline_path}:")
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        rate = (result["updates_per_sec"] / before["updates_per_sec"] - 1) * 100
+        p95 = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        print(f"{name:22} updates/sec {rate:+6.1f}%   p95 {p95:+6.1f}%")
+
+async def main(updates=500, concurrency=16, output="bench_handlers.json", baseline=None):
+    output = os.path.abspath(output)
+    baseline = os.path.abspath(baseline) if baseline else None
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    # JomNenhBot opens DATABASE_NAME relative to the working directory
+    os.chdir(workdir.name)
+    bot = JomNenhBot()
+    request = StubRequest()
+    app = bot.build_application(
+        Application.builder().token(TOKEN).request(request).get_updates_request(StubRequest())
+    )
+    errors = []
+    
+    async def on_error(update, context):
+        errors.append(context.error)
+    app.add_error_handler(on_error)
+    
+    users = max(concurrency * 4, 50)
+    # Enough keys that confirm_buy never runs out of stock
+    bot.db.sync.add_digital_keys(1, [f"BENCH-KEY-{n:06d}" for n in range(updates * 4)])
+    bot.db.sync.add_digital_keys(2, [f"BENCH-CART-{n:06d}" for n in range(updates)])
+    
+    results = {}
+    await app.initialize()
+    try:
+        print(f"{updates} updates per scenario, {concurrency} in flight, {users} users")
+        print(f"{'scenario':22} {'updates/sec':>12} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+        for index, (name, build) in enumerate(SCENARIOS.items()):
+            result = await run_scenario(app, build, updates, concurrency, users, (index + 1) * 1_000_000, errors)
+            results[name] = result
+            print(f"{name:22} {result['updates_per_sec']:12,.1f} {result['p50_ms']:7.2f}ms "
+                  f"{result['p95_ms']:7.2f}ms {result['p99_ms']:7.2f}ms {result['errors']:>7}")
+    finally:
+        await app.shutdown()
+        bot.db.close()
+        shutdown_render_pool()
+        os.chdir(cwd)
+        workdir.cleanup()
+    
+    with open(output, "w") as f:
+        json.dump({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "updates": updates,
+            "concurrency": concurrency,
+            "scenarios": results,
+        }, f, indent=2)
+    print(f"\nresults written to {output}")
+    if baseline:
+        compare(results, baseline)
+    
+    failed = [name for name, result in results.items() if result["errors"]]
+    if failed:
+        print(f"FAIL: handler errors in {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    # bot.py configures INFO logging on import
+    logging.getLogger().setLevel(logging.ERROR)
+    args = sys.argv[1:]
+    sys.exit(asyncio.run(main(
+        *(int(arg) for arg in args[:2]),
+        *args[2:4],
+    )))
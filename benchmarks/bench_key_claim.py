@@ -0,0 +1,70 @@
+"""
+Check that reserving a digital key stays constant-time as key stock grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_key_claim [keys] [orders_per_sample]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+
+def time_orders(db, product_id, count):
+    started = time.perf_counter()
+    for n in range(count):
+        if not db.create_order(n, product_id, 1, 1.0):
+            raise RuntimeError("ran out of keys during the benchmark")
+    return (time.perf_counter() - started) / count
+
+def main(keys=100_000, sample=1000):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        conn = db.get_connection()
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO products (name, description, price, category, stock, is_digital)
+                VALUES ('Bench Key', 'benchmark product', 1.0, 'bench', 0, 1)
+            ''')
+        product_id = cursor.lastrowid
+        
+        started = time.perf_counter()
+        db.add_digital_keys(product_id, [f"KEY-{n:08d}" for n in range(keys)])
+        print(f"loaded {keys:,} keys in {time.perf_counter() - started:.2f}s")
+        
+        first = time_orders(db, product_id, sample)
+        # Reserve most of the stock so the remaining free keys sit behind
+        # a long run of already-sold rows
+        with conn:
+            conn.execute('''
+                UPDATE digital_keys SET order_id = -1
+                WHERE id IN (
+                    SELECT id FROM digital_keys WHERE product_id = ? AND order_id IS NULL
+                    ORDER BY id LIMIT ?
+                )
+            ''', (product_id, keys - 2 * sample))
+        last = time_orders(db, product_id, sample)
+        
+        plan = conn.execute('''
+            EXPLAIN QUERY PLAN SELECT id FROM digital_keys
+            WHERE product_id = ? AND order_id IS NULL ORDER BY id LIMIT 1
+        ''', (product_id,)).fetchall()
+        remaining = db.get_product(product_id)[5]
+        db.close()
+    
+    print(f"reserve with {keys:,} free keys      : {first * 1e6:8.1f} us/order")
+    print(f"reserve with {2 * sample:,} free keys behind {keys - 2 * sample:,} sold: {last * 1e6:8.1f} us/order")
+    print(f"free-key lookup plan: {plan[0][-1]}")
+    print(f"stock remaining: {remaining}")
+    
+    if "idx_digital_keys_free" not in plan[0][-1] or remaining != 0:
+        print("FAIL: free-key lookup is not served by the partial index")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
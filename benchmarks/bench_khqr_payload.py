@@ -0,0 +1,76 @@
+"""
+Round-trip checks for the KHQR payload encoder/decoder, then a timed run
+encoding one million payloads.
+
+Run from the repository root:
+    python -m benchmarks.bench_khqr_payload [payloads]
+"""
+import sys
+import time
+
+from khqr_payload import KHQRMerchantTemplate, crc16_ccitt, decode_payload, tlv
+
+def full_encode(amount, bill_number, timestamp_ms):
+    """Reference encoder that rebuilds every field and the whole CRC each time"""
+    payload = (
+        tlv("00", "01") + tlv("01", "12") + tlv("29", tlv("00", "jomnenh@aclb")) + tlv("52", "5999")
+        + tlv("53", "840") + tlv("54", f"{amount:.2f}") + tlv("58", "KH")
+        + tlv("59", "JomNenh Store") + tlv("60", "Phnom Penh")
+        + tlv("62", tlv("01", bill_number)) + tlv("99", tlv("00", timestamp_ms)) + "6304"
+    )
+    return payload + f"{crc16_ccitt(payload.encode('utf-8')):04X}"
+
+def check_round_trips():
+    # Standard check value for CRC-16/CCITT-FALSE
+    assert crc16_ccitt(b"123456789") == 0x29B1
+    
+    individual = KHQRMerchantTemplate("jomnenh@aclb", "JomNenh Store", "Phnom Penh")
+    merchant = KHQRMerchantTemplate(
+        "jomnenh@aclb", "JomNenh Store", "Phnom Penh", merchant_id="123456", acquiring_bank="ACLEDA"
+    )
+    for template, account_tag in ((individual, "29"), (merchant, "30")):
+        for amount, currency, expected in ((15.99, "USD", "15.99"), (0.5, "USD", "0.50"), (40000, "KHR", "40000")):
+            payload = template.encode(amount, currency, bill_number="42", timestamp_ms=1700000000000)
+            fields = decode_payload(payload)
+            assert fields["54"] == expected, fields
+            assert fields["53"] == ("840" if currency == "USD" else "116"), fields
+            assert fields["62"] == {"01": "42"}, fields
+            assert fields["99"] == {"00": "1700000000000"}, fields
+            assert fields[account_tag]["00"] == "jomnenh@aclb", fields
+            assert list(fields)[-1] == "63"
+    
+    # Precomputed prefix and CRC must give byte-identical output
+    payload = individual.encode(15.99, "USD", bill_number="42", timestamp_ms=1700000000000)
+    assert payload == full_encode(15.99, "42", 1700000000000), payload
+    
+    corrupted = payload.replace("15.99", "15.98")
+    try:
+        decode_payload(corrupted)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("corrupted payload passed the CRC check")
+    print("round-trip checks passed")
+
+def main(payloads=1_000_000):
+    check_round_trips()
+    template = KHQRMerchantTemplate("jomnenh@aclb", "JomNenh Store", "Phnom Penh")
+    encode = template.encode
+    timestamp_ms = 1700000000000
+    
+    started = time.perf_counter()
+    for n in range(payloads):
+        encode(15.99, "USD", str(n), timestamp_ms)
+    elapsed = time.perf_counter() - started
+    print(f"template encode: {payloads:,} payloads in {elapsed:.2f}s ({elapsed / payloads * 1e6:.2f} us each)")
+    
+    sample = max(1, payloads // 10)
+    started = time.perf_counter()
+    for n in range(sample):
+        full_encode(15.99, str(n), timestamp_ms)
+    per_payload = (time.perf_counter() - started) / sample
+    print(f"full encode    : {per_payload * 1e6:.2f} us each (sampled {sample:,})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
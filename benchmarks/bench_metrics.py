@@ -0,0 +1,106 @@
+"""
+Measure what metrics timing adds to a call (the target is under a
+microsecond), then time real Database calls, serve the metrics endpoint and
+check the scrape is well-formed Prometheus text.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics [calls]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import metrics
+from database import Database
+
+def bare(x):
+    return x
+
+async def bare_async(x):
+    return x
+
+def per_call_ns(func, calls):
+    started = time.perf_counter_ns()
+    for n in range(calls):
+        func(n)
+    return (time.perf_counter_ns() - started) / calls
+
+async def per_call_async_ns(func, calls):
+    started = time.perf_counter_ns()
+    for n in range(calls):
+        await func(n)
+    return (time.perf_counter_ns() - started) / calls
+
+async def scrape(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0].decode(), body.decode()
+
+def check_exposition(body):
+    """Every sample line is `name{labels} value` and every bucket series ends in +Inf == _count"""
+    counts = {}
+    infs = {}
+    for line in body.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        series, value = line.rsplit(" ", 1)
+        float(value)
+        if "_bucket{" in series and 'le="+Inf"' in series:
+            infs[series.split("_bucket{")[0] + series.split("{")[1].split(",le=")[0]] = value
+        elif series.split("{")[0].endswith("_seconds_count"):
+            counts[series.split("_count{")[0] + series.split("{")[1].rstrip("}")] = value
+    assert infs and infs == counts, "+Inf buckets do not match _count"
+
+async def main(calls=1_000_000):
+    family = metrics.Family("bench", "benchmark", "call")
+    timed = family.timed("bare")(bare)
+    timed_async = family.timed("bare_async")(bare_async)
+    
+    base = per_call_ns(bare, calls)
+    wrapped = per_call_ns(timed, calls)
+    base_async = await per_call_async_ns(bare_async, calls)
+    wrapped_async = await per_call_async_ns(timed_async, calls)
+    sync_overhead = wrapped - base
+    async_overhead = wrapped_async - base_async
+    print(f"sync call:  {base:6.0f}ns bare, {wrapped:6.0f}ns timed, overhead {sync_overhead:5.0f}ns")
+    print(f"async call: {base_async:6.0f}ns bare, {wrapped_async:6.0f}ns timed, overhead {async_overhead:5.0f}ns")
+    assert family.children["bare"].counts and sum(family.children["bare"].counts) == calls
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "metrics.db"))
+        db.add_user(1, "alice", "Alice", "A")
+        for _ in range(1000):
+            db.get_product(1)
+            db.get_user(1)
+        order_id = db.create_order(1, 1, 1, 15.99)
+        db.update_order_status(order_id, "completed", f"txn_{order_id}")
+        db.close()
+    
+    server = await metrics.start_server("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        status, body = await scrape(port)
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert status == "HTTP/1.1 200 OK", status
+    check_exposition(body)
+    for method in ("get_user", "get_product", "create_order"):
+        line = next(l for l in body.splitlines() if l.startswith(f'jomnenh_db_query_seconds_count{{method="{method}"}}'))
+        print(f"scraped {line}")
+    
+    if max(sync_overhead, async_overhead) >= 1000:
+        print("FAIL: timing overhead is a microsecond or more per call")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
@@ -0,0 +1,112 @@
+"""
+Flood MessageDispatcher with key deliveries and admin notifications against a
+fake bot that takes a fixed time per send and answers one send with
+RetryAfter. Checks that the global and per-chat rates hold, that each chat
+receives its messages in order, that customer deliveries are not held up
+behind admin traffic and that admin notifications past the threshold are
+merged into digests.
+
+Run from the repository root:
+    python -m benchmarks.bench_outbox [customers] [messages_per_customer] [api_delay_ms]
+"""
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+from telegram.error import RetryAfter
+
+from message_dispatcher import MessageDispatcher
+
+ADMIN = "admin"
+
+class FakeBot:
+    def __init__(self, delay):
+        self.delay = delay
+        # chat id -> [(sent at, text)]
+        self.sent = defaultdict(list)
+        self.flood_once = True
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.delay)
+        if self.flood_once and len(self.sent[chat_id]) == 1:
+            self.flood_once = False
+            raise RetryAfter(1)
+        self.sent[chat_id].append((time.monotonic(), text))
+
+def max_in_window(times, window):
+    """Most sends that fall within any `window` seconds"""
+    best = start = 0
+    for end in range(len(times)):
+        while times[end] - times[start] >= window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+async def main(customers=60, per_customer=3, api_delay_ms=50):
+    bot = FakeBot(api_delay_ms / 1000)
+    outbox = MessageDispatcher(ADMIN, global_rate=30, chat_rate=1, chat_burst=1, concurrency=8,
+                               digest_threshold=10, digest_interval=1)
+    outbox.start(bot)
+    
+    queued_at = {}
+    started = time.monotonic()
+    for n in range(per_customer):
+        for chat_id in range(1, customers + 1):
+            text = f"{chat_id}:{n}"
+            queued_at[text] = time.monotonic()
+            outbox.send(chat_id, text)
+            outbox.notify_admin("✅ Completed orders", f"order {text} completed", f"✅ {text}")
+    
+    total = customers * per_customer
+    while sum(len(bot.sent[chat_id]) for chat_id in range(1, customers + 1)) < total:
+        if time.monotonic() - started > 300:
+            raise TimeoutError("deliveries were not all sent")
+        await asyncio.sleep(0.01)
+    customers_done = time.monotonic() - started
+    await outbox.stop(timeout=30)
+    elapsed = time.monotonic() - started
+    
+    failures = []
+    all_times = sorted(at for chat in bot.sent.values() for at, _ in chat)
+    if max_in_window(all_times, 1.0) > outbox.global_rate + 1:
+        failures.append(f"global rate exceeded: {max_in_window(all_times, 1.0)} sends in one second")
+    for chat_id, messages in bot.sent.items():
+        times = [at for at, _ in messages]
+        if chat_id != ADMIN and any(b - a < 0.9 / outbox.chat_rate for a, b in zip(times, times[1:])):
+            failures.append(f"chat {chat_id} got messages faster than {outbox.chat_rate}/sec")
+        if chat_id != ADMIN and [text for _, text in messages] != [f"{chat_id}:{n}" for n in range(per_customer)]:
+            failures.append(f"chat {chat_id} got its messages out of order")
+    
+    latencies = sorted(
+        (at - queued_at[text]) * 1000
+        for chat_id, messages in bot.sent.items() if chat_id != ADMIN
+        for at, text in messages
+    )
+    admin_messages = bot.sent[ADMIN]
+    digests = [text for _, text in admin_messages if text.startswith("📋")]
+    stats = outbox.stats()
+    
+    print(f"{total} deliveries to {customers} chats and {total} admin notifications, "
+          f"{api_delay_ms}ms per send")
+    print(f"deliveries done in {customers_done:.2f}s, everything in {elapsed:.2f}s "
+          f"(global cap {outbox.global_rate:.0f}/sec, per chat {outbox.chat_rate:.0f}/sec)")
+    print(f"delivery latency p50 {statistics.median(latencies):.0f}ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.0f}ms")
+    print(f"admin chat received {len(admin_messages)} messages "
+          f"({len(digests)} digests covering {stats['digested']} notifications)")
+    print(f"retried {stats['retried']}, dropped {stats['dropped']}")
+    
+    if stats["digested"] == 0 or not digests:
+        failures.append("admin notifications were never digested")
+    if stats["dropped"]:
+        failures.append(f"{stats['dropped']} messages dropped")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
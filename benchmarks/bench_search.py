@@ -0,0 +1,106 @@
+"""
+Product search latency on a large catalog. Seeds synthetic products (the
+FTS5 index is filled by the products triggers), then times
+Database.search_products for common, rare, prefix, multi-word and
+no-match queries, first uncached (ranking every match) and then with the
+ranking cached. Fails if any query's cached p95 reaches 10 ms, or its
+uncached p95 reaches COLD_BUDGET_MS.
+
+Run from the repository root:
+    python -m benchmarks.bench_search [products] [runs_per_query]
+"""
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import Database
+
+BRANDS = ["Windows", "Office", "Adobe", "Spotify", "Netflix", "Steam", "Minecraft", "Xbox", "PlayStation",
+          "Canva", "Nord", "Kaspersky", "Disney", "YouTube", "Apple", "Google", "Autodesk", "JetBrains"]
+KINDS = ["License Key", "Premium Account", "Gift Card", "Subscription", "Activation Code", "Bundle"]
+TERMS = ["1 Month", "3 Months", "6 Months", "1 Year", "Lifetime", "Family", "Student", "Pro", "Ultimate"]
+WORDS = ["genuine", "instant", "delivery", "global", "region", "free", "official", "digital", "worldwide",
+         "warranty", "renewable", "shared", "private", "upgrade", "edition", "multi", "device", "support"]
+
+QUERIES = {
+    "common word": "premium",
+    "brand + kind": "netflix account",
+    "prefix": "spot",
+    "three words": "adobe lifetime key",
+    "rare": "jetbrains ultimate",
+    "no match": "zzzzunknown",
+}
+
+# Uncached searches rank every match, so they cost time in proportion to
+# the matches: about 8k for "premium" in 50k products. Rankings are only
+# dropped when product text changes, so this is the first search after an
+# edit, not the steady state.
+COLD_BUDGET_MS = 30
+
+def seed(db, products, rng):
+    conn = db.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO products (name, description, price, category, stock, is_digital) VALUES (?, ?, ?, ?, ?, 0)",
+            (
+                (
+                    f"{rng.choice(BRANDS)} {rng.choice(KINDS)} {rng.choice(TERMS)} #{n}",
+                    " ".join(rng.choices(WORDS, k=12)),
+                    round(rng.uniform(1, 100), 2),
+                    rng.choice(["software", "accounts", "games"]),
+                    rng.randint(0, 50),
+                )
+                for n in range(products)
+            )
+        )
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def main(products=50_000, runs=200):
+    rng = random.Random(42)
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        started = time.perf_counter()
+        seed(db, products, rng)
+        print(f"seeded {products} products in {time.perf_counter() - started:.1f}s")
+        print(f"{'query':14} {'results':>7} {'cold p95':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for name, query in QUERIES.items():
+            results = db.search_products(query)
+            cold = []
+            for _ in range(max(1, runs // 10)):
+                # A text change drops the cached rankings
+                with db.get_connection() as conn:
+                    conn.execute("UPDATE products SET name = name WHERE id = 1")
+                started = time.perf_counter()
+                db.search_products(query)
+                cold.append((time.perf_counter() - started) * 1000)
+            cold.sort()
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                db.search_products(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = percentile(timings, 0.95)
+            cold_p95 = percentile(cold, 0.95)
+            print(f"{name:14} {len(results):7} {cold_p95:7.2f}ms "
+                  f"{percentile(timings, 0.5):7.2f}ms {p95:7.2f}ms "
+                  f"{percentile(timings, 0.99):7.2f}ms")
+            if p95 >= 10:
+                failures.append(f"{name!r} p95 {p95:.2f}ms is not single-digit")
+            if cold_p95 >= COLD_BUDGET_MS:
+                failures.append(f"{name!r} uncached p95 {cold_p95:.2f}ms is over {COLD_BUDGET_MS}ms")
+        db.close()
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
@@ -0,0 +1,86 @@
+"""
+Measure cold-start cost: the import time of each module in a fresh
+interpreter (so nothing is cached by an earlier import), which heavy
+dependencies each import drags in, and Database init time on a new
+database versus one already at the latest schema.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULES = [
+    "config", "migrations", "catalog_cache", "metrics", "khqr_payload", "database",
+    "async_database", "khqr", "message_dispatcher", "payment_poller", "bot",
+]
+# Only wanted once a QR is rendered or the bank is called
+HEAVY = ["qrcode", "PIL", "requests", "httpx"]
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+try:
+    import {module}
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "error": error, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+INIT_PROBE = """
+import json, logging, time
+logging.disable(logging.CRITICAL)
+from database import Database
+started = time.perf_counter()
+db = Database({path!r})
+elapsed = time.perf_counter() - started
+db.close()
+print(json.dumps({{"seconds": elapsed}}))
+"""
+
+def probe(code, cwd):
+    env = dict(os.environ, PYTHONPATH=cwd)
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    # Modules may print while importing; the probe's result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(runs=5):
+    root = os.getcwd()
+    print(f"import time in a fresh interpreter, median of {runs} runs")
+    print(f"{'module':20} {'import':>10}  heavy dependencies loaded")
+    failures = []
+    for module in MODULES:
+        results = [probe(IMPORT_PROBE.format(module=module, heavy=HEAVY), root) for _ in range(runs)]
+        if results[0]["error"]:
+            print(f"{module:20} {'-':>10}  unavailable here ({results[0]['error']})")
+            continue
+        seconds = statistics.median(result["seconds"] for result in results)
+        heavy = results[0]["heavy"]
+        print(f"{module:20} {seconds * 1000:8.1f}ms  {', '.join(heavy) or '-'}")
+        if module in ("khqr", "config") and heavy:
+            failures.append(f"importing {module} loads {', '.join(heavy)}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        times = {"new database": [], "current schema": []}
+        for run in range(runs):
+            path = os.path.join(tmp, f"startup{run}.db")
+            times["new database"].append(probe(INIT_PROBE.format(path=path), root)["seconds"])
+            times["current schema"].append(probe(INIT_PROBE.format(path=path), root)["seconds"])
+    print()
+    for label, samples in times.items():
+        print(f"Database() on a {label:15} {statistics.median(samples) * 1000:8.2f}ms")
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:])))
@@ -0,0 +1,107 @@
+"""
+Exercise KHQRPayment.verify_payment_async against a local stub bank API:
+success, retry on transient errors, no retry on client errors, timeouts,
+then throughput and connection reuse under concurrent verifications.
+
+Run from the repository root:
+    python -m benchmarks.bench_verify_payment [verifications]
+"""
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from khqr import KHQRPayment
+
+hits = Counter()
+connections = Counter()
+
+class StubBankHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def setup(self):
+        super().setup()
+        connections["opened"] += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        transaction_id = self.path.rsplit("/", 1)[-1]
+        hits[transaction_id] += 1
+        kind = transaction_id.split("_", 1)[0]
+        
+        if kind == "flaky" and hits[transaction_id] <= 2:
+            return self.reply(503, {"error": "try again"})
+        if kind == "missing":
+            return self.reply(404, {"error": "not found"})
+        if kind == "slow":
+            time.sleep(0.5)
+        self.reply(200, {"status": "success", "transaction_id": transaction_id})
+    
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class StubBankServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Timed-out clients hang up before the slow handler replies
+        pass
+
+async def check_behaviour(khqr):
+    result = await khqr.verify_payment_async("ok_1")
+    assert result and result["status"] == "success", result
+    
+    result = await khqr.verify_payment_async("flaky_1")
+    assert result and hits["flaky_1"] == 3, (result, hits["flaky_1"])
+    
+    result = await khqr.verify_payment_async("missing_1")
+    assert result is None and hits["missing_1"] == 1, (result, hits["missing_1"])
+    
+    started = time.perf_counter()
+    result = await khqr.verify_payment_async("slow_1")
+    elapsed = time.perf_counter() - started
+    assert result is None and hits["slow_1"] == khqr.verify_retries + 1, (result, hits["slow_1"])
+    # Each attempt is cut off by the per-request timeout, not the 0.5s handler
+    assert elapsed < (khqr.verify_retries + 1) * 0.5, elapsed
+    print("behaviour checks passed (success, retry on 503, no retry on 404, timeout)")
+
+async def main(verifications=500):
+    server = StubBankServer(("127.0.0.1", 0), StubBankHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    khqr = KHQRPayment()
+    khqr.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    khqr.verify_timeout = 0.2
+    khqr.verify_retries = 2
+    khqr.verify_backoff = 0.01
+    try:
+        await check_behaviour(khqr)
+        
+        connections.clear()
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(khqr.verify_payment_async(f"ok_bulk{n}") for n in range(verifications))
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await khqr.aclose()
+        server.shutdown()
+    
+    assert all(results), "some verifications failed"
+    print(f"{verifications} concurrent verifications in {elapsed:.2f}s "
+          f"({verifications / elapsed:,.0f}/sec) over {connections['opened']} TCP connections "
+          f"(cap {khqr.verify_concurrency})")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
@@ -0,0 +1,99 @@
+"""
+Wallet checkout against the KHQR checkout: concurrent buyers each top up
+enough for two purchases, then try five at once. Reports purchases/sec and
+latency for both flows (the KHQR one stops at the QR, before the payment
+wait it would add), and checks the ledger afterwards: nobody went below
+zero, nobody bought more than they could afford, and every balance equals
+the sum of its ledger entries.
+
+Run from the repository root:
+    python -m benchmarks.bench_wallet [buyers]
+"""
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from database import Database
+from async_database import AsyncDatabase
+from khqr import MockKHQRPayment, shutdown_render_pool
+
+PRICE_CENTS = 1599
+ATTEMPTS = 5
+
+async def khqr_checkout(db, khqr, user_id):
+    order_id = await db.create_order(user_id, 1, 1, PRICE_CENTS / 100)
+    await khqr.generate_payment_qr_async(PRICE_CENTS / 100, order_id)
+    return order_id is not None
+
+async def wallet_checkout(db, khqr, user_id):
+    order_id, _ = await db.wallet_purchase(user_id, 1)
+    return order_id is not None
+
+async def run(db, khqr, checkout, buyers):
+    latencies = []
+    
+    async def one(user_id):
+        started = time.perf_counter()
+        ok = await checkout(db, khqr, user_id)
+        latencies.append(time.perf_counter() - started)
+        return ok
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(user_id) for user_id in range(1, buyers + 1) for _ in range(ATTEMPTS)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return sum(results), elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+
+def check_ledger(db, buyers):
+    cursor = db.get_connection().cursor()
+    failures = []
+    cursor.execute('''
+        SELECT u.user_id, u.balance_cents, COALESCE(SUM(l.amount_cents), 0)
+        FROM users u LEFT JOIN wallet_ledger l ON l.user_id = u.user_id
+        GROUP BY u.user_id
+    ''')
+    for user_id, balance, ledger in cursor.fetchall():
+        if balance != ledger:
+            failures.append(f"user {user_id}: balance {balance} but ledger sums to {ledger}")
+        if balance < 0:
+            failures.append(f"user {user_id}: negative balance {balance}")
+    cursor.execute("SELECT COUNT(*) FROM wallet_ledger WHERE kind = 'purchase'")
+    purchases = cursor.fetchone()[0]
+    if purchases != buyers * 2:
+        failures.append(f"{purchases} wallet purchases, expected exactly {buyers * 2}")
+    return failures
+
+async def main(buyers=100):
+    khqr = MockKHQRPayment()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, "bench.db")))
+        await db.add_digital_keys(1, [f"BENCH-{n}" for n in range(4 * ATTEMPTS * buyers)])
+        for user_id in range(1, buyers + 1):
+            await db.add_user(user_id, f"user{user_id}", f"User{user_id}", "")
+            topup_id = await db.create_topup(user_id, PRICE_CENTS * 2)
+            await db.complete_topup(topup_id, f"topup_{topup_id}")
+        # Start the worker processes outside the timed section
+        await khqr.generate_payment_qr_async(1, 0)
+        try:
+            print(f"{buyers} buyers, {ATTEMPTS} concurrent attempts each, wallet covers two")
+            for name, checkout in (("khqr (to QR)", khqr_checkout), ("wallet", wallet_checkout)):
+                done, elapsed, p50, p95 = await run(db, khqr, checkout, buyers)
+                print(f"{name:13}: {done:5} purchases, {done / elapsed:8.1f}/sec, "
+                      f"p50 {p50 * 1000:6.2f} ms, p95 {p95 * 1000:6.2f} ms")
+            failures = check_ledger(db.sync, buyers)
+        finally:
+            shutdown_render_pool()
+            db.close()
+    
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("ledger consistent: no overdraft, every balance matches its entries")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
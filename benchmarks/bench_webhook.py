@@ -0,0 +1,189 @@
+"""
+Load-test webhook mode: run the bot's real handlers behind the local webhook
+listener, post synthetic callback-query updates to it and measure throughput
+and per-update latency, first with sequential processing and then with the
+configured concurrency. Bot API calls go to a local stub that answers after a
+fixed delay, standing in for the round trip to Telegram. Each user's updates
+must be answered in the order they were posted.
+
+Run from the repository root:
+    python -m benchmarks.bench_webhook [users] [updates_per_user] [api_delay_ms]
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import httpx
+from telegram.ext import Application
+
+from bot import JomNenhBot
+from config import UPDATE_CONCURRENCY
+from khqr import shutdown_render_pool
+
+TOKEN = "123456:LOADTEST"
+SECRET = "load-test-secret"
+
+class StubTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.02
+    # chat id -> [(message id, answered at)] in the order edits arrived
+    edits = defaultdict(list)
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method == "editMessageText":
+            time.sleep(self.delay)
+            with self.lock:
+                self.edits[int(params["chat_id"])].append((int(params["message_id"]), time.perf_counter()))
+            result = True
+        else:
+            if method != "setWebhook":
+                time.sleep(self.delay)
+            result = True
+        self.reply({"ok": True, "result": result})
+
+    def reply(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def callback_update(update_id, user_id, sequence):
+    """A button press on message `sequence`, so answers can be matched to updates"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": "view_all_products",
+            "message": {
+                "message_id": sequence,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+async def run_load(bot, api_url, concurrency, users, per_user):
+    StubTelegramHandler.edits.clear()
+    app = bot.build_application(Application.builder().token(TOKEN).base_url(api_url), concurrency)
+    port = free_port()
+    await app.initialize()
+    await app.updater.start_webhook(
+        listen="127.0.0.1", port=port, url_path="webhook",
+        webhook_url=f"http://127.0.0.1:{port}/webhook", secret_token=SECRET,
+    )
+    await app.start()
+
+    posted = {}
+
+    async def post_user(client, user_id):
+        # Telegram delivers one user's updates in order, so post them one at a time
+        for sequence in range(1, per_user + 1):
+            update_id = user_id * per_user + sequence
+            posted[(user_id, sequence)] = time.perf_counter()
+            response = await client.post(
+                f"http://127.0.0.1:{port}/webhook",
+                json=callback_update(update_id, user_id, sequence),
+                headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+            )
+            response.raise_for_status()
+
+    total = users * per_user
+    started = time.perf_counter()
+    try:
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(post_user(client, user_id) for user_id in range(1, users + 1)))
+        while sum(len(answers) for answers in StubTelegramHandler.edits.values()) < total:
+            if time.perf_counter() - started > 300:
+                raise TimeoutError("updates were not all answered")
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+
+    latencies = []
+    out_of_order = 0
+    for user_id, answers in StubTelegramHandler.edits.items():
+        sequences = [sequence for sequence, _ in answers]
+        out_of_order += sequences != sorted(sequences)
+        latencies += [(answered - posted[(user_id, sequence)]) * 1000 for sequence, answered in answers]
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "rate": total / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "out_of_order": out_of_order,
+    }
+
+async def main(users=50, per_user=4, api_delay_ms=20):
+    StubTelegramHandler.delay = api_delay_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTelegramHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/bot"
+
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(workdir.name)
+    bot = JomNenhBot()
+    try:
+        print(f"{users} users x {per_user} updates, {api_delay_ms}ms per Bot API call")
+        results = {}
+        for concurrency in (1, UPDATE_CONCURRENCY):
+            result = await run_load(bot, api_url, concurrency, users, per_user)
+            results[concurrency] = result
+            print(f"concurrency {concurrency:>3}: {result['rate']:8,.1f} updates/sec  "
+                  f"p50 {result['p50']:7.1f}ms  p95 {result['p95']:7.1f}ms  "
+                  f"users answered out of order: {result['out_of_order']}")
+    finally:
+        bot.db.close()
+        shutdown_render_pool()
+        server.shutdown()
+        os.chdir(cwd)
+        workdir.cleanup()
+
+    if any(result["out_of_order"] for result in results.values()):
+        print("FAIL: a user's updates were answered out of order")
+        return 1
+    print(f"speedup: {results[UPDATE_CONCURRENCY]['rate'] / results[1]['rate']:.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    # bot.py configures INFO logging on import
+    logging.getLogger().setLevel(logging.ERROR)
+    sys.exit(asyncio.run(main(*(int(arg) for arg in sys.argv[1:]))))
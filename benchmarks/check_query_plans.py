@@ -0,0 +1,155 @@
+"""
+Run EXPLAIN QUERY PLAN on every query issued by Database and fail if a hot
+query falls back to a full table scan or a temporary sort.
+
+Every public Database method must appear in EXERCISES (or SKIPPED with a
+reason), so new queries cannot slip past the check.
+
+Run from the repository root:
+    python -m benchmarks.check_query_plans
+"""
+import inspect
+import logging
+import os
+import sys
+import tempfile
+
+from database import Database
+
+EXERCISES = {
+    "add_user": lambda db: db.add_user(1, "alice", "Alice", "A"),
+    "get_user": lambda db: db.get_user(1),
+    "_load_catalog": lambda db: db._load_catalog(),
+    "get_products": lambda db: db.get_products("games"),
+    "get_product": lambda db: db.get_product(1),
+    "get_products_page": lambda db: db.get_products_page("games", after_id=1),
+    "get_categories": lambda db: db.get_categories(),
+    "search_products": lambda db: db.search_products("windows pro"),
+    "create_order": lambda db: db.create_order(1, 1, 1, 15.99),
+    "update_order_status": lambda db: (
+        db.update_order_status(1, "completed", "txn_1"),
+        db.update_order_status(2, "failed"),
+    ),
+    "add_digital_keys": lambda db: db.add_digital_keys(1, ["PLAN-CHECK-KEY"]),
+    "get_order_keys": lambda db: db.get_order_keys(1),
+    "get_pending_orders": lambda db: db.get_pending_orders(),
+    "expire_pending_orders": lambda db: db.expire_pending_orders(0),
+    "get_user_orders": lambda db: (
+        db.get_user_orders(1),
+        db.get_user_orders(1, before_id=2),
+        db.get_user_orders(1, after_id=1),
+    ),
+    "get_all_orders": lambda db: (
+        db.get_all_orders(),
+        db.get_all_orders(before_id=2),
+        db.get_all_orders(after_id=1),
+    ),
+    "get_orders_chunk": lambda db: (
+        db.get_orders_chunk(),
+        db.get_orders_chunk(1, 100, "2024-01-01", "2024-12-31", "completed"),
+    ),
+    "get_stats": lambda db: db.get_stats(),
+    "create_broadcast": lambda db: db.create_broadcast("hello"),
+    "get_running_broadcast": lambda db: db.get_running_broadcast(),
+    "claim_broadcast_batch": lambda db: db.claim_broadcast_batch(1, 10),
+    "record_broadcast_progress": lambda db: db.record_broadcast_progress(1, 1, 0),
+    "settle_broadcast_claims": lambda db: db.settle_broadcast_claims(1),
+    "finish_broadcast": lambda db: db.finish_broadcast(1),
+    "create_topup": lambda db: db.create_topup(1, 2000),
+    "get_pending_topups": lambda db: db.get_pending_topups(),
+    "complete_topup": lambda db: db.complete_topup(1, "topup_1"),
+    "fail_topup": lambda db: db.fail_topup(1),
+    "get_wallet_balance": lambda db: db.get_wallet_balance(1),
+    "wallet_purchase": lambda db: db.wallet_purchase(1, 1),
+    "get_order_status": lambda db: db.get_order_status(1),
+    "get_order_items": lambda db: db.get_order_items(1),
+    "add_to_cart": lambda db: (db.add_to_cart(1, 1, 2, 10), db.add_to_cart(1, 2, 1, 10)),
+    "get_cart": lambda db: db.get_cart(1),
+    "remove_from_cart": lambda db: db.remove_from_cart(1, 2),
+    "checkout_cart": lambda db: db.checkout_cart(1),
+    "clear_cart": lambda db: db.clear_cart(1),
+}
+
+SKIPPED = {
+    "init_db": "startup only; schema work lives in migrations.py",
+    "get_connection": "issues no queries of its own",
+    "close": "issues no queries",
+    "rebuild_stats": "manual repair tool; recounts the base tables on purpose",
+}
+
+# (method, plan detail prefix) pairs that are scans by design
+ALLOWED = {
+    ("_load_catalog", "SCAN products"): "the catalog snapshot loads the whole table once per version",
+    ("get_all_orders", "SCAN o"): "first page walks the rowid b-tree newest first and stops at LIMIT",
+    ("search_products", "SCAN products_fts VIRTUAL TABLE"): "FTS5 index lookup of the matching rows",
+    ("search_products", "SCAN f"): "FTS5 index lookup when most of the best matches are sold out",
+    ("search_products", "USE TEMP B-TREE FOR ORDER BY"): "bm25 ranking, cached per query until product text changes",
+}
+# Releasing stock walks the batch of order ids staged in temp.releasing_orders,
+# which never holds more than one sweep's worth of rows
+for _method in ("update_order_status", "expire_pending_orders"):
+    for _prefix in ("SCAN temp.releasing_orders", "SCAN r", "USE TEMP B-TREE FOR GROUP BY"):
+        ALLOWED[(_method, _prefix)] = "bounded scan of the staged order ids"
+
+def allowed(method, detail):
+    for (allowed_method, prefix), reason in ALLOWED.items():
+        if method == allowed_method and (detail == prefix or detail.startswith(prefix + " ")):
+            return reason
+    return None
+
+def is_bad(detail):
+    if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW":
+        return True
+    return "USE TEMP B-TREE" in detail
+
+def main():
+    public = {
+        name for name, _ in inspect.getmembers(Database, inspect.isfunction)
+        if not name.startswith("_")
+    }
+    missing = sorted(public - set(EXERCISES) - set(SKIPPED))
+    if missing:
+        print(f"FAIL: no plan check for Database methods: {', '.join(missing)}")
+        return 1
+    
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "plans.db"))
+        conn = db.get_connection()
+        # Seed one row of each kind so every exercise runs its real queries
+        db.add_user(1, "alice", "Alice", "A")
+        db.create_order(1, 1, 1, 15.99)
+        db.create_order(1, 1, 1, 15.99)
+        
+        for method, exercise in EXERCISES.items():
+            # Warm the catalog so only the method's own queries are traced
+            db.catalog.snapshot()
+            statements = []
+            conn.set_trace_callback(statements.append)
+            exercise(db)
+            conn.set_trace_callback(None)
+            
+            for sql in statements:
+                if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")):
+                    continue
+                for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                    detail = row[-1]
+                    if not is_bad(detail):
+                        continue
+                    reason = allowed(method, detail)
+                    if reason:
+                        print(f"ok   {method:22} {detail}  ({reason})")
+                        continue
+                    failures.append((method, detail, " ".join(sql.split())))
+        db.close()
+    
+    for method, detail, sql in failures:
+        print(f"FAIL {method:22} {detail}\n     {sql}")
+    if failures:
+        return 1
+    print(f"OK: {len(EXERCISES)} methods checked, no unexpected scans")
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main())
@@ -1,20 +1,47 @@
+# Handler annotations name telegram types; keep them unevaluated so this module
+# still imports, and reports the missing packages, without python-telegram-bot
+from __future__ import annotations
+
 import logging
 import sqlite3
-import os
-import asyncio
 from datetime import datetime
 
 try:
-    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+    from telegram import (
+        Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent,
+    )
+    from telegram.ext import (
+        Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, filters, ContextTypes,
+    )
+    from telegram.helpers import escape_markdown
+    from update_processor import PerUserUpdateProcessor
     TELEGRAM_AVAILABLE = True
 except ImportError as e:
     print("Error: Required packages not installed. Please run: python setup.py")
     TELEGRAM_AVAILABLE = False
 
-from config import BOT_TOKEN, ADMIN_USERNAME, ADMIN_PASSWORD
-from database import Database
-from khqr import MockKHQRPayment
+from config import (
+    BOT_TOKEN, ADMIN_USERNAME, ADMIN_PASSWORD, DATABASE_NAME, DB_MAX_WORKERS, RENDER_CACHE_SIZE,
+    PRODUCTS_PAGE_SIZE, ORDERS_PAGE_SIZE, PAYMENT_POLL_INITIAL_DELAY, PAYMENT_POLL_MIN_INTERVAL,
+    PAYMENT_POLL_MAX_INTERVAL, PAYMENT_TIMEOUT, PAYMENT_POLL_BATCH_SIZE, PAYMENT_POLL_CONCURRENCY,
+    ORDER_TTL, ORDER_SWEEP_INTERVAL, ORDER_SWEEP_BATCH_SIZE, UPDATE_CONCURRENCY,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_CONCURRENCY,
+    ADMIN_DIGEST_THRESHOLD, ADMIN_DIGEST_INTERVAL, BROADCAST_RATE, BROADCAST_BATCH_SIZE,
+    METRICS_HOST, METRICS_PORT, WALLET_TOPUP_AMOUNTS, MAX_ORDER_QUANTITY, SEARCH_RESULTS_LIMIT,
+    INLINE_CACHE_TIME, EXPORT_CHUNK_SIZE, EXPORT_SPOOL_SIZE, EXPORT_PART_SIZE,
+)
+from database import Database, ORDER_MISSING
+from async_database import AsyncDatabase
+from render_cache import RenderCache
+from payment_poller import PaymentPoller
+from order_sweeper import OrderSweeper
+from message_dispatcher import MessageDispatcher, ADMIN
+from broadcaster import Broadcaster
+from callback_router import CallbackRouter
+from orders_export import export_orders, spool_bytes, TELEGRAM_DOCUMENT_LIMIT
+from khqr import MockKHQRPayment, shutdown_render_pool
+import metrics
 
 # Set up logging
 logging.basicConfig(
@@ -29,34 +56,95 @@ class JomNenhBot:
             logger.error("Telegram packages not installed.")
             return
             
-        self.db = Database()
+        self.db = AsyncDatabase(Database(DATABASE_NAME), max_workers=DB_MAX_WORKERS)
         self.khqr = MockKHQRPayment()
+        self.views = RenderCache(maxsize=RENDER_CACHE_SIZE)
+        self.metrics_server = None
+        self.callbacks = CallbackRouter()
+        self.setup_callback_routes()
+        self.poller = PaymentPoller(
+            self.db, self.khqr, on_paid=self.deliver_order, on_failed=self.fail_order,
+            initial_delay=PAYMENT_POLL_INITIAL_DELAY, min_interval=PAYMENT_POLL_MIN_INTERVAL,
+            max_interval=PAYMENT_POLL_MAX_INTERVAL, timeout=PAYMENT_TIMEOUT,
+            batch_size=PAYMENT_POLL_BATCH_SIZE, concurrency=PAYMENT_POLL_CONCURRENCY,
+        )
+        # Wallet top-ups are KHQR bills too, polled from their own table
+        self.topup_poller = PaymentPoller(
+            self.db, self.khqr, on_paid=self.credit_topup, on_failed=self.fail_topup,
+            initial_delay=PAYMENT_POLL_INITIAL_DELAY, min_interval=PAYMENT_POLL_MIN_INTERVAL,
+            max_interval=PAYMENT_POLL_MAX_INTERVAL, timeout=PAYMENT_TIMEOUT,
+            batch_size=PAYMENT_POLL_BATCH_SIZE, concurrency=PAYMENT_POLL_CONCURRENCY,
+            load_pending=self.db.get_pending_topups, txn_prefix="topup_",
+        )
+        self.sweeper = OrderSweeper(
+            self.db, ttl=ORDER_TTL, interval=ORDER_SWEEP_INTERVAL,
+            batch_size=ORDER_SWEEP_BATCH_SIZE, on_expired=self.poller.discard,
+        )
+        self.outbox = MessageDispatcher(
+            ADMIN_USERNAME, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE,
+            chat_burst=OUTBOX_CHAT_BURST, concurrency=OUTBOX_CONCURRENCY,
+            digest_threshold=ADMIN_DIGEST_THRESHOLD, digest_interval=ADMIN_DIGEST_INTERVAL,
+        )
+        self.broadcaster = Broadcaster(
+            self.db, self.outbox, rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE,
+            on_finished=self.broadcast_finished,
+        )
         
         try:
-            self.app = Application.builder().token(BOT_TOKEN).build()
-            self.setup_handlers()
+            self.app = self.build_application(Application.builder().token(BOT_TOKEN))
             logger.info("Bot initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize bot: {e}")
     
+    def build_application(self, builder, concurrency=UPDATE_CONCURRENCY):
+        """Finish `builder` with this bot's lifecycle hooks, update processor and handlers"""
+        app = (
+            builder
+            .concurrent_updates(PerUserUpdateProcessor(concurrency))
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+        self.app = app
+        self.setup_handlers()
+        return app
+    
     def setup_handlers(self):
         # Command handlers
         self.app.add_handler(CommandHandler("start", self.start))
         self.app.add_handler(CommandHandler("account", self.account))
         self.app.add_handler(CommandHandler("products", self.show_products))
         self.app.add_handler(CommandHandler("orders", self.show_orders))
+        self.app.add_handler(CommandHandler("cart", self.show_cart))
+        self.app.add_handler(CommandHandler("search", self.search))
         self.app.add_handler(CommandHandler("admin", self.admin_login))
+        self.app.add_handler(CommandHandler("rebuild_stats", self.admin_rebuild_stats))
+        self.app.add_handler(CommandHandler("broadcast", self.admin_broadcast))
+        self.app.add_handler(CommandHandler("broadcast_status", self.admin_broadcast_status))
+        self.app.add_handler(CommandHandler("broadcast_cancel", self.admin_broadcast_cancel))
+        self.app.add_handler(CommandHandler("export_orders", self.admin_export_orders))
         self.app.add_handler(CommandHandler("help", self.help_command))
         
         # Callback query handlers
         self.app.add_handler(CallbackQueryHandler(self.button_handler))
         
+        # Inline mode: "@bot <words>" from any chat
+        self.app.add_handler(InlineQueryHandler(self.inline_search))
+        
         # Message handlers
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        await self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        
+        # Deep link from an inline search result: t.me/<bot>?start=buy_<id>
+        if context.args and context.args[0].startswith("buy_") and context.args[0][4:].isdigit():
+            product = await self.db.get_product(int(context.args[0][4:]))
+            if product and product[5] > 0:
+                text, reply_markup = self.render_purchase(product, 1)
+                await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+                return
         
         welcome_text = f"""
 👋 Welcome {user.first_name} to *JomNenh Bot*!
@@ -65,6 +153,8 @@ class JomNenhBot:
 /account - View your account
 /products - Browse products  
 /orders - View your orders
+/cart - View your cart
+/search - Find a product
 /admin - Admin access
 /help - Get help
 
@@ -84,6 +174,7 @@ _Start shopping by clicking the button below!_
             [InlineKeyboardButton("🛍️ Browse Products", callback_data="view_products")],
             [InlineKeyboardButton("👤 My Account", callback_data="my_account")],
             [InlineKeyboardButton("📦 My Orders", callback_data="my_orders")],
+            [InlineKeyboardButton("🛒 My Cart", callback_data="cart_view")],
             [InlineKeyboardButton("ℹ️ Help", callback_data="help")],
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -99,14 +190,16 @@ _Start shopping by clicking the button below!_
 /account - View your account info  
 /products - Browse available products
 /orders - View your order history
+/cart - View your cart and check out
+/search <words> - Search products (or type @botname <words> in any chat)
 /admin - Admin login
 /help - Show this help message
 
 *How to Buy:*
 1. Click "Browse Products"
 2. Choose a category
-3. Select a product
-4. Confirm purchase
+3. Select a product and quantity
+4. Confirm purchase (or add to cart and check out once)
 5. Scan KHQR to pay
 6. Receive product instantly!
 
@@ -117,35 +210,46 @@ For issues, contact @tephh
     
     async def account(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user.id,))
-        user_data = cursor.fetchone()
-        conn.close()
+        user_data = await self.db.get_user(user.id)
         
         if user_data:
+            balance_cents = await self.db.get_wallet_balance(user.id)
             account_text = f"""
 👤 *Account Information*
 
 🆔 *User ID:* `{user_data[0]}`
 👤 *Name:* {user_data[2]} {user_data[3]}
 📛 *Username:* @{user_data[1] or 'N/A'}
-💰 *Balance:* ${user_data[4]:.2f}
+💰 *Wallet Balance:* ${balance_cents / 100:.2f}
 📅 *Member since:* {user_data[5][:10]}
             """
-            await update.message.reply_text(account_text, parse_mode='Markdown')
+            keyboard = [[InlineKeyboardButton("➕ Top up wallet", callback_data="wallet_topup")]]
+            await update.effective_message.reply_text(
+                account_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+            )
         else:
-            await update.message.reply_text("❌ Account not found!")
+            await update.effective_message.reply_text("❌ Account not found!")
     
-    async def show_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        products = self.db.get_products()
+    async def cached_view(self, key, render):
+        """
+        Return the (text, reply_markup) for a catalog view, rendering it only
+        when the catalog has changed since it was last built
+        """
+        # Read the version before the products so a concurrent change
+        # can only make the entry stale, never wrong
+        version = self.db.catalog_version
+        view = self.views.get(key, version)
+        if view is None:
+            view = await render()
+            self.views.put(key, version, view)
+        return view
+    
+    async def render_categories(self):
+        categories = await self.db.get_categories()
         
-        if not products:
-            await update.message.reply_text("📭 No products available at the moment.")
-            return
+        if not categories:
+            return "📭 No products available at the moment.", None
         
-        # Show categories first
-        categories = set([product[4] for product in products])
         keyboard = []
         
         for category in categories:
@@ -156,46 +260,79 @@ For issues, contact @tephh
         
         keyboard.append([InlineKeyboardButton("🔍 View All Products", callback_data="view_all_products")])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("📦 *Choose a category:*", reply_markup=reply_markup, parse_mode='Markdown')
+        return "📦 *Choose a category:*", InlineKeyboardMarkup(keyboard)
     
-    async def show_products_by_category(self, query, category):
-        products = self.db.get_products(category)
+    async def show_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Show categories first
+        text, reply_markup = await self.cached_view(("categories",), self.render_categories)
         
-        if not products:
-            await query.edit_message_text(f"📭 No products in *{category}* category.", parse_mode='Markdown')
+        if reply_markup is None:
+            await update.message.reply_text(text)
             return
         
-        text = f"📦 *Products - {category.title()}*\n\n"
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    def page_buttons(self, has_prev, prev_data, has_next, next_data):
+        """Prev/Next row for a keyset-paginated view (empty when there is one page)"""
+        row = []
+        if has_prev:
+            row.append(InlineKeyboardButton("⬅️ Prev", callback_data=prev_data))
+        if has_next:
+            row.append(InlineKeyboardButton("Next ➡️", callback_data=next_data))
+        return row
+    
+    async def render_category(self, category, after_id=None, before_id=None):
+        products, has_prev, has_next = await self.db.get_products_page(
+            category, after_id, before_id, PRODUCTS_PAGE_SIZE
+        )
+        
+        if not products:
+            return f"📭 No products in *{category}* category.", None
+        
+        parts = [f"📦 *Products - {category.title()}*\n\n"]
         keyboard = []
         
         for product in products:
-            text += f"""
+            parts.append(f"""
 🆔 *#{product[0]}*
 📛 *Name:* {product[1]}
 📝 *Description:* {product[2]}
 💰 *Price:* ${product[3]:.2f}
 📊 *Stock:* {product[5]}
 ────────────────────
-            """
+            """)
             keyboard.append([InlineKeyboardButton(
                 f"🛒 Buy {product[1]} - ${product[3]:.2f}", 
                 callback_data=f"buy_{product[0]}"
             )])
         
+        nav = self.page_buttons(
+            has_prev, f"products_prev_{products[0][0]}_{category}",
+            has_next, f"products_next_{products[-1][0]}_{category}",
+        )
+        if nav:
+            keyboard.append(nav)
         keyboard.append([InlineKeyboardButton("🔙 Back to Categories", callback_data="view_products")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
         
+        return "".join(parts), InlineKeyboardMarkup(keyboard)
+    
+    async def show_products_by_category(self, query, category, after_id=None, before_id=None):
+        text, reply_markup = await self.cached_view(
+            ("category", category, after_id, before_id),
+            lambda: self.render_category(category, after_id, before_id)
+        )
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
-    async def show_all_products(self, query):
-        products = self.db.get_products()
+    async def render_all_products(self, after_id=None, before_id=None):
+        products, has_prev, has_next = await self.db.get_products_page(
+            None, after_id, before_id, PRODUCTS_PAGE_SIZE
+        )
         
-        text = "📦 *All Products*\n\n"
+        parts = ["📦 *All Products*\n\n"]
         keyboard = []
         
         for product in products:
-            text += f"""
+            parts.append(f"""
 🆔 *#{product[0]}*
 📛 *Name:* {product[1]}
 📝 *Description:* {product[2]}
@@ -203,19 +340,32 @@ For issues, contact @tephh
 📁 *Category:* {product[4]}
 📊 *Stock:* {product[5]}
 ────────────────────
-            """
+            """)
             keyboard.append([InlineKeyboardButton(
                 f"🛒 Buy {product[1]}", 
                 callback_data=f"buy_{product[0]}"
             )])
         
+        if products:
+            nav = self.page_buttons(
+                has_prev, f"products_prev_{products[0][0]}_",
+                has_next, f"products_next_{products[-1][0]}_",
+            )
+            if nav:
+                keyboard.append(nav)
         keyboard.append([InlineKeyboardButton("🔙 Back to Categories", callback_data="view_products")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
         
+        return "".join(parts), InlineKeyboardMarkup(keyboard)
+    
+    async def show_all_products(self, query, after_id=None, before_id=None):
+        text, reply_markup = await self.cached_view(
+            ("all_products", after_id, before_id),
+            lambda: self.render_all_products(after_id, before_id)
+        )
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
-    async def initiate_purchase(self, query, product_id):
-        product = self.db.get_product(product_id)
+    async def initiate_purchase(self, query, product_id, quantity=1):
+        product = await self.db.get_product(product_id)
         
         if not product:
             await query.edit_message_text("❌ Product not found!")
@@ -225,6 +375,13 @@ For issues, contact @tephh
             await query.edit_message_text("❌ This product is out of stock!")
             return
         
+        text, reply_markup = self.render_purchase(product, quantity)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    def render_purchase(self, product, quantity):
+        """Confirmation page for an in-stock product, with the quantity clamped to what can be bought"""
+        product_id = product[0]
+        quantity = max(1, min(quantity, product[5], MAX_ORDER_QUANTITY))
         text = f"""
 🛒 *Confirm Purchase*
 
@@ -232,23 +389,79 @@ For issues, contact @tephh
 📝 *Description:* {product[2]}
 💰 *Price:* ${product[3]:.2f}
 📦 *Stock:* {product[5]}
+🔢 *Quantity:* {quantity}
+💵 *Total:* ${product[3] * quantity:.2f}
 
 💳 *Payment Method:* KHQR Bakong
 🇰🇭 *Supported Banks:* All Cambodian Banks
 
-Click *Confirm Purchase* to generate KHQR code.
+Click *Confirm Purchase* to generate KHQR code, or pay instantly from your wallet.
         """
         
+        steps = []
+        if quantity > 1:
+            steps.append(InlineKeyboardButton("➖", callback_data=f"buy_qty_{product_id}_{quantity - 1}"))
+        if quantity < min(product[5], MAX_ORDER_QUANTITY):
+            steps.append(InlineKeyboardButton("➕", callback_data=f"buy_qty_{product_id}_{quantity + 1}"))
         keyboard = [
-            [InlineKeyboardButton("✅ Confirm Purchase", callback_data=f"confirm_buy_{product_id}")],
+            [InlineKeyboardButton("✅ Confirm Purchase", callback_data=f"confirm_buy_qty_{product_id}_{quantity}")],
+            [InlineKeyboardButton("💰 Pay with Wallet", callback_data=f"wallet_buy_{product_id}_{quantity}")],
+            [InlineKeyboardButton("🛒 Add to Cart", callback_data=f"cart_add_{product_id}_{quantity}")],
             [InlineKeyboardButton("🔙 Back", callback_data=f"category_{product[4]}")],
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        if steps:
+            keyboard.insert(0, steps)
+        return text, InlineKeyboardMarkup(keyboard)
+    
+    async def search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        terms = " ".join(context.args or [])
+        if not terms:
+            await update.message.reply_text("Usage: /search <words>, e.g. /search netflix")
+            return
         
-        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        products = await self.db.search_products(terms, SEARCH_RESULTS_LIMIT)
+        if not products:
+            await update.message.reply_text(f"🔍 No products match \"{terms}\".")
+            return
+        
+        parts = [f"🔍 *Results for* \"{escape_markdown(terms)}\"\n\n"]
+        keyboard = []
+        for product in products:
+            parts.append(f"🆔 *#{product[0]}* {product[1]} - ${product[3]:.2f} ({product[5]} in stock)\n")
+            keyboard.append([InlineKeyboardButton(
+                f"🛒 Buy {product[1]} - ${product[3]:.2f}",
+                callback_data=f"buy_{product[0]}"
+            )])
+        await update.message.reply_text(
+            "".join(parts), reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+        )
     
-    async def process_payment(self, query, product_id):
-        product = self.db.get_product(product_id)
+    async def inline_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer "@bot <words>" with ranked products; each result links back here to buy"""
+        inline_query = update.inline_query
+        terms = inline_query.query.strip()
+        products = await self.db.search_products(terms, SEARCH_RESULTS_LIMIT) if terms else []
+        
+        results = [
+            InlineQueryResultArticle(
+                id=str(product[0]),
+                title=f"{product[1]} - ${product[3]:.2f}",
+                description=product[2],
+                input_message_content=InputTextMessageContent(
+                    f"🛒 *{product[1]}*\n📝 {product[2]}\n💰 *Price:* ${product[3]:.2f}",
+                    parse_mode='Markdown'
+                ),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                    "🛒 Buy", url=f"https://t.me/{context.bot.username}?start=buy_{product[0]}"
+                )]]),
+            )
+            for product in products
+        ]
+        # Results are the same for everyone, so Telegram may serve them from its cache
+        await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
+    
+    async def process_payment(self, query, product_id, quantity=1):
+        product = await self.db.get_product(product_id)
         user = query.from_user
         
         if not product:
@@ -259,22 +472,32 @@ Click *Confirm Purchase* to generate KHQR code.
             await query.edit_message_text("❌ This product is out of stock!")
             return
         
+        if not 1 <= quantity <= MAX_ORDER_QUANTITY:
+            await query.edit_message_text(f"❌ You can buy 1 to {MAX_ORDER_QUANTITY} at a time.")
+            return
+        
         # Create order
-        order_id = self.db.create_order(user.id, product_id, 1, product[3])
+        total_amount = round(product[3] * 100) * quantity / 100
+        order_id = await self.db.create_order(user.id, product_id, quantity, total_amount)
         
         if not order_id:
-            await query.edit_message_text("❌ Error creating order. Please try again.")
+            await query.edit_message_text("❌ Could not reserve this product, it may have just sold out. Please try again.")
             return
         
-        # Generate KHQR
-        qr_filename, qr_data = self.khqr.generate_payment_qr(product[3], order_id)
+        label = f"{product[1]} x{quantity}" if quantity > 1 else product[1]
+        await self.send_payment_qr(query, user, order_id, product_id, label, total_amount)
+    
+    async def send_payment_qr(self, query, user, order_id, product_id, label, total_amount):
+        """Send the KHQR for a freshly created order and hand it to the payment poller"""
+        # Generate KHQR (rendered off the event loop, kept in memory)
+        qr_image, qr_data = await self.khqr.generate_payment_qr_async(total_amount, order_id)
         
-        if qr_filename and os.path.exists(qr_filename):
+        if qr_image:
             text = f"""
 💳 *Payment Required*
 
-📦 *Product:* {product[1]}
-💰 *Amount:* ${product[3]:.2f}
+📦 *Product:* {label}
+💰 *Amount:* ${total_amount:.2f}
 🆔 *Order:* #{order_id}
 
 📱 *Please scan the KHQR code below to pay using Bakong:*
@@ -284,33 +507,30 @@ Click *Confirm Purchase* to generate KHQR code.
             """
             
             try:
-                with open(qr_filename, 'rb') as qr_file:
-                    await query.message.reply_photo(
-                        photo=qr_file,
-                        caption=text,
-                        parse_mode='Markdown'
-                    )
-                
-                # Clean up QR file
-                os.remove(qr_filename)
+                await query.message.reply_photo(
+                    photo=qr_image,
+                    caption=text,
+                    parse_mode='Markdown'
+                )
                 
                 # Notify admin
                 admin_text = f"""
 🆕 *New Order Created*
 
 👤 *Customer:* {user.first_name} (@{user.username})
-📦 *Product:* {product[1]}
-💰 *Amount:* ${product[3]:.2f}
+📦 *Product:* {label}
+💰 *Amount:* ${total_amount:.2f}
 🆔 *Order:* #{order_id}
 📊 *Status:* Pending Payment
                 """
-                try:
-                    await self.app.bot.send_message(ADMIN_USERNAME, admin_text, parse_mode='Markdown')
-                except Exception as e:
-                    logger.error(f"Could not notify admin: {e}")
+                self.outbox.notify_admin(
+                    "🆕 New orders", admin_text,
+                    f"🆕 #{order_id} {label} ${total_amount:.2f} - {user.first_name}",
+                    parse_mode='Markdown'
+                )
                 
-                # Start payment verification
-                asyncio.create_task(self.check_payment_status(order_id, product, user))
+                # Hand the order to the payment poller
+                self.poller.add(order_id, user.id, product_id, total_amount)
                 
             except Exception as e:
                 logger.error(f"Error sending QR code: {e}")
@@ -318,25 +538,39 @@ Click *Confirm Purchase* to generate KHQR code.
         else:
             await query.edit_message_text("❌ Error generating payment QR code!")
     
-    async def check_payment_status(self, order_id, product, user):
-        # Simulate payment processing delay
-        await asyncio.sleep(10)
+    def order_label(self, items):
+        """One line per order item, e.g. "Netflix Premium x2" """
+        return "\n".join(f"{name} x{quantity}" if quantity > 1 else name for _, name, quantity, _ in items)
+    
+    async def deliver_order(self, payment, payment_result):
+        """Payment poller callback: mark the order paid and deliver every line in one message"""
+        order_id = payment.order_id
+        items = await self.db.get_order_items(order_id)
+        customer = await self.db.get_user(payment.user_id)
+        first_name, username = (customer[2], customer[1]) if customer else (payment.user_id, None)
         
-        # Verify payment (mock - replace with real verification)
-        payment_result = self.khqr.verify_payment(f"txn_{order_id}")
+        label = self.order_label(items) or str(payment.product_id)
+        summary = ", ".join(label.splitlines())
+        if not await self.db.update_order_status(order_id, 'completed', f"txn_{order_id}"):
+            status = await self.db.get_order_status(order_id)
+            if status in (None, 'pending'):
+                raise RuntimeError(f"could not mark order {order_id} completed")
+            if status != 'completed':
+                # A deleted order is settled too: refund it and stop tracking it
+                status = 'deleted' if status == ORDER_MISSING else status
+                self.paid_after_release(payment, status, label, summary, first_name, username)
+            return
         
-        if payment_result and payment_result.get('status') == 'success':
-            self.db.update_order_status(order_id, 'completed', f"txn_{order_id}")
-            
-            # Send product to user
-            if product[6]:  # is_digital
-                digital_key = self.db.get_digital_key(product[0])
-                delivery_text = f"""
+        # Send product to user
+        keys = await self.db.get_order_keys(order_id)
+        if keys:
+            digital_key = "\n".join(keys)
+            delivery_text = f"""
 🎉 *Payment Successful!*
 
-📦 *Product:* {product[1]}
+📦 *Product:* {label}
 🆔 *Order:* #{order_id}
-💰 *Amount:* ${product[3]:.2f}
+💰 *Amount:* ${payment.total_amount:.2f}
 
 🔑 *Your Key:* 
 `{digital_key}`
@@ -346,58 +580,322 @@ Click *Confirm Purchase* to generate KHQR code.
 📧 *Support:* Contact @tephh for issues.
 
 Thank you for your purchase! 🙏
-                """
-                await self.app.bot.send_message(user.id, delivery_text, parse_mode='Markdown')
-            
-            # Notify admin
-            admin_text = f"""
+            """
+            self.outbox.send(payment.user_id, delivery_text, parse_mode='Markdown')
+        
+        # Notify admin
+        admin_text = f"""
 ✅ *Order Completed*
 
-👤 *Customer:* {user.first_name} (@{user.username})
-📦 *Product:* {product[1]}
-💰 *Amount:* ${product[3]:.2f}
+👤 *Customer:* {first_name} (@{username})
+📦 *Product:* {label}
+💰 *Amount:* ${payment.total_amount:.2f}
 🆔 *Order:* #{order_id}
 🔑 *Key Delivered:* Yes
-            """
-            try:
-                await self.app.bot.send_message(ADMIN_USERNAME, admin_text, parse_mode='Markdown')
-            except Exception as e:
-                logger.error(f"Could not notify admin: {e}")
-                
-        else:
-            self.db.update_order_status(order_id, 'failed')
-            fail_text = f"""
+        """
+        self.outbox.notify_admin(
+            "✅ Completed orders", admin_text,
+            f"✅ #{order_id} {summary} ${payment.total_amount:.2f} - {first_name}",
+            parse_mode='Markdown'
+        )
+    
+    def paid_after_release(self, payment, status, label, summary, first_name, username):
+        """
+        The payment for an order arrived after the order was settled another way,
+        e.g. expired by the sweeper, so its stock is gone: refund, don't deliver
+        """
+        order_id = payment.order_id
+        logger.warning(f"Order {order_id} was paid after it was marked {status}")
+        self.outbox.send(payment.user_id, f"""
+⚠️ *Payment Received Late*
+
+🆔 *Order:* #{order_id}
+📦 *Product:* {label}
+💰 *Amount:* ${payment.total_amount:.2f}
+
+This order was already {status} when your payment arrived, so nothing was delivered.
+Your payment will be refunded; contact @tephh if you have questions.
+        """, parse_mode='Markdown')
+        admin_text = f"""
+⚠️ *Refund Needed*
+
+👤 *Customer:* {first_name} (@{username})
+📦 *Product:* {label}
+💰 *Amount:* ${payment.total_amount:.2f}
+🆔 *Order:* #{order_id} ({status} before payment arrived)
+🔑 *Key Delivered:* No
+        """
+        self.outbox.notify_admin(
+            "⚠️ Refunds needed", admin_text,
+            f"⚠️ #{order_id} {summary} ${payment.total_amount:.2f} - {first_name} ({status})",
+            parse_mode='Markdown'
+        )
+    
+    async def fail_order(self, payment):
+        """Payment poller callback: the payment failed or timed out"""
+        order_id = payment.order_id
+        items = await self.db.get_order_items(order_id)
+        if not await self.db.update_order_status(order_id, 'failed'):
+            if await self.db.get_order_status(order_id) in (None, 'pending'):
+                raise RuntimeError(f"could not mark order {order_id} failed")
+            # Already settled, e.g. expired by the sweeper, or deleted:
+            # nothing left to tell the buyer
+            return
+        
+        fail_text = f"""
 ❌ *Payment Failed*
 
 🆔 *Order:* #{order_id}
-📦 *Product:* {product[1]}
+📦 *Product:* {self.order_label(items) or payment.product_id}
 
 Please try again or contact support @tephh if you have paid.
+        """
+        self.outbox.send(payment.user_id, fail_text, parse_mode='Markdown')
+    
+    async def wallet_purchase(self, query, product_id, quantity=1):
+        """Buy from the wallet balance: no QR and no polling, the keys come straight back"""
+        user = query.from_user
+        if not 1 <= quantity <= MAX_ORDER_QUANTITY:
+            await query.edit_message_text(f"❌ You can buy 1 to {MAX_ORDER_QUANTITY} at a time.")
+            return
+        order_id, error = await self.db.wallet_purchase(user.id, product_id, quantity)
+        
+        if error == "insufficient_funds":
+            keyboard = [[InlineKeyboardButton("➕ Top up wallet", callback_data="wallet_topup")]]
+            await query.edit_message_text(
+                "❌ Not enough balance in your wallet. Top up and try again.",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        if error == "not_found":
+            await query.edit_message_text("❌ Product not found!")
+            return
+        if error == "out_of_stock":
+            await query.edit_message_text("❌ This product is out of stock!")
+            return
+        if error:
+            await query.edit_message_text("❌ Error processing payment. Please try again.")
+            return
+        
+        product = await self.db.get_product(product_id)
+        balance_cents = await self.db.get_wallet_balance(user.id)
+        label = f"{product[1]} x{quantity}" if quantity > 1 else product[1]
+        amount = round(product[3] * 100) * quantity / 100
+        delivery_text = f"""
+🎉 *Purchase Successful!*
+
+📦 *Product:* {label}
+🆔 *Order:* #{order_id}
+💰 *Paid from wallet:* ${amount:.2f}
+👛 *Balance left:* ${balance_cents / 100:.2f}
+        """
+        if product[6]:  # is_digital
+            digital_key = "\n".join(await self.db.get_order_keys(order_id))
+            delivery_text += f"""
+🔑 *Your Key:* 
+`{digital_key}`
+
+💾 *Instructions:* Use this key to activate your product.
             """
-            await self.app.bot.send_message(user.id, fail_text, parse_mode='Markdown')
+        await query.edit_message_text(delivery_text, parse_mode='Markdown')
+        
+        admin_text = f"""
+✅ *Order Completed (Wallet)*
+
+👤 *Customer:* {user.first_name} (@{user.username})
+📦 *Product:* {label}
+💰 *Amount:* ${amount:.2f}
+🆔 *Order:* #{order_id}
+        """
+        self.outbox.notify_admin(
+            "✅ Completed orders", admin_text,
+            f"✅ #{order_id} {label} ${amount:.2f} (wallet) - {user.first_name}",
+            parse_mode='Markdown'
+        )
     
-    async def show_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user = update.effective_user
-        orders = self.db.get_user_orders(user.id)
+    async def show_topup_amounts(self, query):
+        keyboard = [
+            [InlineKeyboardButton(f"💵 ${amount}", callback_data=f"wallet_topup_{amount * 100}")]
+            for amount in WALLET_TOPUP_AMOUNTS
+        ]
+        await query.edit_message_text(
+            "➕ *Top up wallet*\n\nChoose an amount to pay by KHQR:",
+            reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+        )
+    
+    async def start_topup(self, query, amount_cents):
+        if amount_cents // 100 not in WALLET_TOPUP_AMOUNTS or amount_cents % 100:
+            await query.edit_message_text("❌ Unsupported top-up amount.")
+            return
         
-        if not orders:
-            await update.message.reply_text("📭 You have no orders yet.")
+        user = query.from_user
+        await self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        topup_id = await self.db.create_topup(user.id, amount_cents)
+        if not topup_id:
+            await query.edit_message_text("❌ Error processing payment. Please try again.")
             return
         
-        orders_text = "📦 *Your Orders:*\n\n"
+        amount = amount_cents / 100
+        # "T" keeps top-up bill numbers apart from order ids
+        qr_image, qr_data = await self.khqr.generate_payment_qr_async(amount, f"T{topup_id}")
+        if not qr_image:
+            await query.edit_message_text("❌ Error generating payment QR code!")
+            return
+        
+        text = f"""
+💳 *Wallet Top-up*
+
+💰 *Amount:* ${amount:.2f}
+🆔 *Top-up:* #{topup_id}
+
+📱 *Please scan the KHQR code below to pay using Bakong.*
+💡 *Your balance is credited automatically once the payment arrives.*
+        """
+        try:
+            await query.message.reply_photo(photo=qr_image, caption=text, parse_mode='Markdown')
+            self.topup_poller.add(topup_id, user.id, None, amount)
+        except Exception as e:
+            logger.error(f"Error sending top-up QR code: {e}")
+            await query.edit_message_text("❌ Error processing payment. Please try again.")
+    
+    async def credit_topup(self, payment, payment_result):
+        """Top-up poller callback: credit the wallet"""
+        balance_cents = await self.db.complete_topup(payment.order_id, f"topup_{payment.order_id}")
+        if balance_cents is None:
+            raise RuntimeError(f"could not credit top-up {payment.order_id}")
+        
+        self.outbox.send(
+            payment.user_id,
+            f"✅ *Wallet topped up!*\n\n💰 *Added:* ${payment.total_amount:.2f}\n"
+            f"👛 *Balance:* ${balance_cents / 100:.2f}",
+            parse_mode='Markdown'
+        )
+        self.outbox.notify_admin(
+            "💰 Wallet top-ups",
+            f"💰 *Wallet Top-up*\n\n👤 *User:* {payment.user_id}\n💵 *Amount:* ${payment.total_amount:.2f}",
+            f"💰 top-up #{payment.order_id} ${payment.total_amount:.2f} - {payment.user_id}",
+            parse_mode='Markdown'
+        )
+    
+    async def fail_topup(self, payment):
+        """Top-up poller callback: the payment failed or timed out"""
+        if not await self.db.fail_topup(payment.order_id):
+            raise RuntimeError(f"could not mark top-up {payment.order_id} failed")
+        self.outbox.send(
+            payment.user_id,
+            f"❌ *Top-up #{payment.order_id} was not paid.*\n\nPlease try again or contact support @tephh if you have paid.",
+            parse_mode='Markdown'
+        )
+    
+    async def render_cart(self, user_id):
+        cart = await self.db.get_cart(user_id)
+        if not cart:
+            return "🛒 Your cart is empty.", InlineKeyboardMarkup(
+                [[InlineKeyboardButton("🛍️ Browse Products", callback_data="view_products")]]
+            )
+        
+        parts = ["🛒 *Your Cart:*\n\n"]
+        keyboard = []
+        total_cents = 0
+        for product_id, name, price, quantity, stock in cart:
+            total_cents += round(price * 100) * quantity
+            warning = f" ⚠️ only {stock} left" if stock < quantity else ""
+            parts.append(f"📦 {name} x{quantity} - ${price * quantity:.2f}{warning}\n")
+            keyboard.append([InlineKeyboardButton(f"❌ Remove {name}", callback_data=f"cart_remove_{product_id}")])
+        parts.append(f"\n💵 *Total:* ${total_cents / 100:.2f}")
+        
+        keyboard.append([InlineKeyboardButton("✅ Checkout (KHQR)", callback_data="cart_checkout")])
+        keyboard.append([InlineKeyboardButton("🗑 Clear Cart", callback_data="cart_clear")])
+        return "".join(parts), InlineKeyboardMarkup(keyboard)
+    
+    async def show_cart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text, reply_markup = await self.render_cart(update.effective_user.id)
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def cart_add(self, query, product_id, quantity):
+        user = query.from_user
+        await self.db.add_user(user.id, user.username, user.first_name, user.last_name)
+        added = 1 <= quantity <= MAX_ORDER_QUANTITY and await self.db.add_to_cart(
+            user.id, product_id, quantity, MAX_ORDER_QUANTITY
+        )
+        text, reply_markup = await self.render_cart(user.id)
+        if not added:
+            text = f"❌ A cart holds at most {MAX_ORDER_QUANTITY} items.\n\n" + text
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def cart_remove(self, query, product_id):
+        await self.db.remove_from_cart(query.from_user.id, product_id)
+        text, reply_markup = await self.render_cart(query.from_user.id)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def cart_clear(self, query):
+        await self.db.clear_cart(query.from_user.id)
+        text, reply_markup = await self.render_cart(query.from_user.id)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def cart_checkout(self, query):
+        """The whole cart becomes one order: one reservation, one KHQR, one delivery"""
+        user = query.from_user
+        order_id, total_amount, error = await self.db.checkout_cart(user.id)
+        
+        if error == "empty":
+            await query.edit_message_text("🛒 Your cart is empty.")
+            return
+        if error == "out_of_stock":
+            text, reply_markup = await self.render_cart(user.id)
+            await query.edit_message_text(
+                "❌ Some items no longer have enough stock. Please adjust your cart.\n\n" + text,
+                reply_markup=reply_markup, parse_mode='Markdown'
+            )
+            return
+        if error:
+            await query.edit_message_text("❌ Error processing payment. Please try again.")
+            return
+        
+        items = await self.db.get_order_items(order_id)
+        label = ", ".join(self.order_label(items).splitlines())
+        await self.send_payment_qr(query, user, order_id, items[0][0], label, total_amount)
+    
+    async def render_orders(self, user_id, before_id=None, after_id=None):
+        orders, has_older, has_newer = await self.db.get_user_orders(
+            user_id, before_id, after_id, ORDERS_PAGE_SIZE
+        )
+        
+        if not orders:
+            return "📭 You have no orders yet.", None
+        
+        parts = ["📦 *Your Orders:*\n\n"]
         for order in orders:
             status_emoji = "✅" if order[4] == "completed" else "⏳" if order[4] == "pending" else "❌"
-            orders_text += f"""
+            parts.append(f"""
 🆔 *Order #*{order[0]}
-📦 *Product:* {order[1]}
+📦 *Product:* {order[1]}{f" +{order[6] - 1} more" if order[6] > 1 else ""}
 🔢 *Quantity:* {order[2]}
 💰 *Amount:* ${order[3]:.2f}
 📊 *Status:* {status_emoji} {order[4]}
 📅 *Date:* {order[5][:16]}
 ────────────────────
-            """
+            """)
         
-        await update.message.reply_text(orders_text, parse_mode='Markdown')
+        # Newest first: "Prev" goes to newer orders, "Next" to older ones
+        nav = self.page_buttons(
+            has_newer, f"orders_prev_{orders[0][0]}",
+            has_older, f"orders_next_{orders[-1][0]}",
+        )
+        reply_markup = InlineKeyboardMarkup([nav]) if nav else None
+        return "".join(parts), reply_markup
+    
+    async def show_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        text, reply_markup = await self.render_orders(user.id)
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    
+    async def show_orders_page(self, query, before_id=None, after_id=None):
+        text, reply_markup = await self.render_orders(query.from_user.id, before_id, after_id)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
     async def admin_login(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.effective_user.username == ADMIN_USERNAME.replace('@', ''):
@@ -425,66 +923,75 @@ Please try again or contact support @tephh if you have paid.
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text("👨‍💼 *Admin Panel*", reply_markup=reply_markup, parse_mode='Markdown')
     
-    async def admin_view_products(self, query):
-        products = self.db.get_products()
+    async def render_admin_products(self, after_id=None, before_id=None):
+        products, has_prev, has_next = await self.db.get_products_page(
+            None, after_id, before_id, PRODUCTS_PAGE_SIZE
+        )
         
-        text = "📊 *All Products (Admin View)*\n\n"
+        parts = ["📊 *All Products (Admin View)*\n\n"]
         for product in products:
             stock_emoji = "🟢" if product[5] > 10 else "🟡" if product[5] > 0 else "🔴"
-            text += f"""
+            parts.append(f"""
 🆔 *#{product[0]}*
 📛 {product[1]}
 💰 ${product[3]:.2f}
 📦 Stock: {stock_emoji} {product[5]}
 📁 Category: {product[4]}
 ────────────────────
-            """
+            """)
         
-        await query.edit_message_text(text, parse_mode='Markdown')
+        nav = []
+        if products:
+            nav = self.page_buttons(
+                has_prev, f"admin_products_prev_{products[0][0]}",
+                has_next, f"admin_products_next_{products[-1][0]}",
+            )
+        reply_markup = InlineKeyboardMarkup([nav]) if nav else None
+        return "".join(parts), reply_markup
+    
+    async def admin_view_products(self, query, after_id=None, before_id=None):
+        text, reply_markup = await self.cached_view(
+            ("admin_products", after_id, before_id),
+            lambda: self.render_admin_products(after_id, before_id)
+        )
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
     
-    async def admin_view_orders(self, query):
-        orders = self.db.get_all_orders()
+    async def admin_view_orders(self, query, before_id=None, after_id=None):
+        orders, has_older, has_newer = await self.db.get_all_orders(before_id, after_id, ORDERS_PAGE_SIZE)
         
         if not orders:
             await query.edit_message_text("📭 No orders found.")
             return
         
-        text = "📦 *All Orders*\n\n"
+        parts = ["📦 *All Orders*\n\n"]
         for order in orders:
             status_emoji = "✅" if order[4] == "completed" else "⏳" if order[4] == "pending" else "❌"
-            text += f"""
+            parts.append(f"""
 🆔 *Order:* #{order[0]}
 👤 *User:* {order[1]}
-📦 *Product:* {order[2]}
+📦 *Product:* {order[2]}{f" +{order[6] - 1} more" if order[6] > 1 else ""}
 💰 *Amount:* ${order[3]:.2f}
 📊 *Status:* {status_emoji} {order[4]}
 📅 *Date:* {order[5][:16]}
 ────────────────────
-            """
+            """)
         
-        await query.edit_message_text(text, parse_mode='Markdown')
+        nav = self.page_buttons(
+            has_newer, f"admin_orders_prev_{orders[0][0]}",
+            has_older, f"admin_orders_next_{orders[-1][0]}",
+        )
+        reply_markup = InlineKeyboardMarkup([nav]) if nav else None
+        await query.edit_message_text("".join(parts), reply_markup=reply_markup, parse_mode='Markdown')
     
     async def admin_stats(self, query):
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        # Get total orders
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        total_orders = cursor.fetchone()[0]
-        
-        # Get completed orders
-        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed'")
-        completed_orders = cursor.fetchone()[0]
-        
-        # Get total revenue
-        cursor.execute("SELECT SUM(total_amount) FROM orders WHERE status = 'completed'")
-        total_revenue = cursor.fetchone()[0] or 0
-        
-        # Get total users
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        conn.close()
+        total_users, total_orders, completed_orders, total_revenue = await self.db.get_stats()
+        poller = self.poller.stats()
+        sweeper = self.sweeper.stats()
+        outbox = self.outbox.stats()
+        routes = "\n".join(
+            f"`{row['route']}` {row['mean_ms']:.1f}ms avg, {row['max_ms']:.0f}ms max ({row['calls']} calls)"
+            for row in self.callbacks.stats()[:3] if row['calls']
+        ) or "No button presses yet"
         
         stats_text = f"""
 📈 *Business Statistics*
@@ -495,42 +1002,244 @@ Please try again or contact support @tephh if you have paid.
 💰 *Total Revenue:* ${total_revenue:.2f}
 📊 *Success Rate:* {(completed_orders/total_orders*100) if total_orders > 0 else 0:.1f}%
 
+⏳ *Awaiting Payment:* {poller['queue_depth']} ({poller['in_flight']} checking)
+🐢 *Poller Lag:* {poller['lag_seconds']:.1f}s
+⌛ *Expired Orders:* {sweeper['expired_orders']} ({sweeper['released_units']} units restocked)
+📤 *Outbox:* {outbox['queued']} queued, {outbox['sent']} sent, {outbox['dropped']} dropped, {outbox['digested']} digested
+
+🐌 *Slowest Buttons:*
+{routes}
+
 🔄 *Last Updated:* {datetime.now().strftime('%Y-%m-%d %H:%M')}
         """
         
         await query.edit_message_text(stats_text, parse_mode='Markdown')
     
+    async def admin_rebuild_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.user_data.get('admin_logged_in'):
+            await update.message.reply_text("❌ You are not authorized to access admin panel.")
+            return
+        
+        stats = await self.db.rebuild_stats()
+        if stats is None:
+            await update.message.reply_text("❌ Could not rebuild statistics. Check the logs.")
+            return
+        
+        total_users, total_orders, completed_orders, total_revenue = stats
+        await update.message.reply_text(
+            f"🔧 *Statistics rebuilt*\n\n👥 Users: {total_users}\n📦 Orders: {total_orders}\n"
+            f"✅ Completed: {completed_orders}\n💰 Revenue: ${total_revenue:.2f}",
+            parse_mode='Markdown'
+        )
+    
+    async def admin_export_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.user_data.get('admin_logged_in'):
+            await update.message.reply_text("❌ You are not authorized to access admin panel.")
+            return
+        
+        # /export_orders [from YYYY-MM-DD] [to YYYY-MM-DD] [status] [gz], in any order
+        dates, status, compress = [], None, False
+        for arg in context.args or []:
+            date = self.parse_date(arg)
+            if date:
+                # Normalised, since created_at is compared as text
+                dates.append(date.strftime("%Y-%m-%d"))
+            elif arg in ("pending", "completed", "failed", "expired"):
+                status = arg
+            elif arg in ("gz", "gzip"):
+                compress = True
+            else:
+                await update.message.reply_text(
+                    "Usage: /export\\_orders [from YYYY-MM-DD] [to YYYY-MM-DD] "
+                    "[pending|completed|failed|expired] [gz]",
+                    parse_mode='Markdown'
+                )
+                return
+        since = dates[0] if dates else None
+        until = dates[1] if len(dates) > 1 else None
+        
+        await update.message.reply_text("⏳ Exporting orders...")
+        filters_text = ", ".join(filter(None, (
+            f"from {since}" if since else None, f"to {until}" if until else None, status,
+        ))) or "all orders"
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        extension = ".csv.gz" if compress else ".csv"
+        parts = export_orders(
+            self.db, since, until, status, compress, chunk_size=EXPORT_CHUNK_SIZE,
+            spool_size=EXPORT_SPOOL_SIZE, part_size=EXPORT_PART_SIZE,
+        )
+        part = 0
+        try:
+            # Each part is uploaded before the next is written, so memory
+            # holds one part of at most about EXPORT_PART_SIZE bytes
+            async for document, rows in parts:
+                part += 1
+                with document:
+                    size = spool_bytes(document)
+                    if size > TELEGRAM_DOCUMENT_LIMIT:
+                        await update.message.reply_text(
+                            f"❌ Part {part} of the export is {size / 1024 / 1024:.0f} MB, over "
+                            f"Telegram's 50 MB limit. Lower EXPORT_PART_SIZE."
+                        )
+                        return
+                    if part == 1:
+                        filename, caption = f"orders_{stamp}{extension}", f"📄 {rows} orders ({filters_text})"
+                    else:
+                        filename = f"orders_{stamp}_{part}{extension}"
+                        caption = f"📄 Part {part}: {rows} more orders ({filters_text})"
+                    # An upload is read into memory whole either way, and
+                    # InputFile cannot take a SpooledTemporaryFile still in
+                    # memory (its name is None), so send the part's bytes
+                    await update.message.reply_document(
+                        document=document.read(), filename=filename, caption=caption,
+                    )
+        except Exception as e:
+            logger.error(f"Orders export failed after {part} parts: {e}")
+            await update.message.reply_text("❌ Export failed. Check the logs.")
+        finally:
+            await parts.aclose()
+    
+    def parse_date(self, text):
+        try:
+            return datetime.strptime(text, "%Y-%m-%d")
+        except ValueError:
+            return None
+    
+    def broadcast_progress_text(self, progress):
+        done = progress['sent'] + progress['failed']
+        percent = done / progress['total'] * 100 if progress['total'] else 100.0
+        eta = f"{progress['eta_seconds'] / 60:.1f} min" if progress['eta_seconds'] is not None else "N/A"
+        return (
+            f"📣 *Broadcast #{progress['broadcast_id']}*"
+            f" ({'running' if progress['running'] else 'stopped'})\n\n"
+            f"📊 *Progress:* {done}/{progress['total']} ({percent:.1f}%)\n"
+            f"✅ *Sent:* {progress['sent']}\n"
+            f"❌ *Failed:* {progress['failed']}\n"
+            f"⚡ *Throughput:* {progress['rate']:.1f} msgs/sec\n"
+            f"⏳ *ETA:* {eta}"
+        )
+    
+    async def admin_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.user_data.get('admin_logged_in'):
+            await update.message.reply_text("❌ You are not authorized to access admin panel.")
+            return
+        
+        # Everything after the command, line breaks included
+        text = update.message.text.partition(" ")[2].strip()
+        if not text:
+            await update.message.reply_text("Usage: /broadcast <message>")
+            return
+        
+        broadcast_id = await self.broadcaster.begin(text)
+        if broadcast_id is None:
+            await update.message.reply_text("❌ A broadcast is already running. See /broadcast_status.")
+            return
+        
+        progress = self.broadcaster.progress()
+        await update.message.reply_text(
+            f"📣 *Broadcast #{broadcast_id} started* for {progress['total']} users.\n\n"
+            f"/broadcast\\_status - progress\n/broadcast\\_cancel - stop it",
+            parse_mode='Markdown'
+        )
+    
+    async def admin_broadcast_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.user_data.get('admin_logged_in'):
+            await update.message.reply_text("❌ You are not authorized to access admin panel.")
+            return
+        
+        progress = self.broadcaster.progress()
+        if progress is None:
+            await update.message.reply_text("📭 No broadcast since the bot started.")
+            return
+        await update.message.reply_text(self.broadcast_progress_text(progress), parse_mode='Markdown')
+    
+    async def admin_broadcast_cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not context.user_data.get('admin_logged_in'):
+            await update.message.reply_text("❌ You are not authorized to access admin panel.")
+            return
+        
+        if await self.broadcaster.cancel():
+            await update.message.reply_text(
+                self.broadcast_progress_text(self.broadcaster.progress()), parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text("📭 No broadcast is running.")
+    
+    async def broadcast_finished(self, progress):
+        """Broadcaster callback: report the final counts to the admin"""
+        self.outbox.send(
+            ADMIN_USERNAME, self.broadcast_progress_text(progress), priority=ADMIN, parse_mode='Markdown'
+        )
+    
+    def setup_callback_routes(self):
+        route = self.callbacks.add
+        route("view_products", self.show_products, with_update=True)
+        route("view_all_products", self.show_all_products)
+        route("my_account", self.account, with_update=True)
+        route("my_orders", self.show_orders, with_update=True)
+        route("help", self.help_command, with_update=True)
+        route("category_{category}", self.show_products_by_category)
+        route("buy_{product_id:int}", self.initiate_purchase)
+        route("confirm_buy_{product_id:int}", self.process_payment)
+        route("buy_qty_{product_id:int}_{quantity:int}", self.initiate_purchase)
+        route("confirm_buy_qty_{product_id:int}_{quantity:int}", self.process_payment)
+        route("wallet_buy_{product_id:int}_{quantity:int}", self.wallet_purchase)
+        route("cart_view", self.show_cart, with_update=True)
+        route("cart_add_{product_id:int}_{quantity:int}", self.cart_add)
+        route("cart_remove_{product_id:int}", self.cart_remove)
+        route("cart_clear", self.cart_clear)
+        route("cart_checkout", self.cart_checkout)
+        route("wallet_topup", self.show_topup_amounts)
+        route("wallet_topup_{amount_cents:int}", self.start_topup)
+        route("admin_view_products", self.admin_view_products)
+        route("admin_view_orders", self.admin_view_orders)
+        route("admin_stats", self.admin_stats)
+        # <cursor>_<category>; the category is empty when paging all products
+        route("products_next_{after_id:int}_{category}", self.show_products_page)
+        route("products_prev_{before_id:int}_{category}", self.show_products_page)
+        route("orders_next_{before_id:int}", self.show_orders_page)
+        route("orders_prev_{after_id:int}", self.show_orders_page)
+        route("admin_products_next_{after_id:int}", self.admin_view_products)
+        route("admin_products_prev_{before_id:int}", self.admin_view_products)
+        route("admin_orders_next_{before_id:int}", self.admin_view_orders)
+        route("admin_orders_prev_{after_id:int}", self.admin_view_orders)
+    
+    async def show_products_page(self, query, category, after_id=None, before_id=None):
+        if category:
+            await self.show_products_by_category(query, category, after_id, before_id)
+        else:
+            await self.show_all_products(query, after_id, before_id)
+    
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
-        
-        data = query.data
-        
-        if data == "view_products":
-            await self.show_products(update, context)
-        elif data == "view_all_products":
-            await self.show_all_products(query)
-        elif data == "my_account":
-            await self.account(update, context)
-        elif data == "my_orders":
-            await self.show_orders(update, context)
-        elif data == "help":
-            await self.help_command(update, context)
-        elif data.startswith("category_"):
-            category = data.replace("category_", "")
-            await self.show_products_by_category(query, category)
-        elif data.startswith("buy_"):
-            product_id = int(data.replace("buy_", ""))
-            await self.initiate_purchase(query, product_id)
-        elif data.startswith("confirm_buy_"):
-            product_id = int(data.replace("confirm_buy_", ""))
-            await self.process_payment(query, product_id)
-        elif data == "admin_view_products":
-            await self.admin_view_products(query)
-        elif data == "admin_view_orders":
-            await self.admin_view_orders(query)
-        elif data == "admin_stats":
-            await self.admin_stats(query)
+        await self.callbacks.dispatch(query.data, update, context)
+    
+    async def on_startup(self, application):
+        if METRICS_PORT:
+            try:
+                self.metrics_server = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+            except OSError as e:
+                logger.error(f"Could not start metrics server: {e}")
+        # Resume verification of orders left pending by a previous run
+        await self.poller.start()
+        await self.topup_poller.start()
+        self.sweeper.start()
+        self.outbox.start(application.bot)
+        # Carry on with a broadcast interrupted by a crash or restart
+        await self.broadcaster.start()
+    
+    async def on_shutdown(self, application):
+        await self.broadcaster.stop()
+        await self.sweeper.stop()
+        await self.poller.stop()
+        await self.topup_poller.stop()
+        # Last, so messages queued by the poller still go out
+        await self.outbox.stop()
+        await self.khqr.aclose()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
     
     def run(self):
         if not TELEGRAM_AVAILABLE:
@@ -548,9 +1257,26 @@ Please try again or contact support @tephh if you have paid.
         print("Press Ctrl+C to stop the bot.")
         
         try:
-            self.app.run_polling()
+            if WEBHOOK_URL:
+                logger.info(f"Listening for webhook updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+                self.app.run_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET or None,
+                    max_connections=UPDATE_CONCURRENCY,
+                )
+            else:
+                self.app.run_polling()
         except Exception as e:
             logger.error(f"Bot stopped with error: {e}")
+        finally:
+            shutdown_render_pool()
+            self.db.close()
+
+# Every async method is a handler or sits on a handler's path
+metrics.instrument(JomNenhBot, metrics.HANDLER, coroutines_only=True)
 
 if __name__ == "__main__":
     bot = JomNenhBot()
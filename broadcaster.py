@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+
+from message_dispatcher import BROADCAST, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class Broadcaster:
+    """
+    Sends an admin broadcast to every user.
+    Users are read in id order one keyset batch at a time, so memory stays
+    flat whatever the size of the users table. Each batch is checkpointed
+    in the broadcasts table as it is claimed (see
+    Database.claim_broadcast_batch): after a crash or restart the broadcast
+    resumes after the last claimed user and nobody is messaged twice. Users
+    the stopped run claimed but never recorded are counted as failed.
+    Messages go through the outbound dispatcher at BROADCAST priority, paced
+    to `rate` per second, so deliveries keep flowing while it runs.
+    `on_finished` receives the final progress() of every broadcast that ends.
+    """
+    def __init__(self, db, outbox, rate=20, batch_size=100, on_finished=None):
+        self.db = db
+        self.outbox = outbox
+        self.rate = rate
+        self.batch_size = batch_size
+        self.on_finished = on_finished
+        self._progress = None
+        self._stopping = False
+        self._task = None
+    
+    async def start(self):
+        """Resume the broadcast a previous run left unfinished, if any"""
+        row = await self.db.get_running_broadcast()
+        if row is not None:
+            broadcast_id, text, last_user_id, sent, failed, total = row
+            lost = await self.db.settle_broadcast_claims(broadcast_id)
+            if lost:
+                logger.warning(f"Broadcast {broadcast_id}: {lost} users claimed before the restart counted as failed")
+                failed += lost
+            logger.info(f"Resuming broadcast {broadcast_id} after user {last_user_id} ({sent + failed}/{total} done)")
+            self._launch(broadcast_id, text, sent, failed, total)
+    
+    async def stop(self, timeout=10.0):
+        """Let the batch in progress finish (up to `timeout` seconds); the rest resumes on next start"""
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._task = None
+    
+    async def begin(self, text):
+        """Start broadcasting `text`; returns the broadcast id, or None if one is already running"""
+        if self.running():
+            return None
+        broadcast_id = await self.db.create_broadcast(text)
+        if broadcast_id is None:
+            return None
+        row = await self.db.get_running_broadcast()
+        total = row[5] if row else 0
+        logger.info(f"Broadcast {broadcast_id} started for {total} users")
+        self._launch(broadcast_id, text, 0, 0, total)
+        return broadcast_id
+    
+    async def cancel(self):
+        """Stop the running broadcast for good; returns False if none was running"""
+        if not self.running():
+            return False
+        broadcast_id = self._progress["broadcast_id"]
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._progress["failed"] += await self.db.settle_broadcast_claims(broadcast_id)
+        await self.db.finish_broadcast(broadcast_id, 'cancelled')
+        logger.info(f"Broadcast {broadcast_id} cancelled")
+        return True
+    
+    def running(self):
+        return self._task is not None and not self._task.done()
+    
+    def progress(self):
+        """Counts for the current (or last) broadcast, with this run's throughput and an ETA"""
+        if self._progress is None:
+            return None
+        progress = dict(self._progress)
+        elapsed = time.monotonic() - progress.pop("started")
+        done_now = progress.pop("done_this_run")
+        rate = done_now / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, progress["total"] - progress["sent"] - progress["failed"])
+        progress["rate"] = rate
+        progress["eta_seconds"] = remaining / rate if rate else None
+        progress["running"] = self.running()
+        return progress
+    
+    def _launch(self, broadcast_id, text, sent, failed, total):
+        self._stopping = False
+        self._progress = {
+            "broadcast_id": broadcast_id, "sent": sent, "failed": failed, "total": total,
+            "started": time.monotonic(), "done_this_run": 0,
+        }
+        self._task = asyncio.create_task(self._run(broadcast_id, text))
+    
+    async def _run(self, broadcast_id, text):
+        pace = TokenBucket(self.rate, 1, time.monotonic())
+        progress = self._progress
+        try:
+            while not self._stopping:
+                user_ids = await self.db.claim_broadcast_batch(broadcast_id, self.batch_size)
+                if not user_ids:
+                    await self.db.finish_broadcast(broadcast_id)
+                    logger.info(f"Broadcast {broadcast_id} finished: {progress['sent']} sent, {progress['failed']} failed")
+                    if self.on_finished:
+                        final = self.progress()
+                        final["running"] = False
+                        await self.on_finished(final)
+                    return
+                
+                results = []
+                for user_id in user_ids:
+                    delay = pace.delay(time.monotonic())
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    pace.take(time.monotonic())
+                    results.append(self.outbox.send(user_id, text, priority=BROADCAST))
+                # Wait for the batch before claiming the next, so the outbound
+                # queue never holds more than one batch of the broadcast
+                delivered = await asyncio.gather(*results)
+                sent = sum(delivered)
+                failed = len(delivered) - sent
+                await self.db.record_broadcast_progress(broadcast_id, sent, failed)
+                progress["sent"] += sent
+                progress["failed"] += failed
+                progress["done_this_run"] += len(delivered)
+                logger.info(f"Broadcast {broadcast_id}: {progress['sent'] + progress['failed']}/{progress['total']} "
+                            f"done, {self.progress()['rate']:.1f} msgs/sec")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Left running in the database, so the next start picks it up again
+            logger.error(f"Broadcast {broadcast_id} stopped: {e}")
@@ -0,0 +1,140 @@
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# "{name}" or "{name:type}" in a route pattern
+PARAM_RE = re.compile(r"\{(\w+)(?::(\w+))?\}")
+CONVERTERS = {"str": str, "int": int}
+
+class RouteStats:
+    __slots__ = ("calls", "errors", "total", "max")
+    
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, elapsed, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+class Route:
+    __slots__ = ("pattern", "prefix", "params", "handler", "with_update", "stats")
+    
+    def __init__(self, pattern, handler, with_update):
+        self.pattern = pattern
+        self.handler = handler
+        self.with_update = with_update
+        self.stats = RouteStats()
+        
+        literals = PARAM_RE.split(pattern)
+        # split() yields literal, name, type, literal, name, type, ..., literal
+        self.prefix = literals[0]
+        self.params = []
+        for i in range(1, len(literals), 3):
+            name, type_name, literal = literals[i], literals[i + 1] or "str", literals[i + 2]
+            if type_name not in CONVERTERS:
+                raise ValueError(f"Unknown parameter type {type_name!r} in route {pattern!r}")
+            last = i + 3 >= len(literals)
+            if (not last and literal != "_") or (last and literal):
+                raise ValueError(f"Parameters must be separated by '_' and end the route: {pattern!r}")
+            self.params.append((name, CONVERTERS[type_name]))
+    
+    def parse(self, rest):
+        """Typed arguments from the data after the prefix, or None if they do not fit"""
+        if not self.params:
+            return {} if not rest else None
+        # Only the last parameter may contain '_'
+        values = rest.split("_", len(self.params) - 1)
+        if len(values) != len(self.params):
+            return None
+        try:
+            return {name: convert(value) for (name, convert), value in zip(self.params, values)}
+        except ValueError:
+            return None
+
+class CallbackRouter:
+    """
+    Declarative dispatch for inline keyboard callback data.
+    Routes are patterns such as "buy_{product_id:int}": a literal prefix
+    followed by '_'-separated parameters (str or int; only the last may
+    contain '_'). They compile into one dict keyed by prefix; a lookup tries
+    the data's own prefixes from the longest registered length down, so the
+    most specific route wins ("confirm_buy_" over "buy_") and the cost
+    depends on the number of distinct prefix lengths, not on the number of
+    routes. Every route records its call count, errors and latency.
+    Handlers are called as handler(query, **args), or
+    handler(update, context, **args) for routes added with with_update=True.
+    """
+    def __init__(self):
+        self._routes = []
+        self._exact = {}
+        self._prefixed = {}
+        self._lengths = []
+        self.unmatched = 0
+    
+    def add(self, pattern, handler, with_update=False):
+        route = Route(pattern, handler, with_update)
+        table = self._prefixed if route.params else self._exact
+        if route.prefix in table:
+            raise ValueError(f"Route {pattern!r} clashes with {table[route.prefix].pattern!r}")
+        table[route.prefix] = route
+        self._routes.append(route)
+        self._lengths = sorted({len(prefix) for prefix in self._prefixed}, reverse=True)
+        return route
+    
+    def resolve(self, data):
+        """(route, arguments) for callback data, or (None, None) if no route fits"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, {}
+        for length in self._lengths:
+            if length > len(data):
+                continue
+            route = self._prefixed.get(data[:length])
+            if route is not None:
+                args = route.parse(data[length:])
+                if args is not None:
+                    return route, args
+        return None, None
+    
+    async def dispatch(self, data, update, context):
+        """Run the route for `data`; returns False if no route matched"""
+        route, args = self.resolve(data)
+        if route is None:
+            self.unmatched += 1
+            logger.warning(f"No route for callback data {data!r}")
+            return False
+        
+        started = time.perf_counter()
+        failed = True
+        try:
+            if route.with_update:
+                await route.handler(update, context, **args)
+            else:
+                await route.handler(update.callback_query, **args)
+            failed = False
+        finally:
+            route.stats.record(time.perf_counter() - started, failed)
+        return True
+    
+    def stats(self):
+        """Per-route calls, errors and mean/max latency in ms, slowest mean first"""
+        rows = [
+            {
+                "route": route.pattern,
+                "calls": route.stats.calls,
+                "errors": route.stats.errors,
+                "mean_ms": route.stats.total / route.stats.calls * 1000 if route.stats.calls else 0.0,
+                "max_ms": route.stats.max * 1000,
+            }
+            for route in self._routes
+        ]
+        rows.sort(key=lambda row: row["mean_ms"], reverse=True)
+        return rows
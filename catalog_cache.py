@@ -0,0 +1,88 @@
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CatalogSnapshot:
+    """Immutable view of the products table at one catalog version"""
+    def __init__(self, version, rows):
+        self.version = version
+        self.by_id = {row[0]: row for row in rows}
+        # Same filter as the old "WHERE stock > 0" queries
+        self.in_stock = [row for row in rows if row[5] > 0]
+        self.by_category = {}
+        for row in self.in_stock:
+            self.by_category.setdefault(row[4], []).append(row)
+        self.categories = sorted(category for category in self.by_category if category)
+        # Sorted id lists for keyset paging (rows are loaded in id order)
+        self.ids = {category: [row[0] for row in rows] for category, rows in self.by_category.items()}
+        self.ids[None] = [row[0] for row in self.in_stock]
+
+class CatalogCache:
+    """
+    In-process product catalog keyed on the database's catalog version.
+    Triggers bump that version on every products write, from this process
+    or from a script on another connection, so each read costs one
+    primary-key lookup of the version and the snapshot is rebuilt with one
+    query only after it has moved. `text_version` only moves when product
+    names or descriptions may have changed, for caches that ignore stock.
+    """
+    def __init__(self, loader, version_loader):
+        self._loader = loader
+        # Returns (version, text_version)
+        self._version_loader = version_loader
+        self._lock = threading.Lock()
+        self._snapshot = CatalogSnapshot(-1, [])
+    
+    def version(self):
+        return self._version_loader()[0]
+    
+    def text_version(self):
+        return self._version_loader()[1]
+    
+    def is_fresh(self):
+        return self._snapshot.version == self.version()
+    
+    def snapshot(self):
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot.version < version:
+                # The version is read before the rows: a commit that lands
+                # during the load leaves this snapshot tagged older than its
+                # rows, and the next read rebuilds it
+                self._snapshot = CatalogSnapshot(version, self._loader())
+                logger.debug(f"Catalog cache rebuilt at version {version}")
+            return self._snapshot
+    
+    def products(self, category=None):
+        snapshot = self.snapshot()
+        if category:
+            return snapshot.by_category.get(category, [])
+        return snapshot.in_stock
+    
+    def products_page(self, category=None, after_id=None, before_id=None, limit=10):
+        """
+        One page of in-stock products in id order, keyed on the last/first id
+        the user has seen. Returns (rows, has_prev, has_next).
+        """
+        snapshot = self.snapshot()
+        category = category or None
+        rows = snapshot.by_category.get(category, []) if category else snapshot.in_stock
+        ids = snapshot.ids.get(category, [])
+        if before_id is not None:
+            end = bisect.bisect_left(ids, before_id)
+            start = max(0, end - limit)
+        else:
+            start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+            end = start + limit
+        return rows[start:end], start > 0, end < len(rows)
+    
+    def product(self, product_id):
+        return self.snapshot().by_id.get(product_id)
+    
+    def categories(self):
+        return self.snapshot().categories
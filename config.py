@@ -1,7 +1,11 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# Only pay for python-dotenv when there is a .env file to read. The explicit
+# path also spares load_dotenv its search up the call stack for one.
+_ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+if os.path.exists(_ENV_FILE):
+    from dotenv import load_dotenv
+    load_dotenv(_ENV_FILE)
 
 # Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8531374089:AAExQ3nQQZbf5AQ0LCtCuX8Pby3l6fhhyGM')
@@ -12,13 +16,92 @@ ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'Tep#@54321')
 KHQR_MERCHANT_ID = os.getenv('KHQR_MERCHANT_ID', 'your_merchant_id_here')
 KHQR_API_KEY = os.getenv('KHQR_API_KEY', 'your_khqr_api_key_here')
 KHQR_BASE_URL = os.getenv('KHQR_BASE_URL', 'https://api.khqr.bakong.nbc.gov.kh')
+KHQR_MERCHANT_NAME = os.getenv('KHQR_MERCHANT_NAME', 'JomNenh Store')
+KHQR_MERCHANT_CITY = os.getenv('KHQR_MERCHANT_CITY', 'Phnom Penh')
+
+# Payment verification HTTP client
+KHQR_VERIFY_TIMEOUT = float(os.getenv('KHQR_VERIFY_TIMEOUT', '10'))
+KHQR_VERIFY_CONCURRENCY = int(os.getenv('KHQR_VERIFY_CONCURRENCY', '10'))
+KHQR_VERIFY_RETRIES = int(os.getenv('KHQR_VERIFY_RETRIES', '3'))
+KHQR_VERIFY_BACKOFF = float(os.getenv('KHQR_VERIFY_BACKOFF', '0.5'))
+
+# Payment poller: first check after the initial delay, then back off from the
+# min to the max interval until the payment succeeds or times out (seconds)
+PAYMENT_POLL_INITIAL_DELAY = float(os.getenv('PAYMENT_POLL_INITIAL_DELAY', '10'))
+PAYMENT_POLL_MIN_INTERVAL = float(os.getenv('PAYMENT_POLL_MIN_INTERVAL', '5'))
+PAYMENT_POLL_MAX_INTERVAL = float(os.getenv('PAYMENT_POLL_MAX_INTERVAL', '60'))
+PAYMENT_TIMEOUT = float(os.getenv('PAYMENT_TIMEOUT', '900'))
+PAYMENT_POLL_BATCH_SIZE = int(os.getenv('PAYMENT_POLL_BATCH_SIZE', '50'))
+PAYMENT_POLL_CONCURRENCY = int(os.getenv('PAYMENT_POLL_CONCURRENCY', '10'))
+# Abandoned pending orders are expired and their stock released after ORDER_TTL seconds
+ORDER_TTL = float(os.getenv('ORDER_TTL', '3600'))
+ORDER_SWEEP_INTERVAL = float(os.getenv('ORDER_SWEEP_INTERVAL', '60'))
+ORDER_SWEEP_BATCH_SIZE = int(os.getenv('ORDER_SWEEP_BATCH_SIZE', '500'))
+
+# Worker processes used to render payment QR codes (defaults to one per CPU)
+QR_RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', str(os.cpu_count() or 1)))
 
 # Database
 DATABASE_NAME = "business_bot.db"
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', '4'))
+
+# Rendered catalog views kept in memory (LRU)
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '128'))
+
+# Rows per page in product and order listings
+PRODUCTS_PAGE_SIZE = int(os.getenv('PRODUCTS_PAGE_SIZE', '10'))
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', '10'))
+
+# Updates handled at once; each user's updates still run in arrival order
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+
+# Webhook mode: when WEBHOOK_URL (the public HTTPS base address) is set, Telegram
+# posts updates to WEBHOOK_URL/WEBHOOK_PATH, which a reverse proxy forwards to the
+# local listener on WEBHOOK_LISTEN:WEBHOOK_PORT. Otherwise the bot long-polls.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# Outbound messages (deliveries, admin notifications): Telegram allows about 30
+# messages a second overall and one a second per chat
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+OUTBOX_CHAT_RATE = float(os.getenv('OUTBOX_CHAT_RATE', '1'))
+OUTBOX_CHAT_BURST = int(os.getenv('OUTBOX_CHAT_BURST', '1'))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '8'))
+# More than ADMIN_DIGEST_THRESHOLD admin notifications a minute are merged into
+# one digest every ADMIN_DIGEST_INTERVAL seconds
+ADMIN_DIGEST_THRESHOLD = int(os.getenv('ADMIN_DIGEST_THRESHOLD', '10'))
+ADMIN_DIGEST_INTERVAL = float(os.getenv('ADMIN_DIGEST_INTERVAL', '60'))
+
+# Admin broadcasts: messages per second (kept under OUTBOX_GLOBAL_RATE so
+# deliveries still get through) and users read and checkpointed per batch
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '20'))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '100'))
+
+# Most units in one order, whether bought directly or through the cart; every
+# key is delivered in a single message
+MAX_ORDER_QUANTITY = int(os.getenv('MAX_ORDER_QUANTITY', '10'))
+
+# Product search: results per /search or inline query, and how long Telegram
+# may cache an inline answer (seconds)
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', '10'))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '30'))
+
+# Wallet top-up choices offered to customers, in whole dollars
+WALLET_TOPUP_AMOUNTS = [int(amount) for amount in os.getenv('WALLET_TOPUP_AMOUNTS', '5,10,20,50').split(',')]
+
+# Admin orders export: rows read per query, CSV bytes kept in memory before
+# the export file moves to disk, and bytes per uploaded file (an upload is
+# held in memory whole; Telegram refuses documents over 50 MB)
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+EXPORT_SPOOL_SIZE = int(os.getenv('EXPORT_SPOOL_SIZE', str(1024 * 1024)))
+EXPORT_PART_SIZE = int(os.getenv('EXPORT_PART_SIZE', str(10 * 1024 * 1024)))
+
+# Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics (port 0 turns it off)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
 
 # Logging
 LOG_LEVEL = "INFO"
-
-print("✅ Config loaded successfully!")
-print(f"🤖 Bot Token: {BOT_TOKEN[:10]}...")
-print(f"👤 Admin: {ADMIN_USERNAME}")
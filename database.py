@@ -1,64 +1,88 @@
 import sqlite3
 import logging
+import threading
 from datetime import datetime
 
+from catalog_cache import CatalogCache
+from render_cache import RenderCache
+from migrations import migrate, get_version, LATEST_VERSION, STATS_REBUILD_SQL
+from metrics import DB_QUERY, instrument
+
 logger = logging.getLogger(__name__)
 
+# Applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA temp_store = MEMORY",
+)
+STATEMENT_CACHE_SIZE = 256
+# Scratch table for the ids of orders whose stock is being handed back
+RELEASE_TABLE_SQL = "CREATE TEMP TABLE IF NOT EXISTS releasing_orders (id INTEGER PRIMARY KEY)"
+# Terminal statuses that return a pending order's reservation to stock
+RELEASE_STATUSES = ('failed', 'expired')
+# get_order_status result for an order id that does not exist
+ORDER_MISSING = 'missing'
+# Search keeps the ranked ids of this many queries, each ranked this many
+# times past the result limit so sold-out matches can be skipped
+SEARCH_CACHE_SIZE = 256
+SEARCH_DEPTH = 4
+
 class Database:
     def __init__(self, db_name="business_bot.db"):
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self.catalog = CatalogCache(self._load_catalog, self._load_catalog_version)
+        # (match, limit) -> ranked product ids, tagged with the catalog text version
+        self._search_ranks = RenderCache(maxsize=SEARCH_CACHE_SIZE)
+        self._search_lock = threading.Lock()
         self.init_db()
     
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        """Return this thread's long-lived connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection is only used by its owning thread; the flag lets
+            # close() tear the pool down from whichever thread shuts us down
+            conn = sqlite3.connect(
+                self.db_name,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            )
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            conn.execute(RELEASE_TABLE_SQL)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def close(self):
+        """Close every pooled connection (call on shutdown)"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
     
     def init_db(self):
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    balance REAL DEFAULT 0.0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            # Fast path for restarts: a database already at the latest schema
+            # version needs no DDL and no seeding, so this is one PRAGMA read
+            version = get_version(conn)
+            if version == LATEST_VERSION:
+                logger.info("Database schema is current")
+                return
             
-            # Products table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    description TEXT,
-                    price REAL NOT NULL,
-                    category TEXT,
-                    stock INTEGER DEFAULT 0,
-                    is_digital BOOLEAN DEFAULT FALSE,
-                    digital_key TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Orders table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS orders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    product_id INTEGER,
-                    quantity INTEGER DEFAULT 1,
-                    total_amount REAL,
-                    khqr_transaction_id TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id),
-                    FOREIGN KEY (product_id) REFERENCES products (id)
-                )
-            ''')
+            # WAL lets readers proceed while a single writer commits (the mode
+            # is stored in the file, so it only needs setting here)
+            conn.execute("PRAGMA journal_mode = WAL")
+            migrate(conn)
+            cursor = conn.cursor()
             
             # Insert sample products
             sample_products = [
@@ -70,16 +94,24 @@ class Database:
                 ("Steam Wallet $20", "$20 Steam Wallet Code", 20.00, "games", 40, True, "STEAM-7418-5296"),
             ]
             
-            cursor.execute("SELECT COUNT(*) FROM products")
-            if cursor.fetchone()[0] == 0:
-                cursor.executemany('''
-                    INSERT INTO products (name, description, price, category, stock, is_digital, digital_key)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', sample_products)
+            # Seed new databases only; one created before schema versioning
+            # also starts at version 0, hence the check for existing products
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM products)")
+            if version == 0 and not cursor.fetchone()[0]:
+                for name, description, price, category, stock, is_digital, digital_key in sample_products:
+                    # Stock starts at 0 and is raised by the key triggers
+                    cursor.execute('''
+                        INSERT INTO products (name, description, price, category, stock, is_digital, digital_key)
+                        VALUES (?, ?, ?, ?, 0, ?, ?)
+                    ''', (name, description, price, category, is_digital, digital_key))
+                    product_id = cursor.lastrowid
+                    cursor.executemany(
+                        "INSERT INTO digital_keys (product_id, key_value) VALUES (?, ?)",
+                        [(product_id, f"{digital_key}-{n:04d}") for n in range(1, stock + 1)]
+                    )
                 logger.info("Sample products inserted successfully")
             
             conn.commit()
-            conn.close()
             logger.info("Database initialized successfully")
             
         except Exception as e:
@@ -88,132 +120,811 @@ class Database:
     def add_user(self, user_id, username, first_name, last_name):
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            conn.commit()
-            conn.close()
+            with conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                    VALUES (?, ?, ?, ?)
+                ''', (user_id, username, first_name, last_name))
             return True
         except Exception as e:
             logger.error(f"Error adding user: {e}")
             return False
     
-    def get_products(self, category=None):
+    def get_user(self, user_id):
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
-            
-            if category:
-                cursor.execute("SELECT * FROM products WHERE category = ? AND stock > 0", (category,))
-            else:
-                cursor.execute("SELECT * FROM products WHERE stock > 0")
-            
-            products = cursor.fetchall()
-            conn.close()
-            return products
+            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error getting user: {e}")
+            return None
+    
+    def _load_catalog(self):
+        cursor = self.get_connection().cursor()
+        cursor.execute("SELECT * FROM products ORDER BY id")
+        return cursor.fetchall()
+    
+    def _load_catalog_version(self):
+        cursor = self.get_connection().cursor()
+        cursor.execute("SELECT version, text_version FROM catalog_version WHERE id = 1")
+        return cursor.fetchone()
+    
+    def get_products(self, category=None):
+        """In-stock products, served from the catalog cache"""
+        try:
+            return self.catalog.products(category)
         except Exception as e:
             logger.error(f"Error getting products: {e}")
             return []
     
     def get_product(self, product_id):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-            product = cursor.fetchone()
-            conn.close()
-            return product
+            return self.catalog.product(product_id)
         except Exception as e:
             logger.error(f"Error getting product: {e}")
             return None
     
-    def create_order(self, user_id, product_id, quantity, total_amount):
+    def get_products_page(self, category=None, after_id=None, before_id=None, limit=10):
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO orders (user_id, product_id, quantity, total_amount, status)
-                VALUES (?, ?, ?, ?, 'pending')
-            ''', (user_id, product_id, quantity, total_amount))
-            order_id = cursor.lastrowid
+            return self.catalog.products_page(category, after_id, before_id, limit)
+        except Exception as e:
+            logger.error(f"Error getting products page: {e}")
+            return [], False, False
+    
+    def search_products(self, query, limit=10):
+        """
+        In-stock products matching every word of `query` (each word also
+        matches as a prefix), best matches first. Uses the products_fts index.
+        Ranking costs about two microseconds per match, so the ids of the best
+        SEARCH_DEPTH * limit matches are cached until product text changes;
+        stock is read fresh on every call, and when too few of those are in
+        stock every in-stock match is ranked instead.
+        """
+        # Quote each word so user input can never be read as FTS5 syntax
+        words = [word.replace('"', '') for word in query.split()]
+        match = " ".join(f'"{word}"*' for word in words if word)
+        if not match:
+            return []
+        try:
+            cursor = self.get_connection().cursor()
+            key = (match, limit)
+            version = self.catalog.text_version()
+            with self._search_lock:
+                ranked = self._search_ranks.get(key, version)
+            if ranked is None:
+                # Name matches weigh ten times description matches
+                cursor.execute('''
+                    SELECT rowid FROM products_fts WHERE products_fts MATCH ?
+                    ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ?
+                ''', (match, limit * SEARCH_DEPTH))
+                ranked = [row[0] for row in cursor.fetchall()]
+                with self._search_lock:
+                    self._search_ranks.put(key, version, ranked)
+            if not ranked:
+                return []
             
-            # Update stock
-            cursor.execute('''
-                UPDATE products SET stock = stock - ? WHERE id = ?
-            ''', (quantity, product_id))
+            cursor.execute(
+                f"SELECT * FROM products WHERE id IN ({','.join('?' * len(ranked))}) AND stock > 0",
+                ranked
+            )
+            in_stock = {row[0]: row for row in cursor.fetchall()}
+            results = [in_stock[product_id] for product_id in ranked if product_id in in_stock][:limit]
+            if len(results) == limit or len(ranked) < limit * SEARCH_DEPTH:
+                return results
             
-            conn.commit()
-            conn.close()
+            # Most of the best matches are sold out
+            cursor.execute('''
+                SELECT p.* FROM products_fts f
+                JOIN products p ON p.id = f.rowid
+                WHERE products_fts MATCH ? AND p.stock > 0
+                ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ?
+            ''', (match, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error searching products: {e}")
+            return []
+    
+    def get_categories(self):
+        """Categories that have at least one product in stock"""
+        try:
+            return self.catalog.categories()
+        except Exception as e:
+            logger.error(f"Error getting categories: {e}")
+            return []
+    
+    def create_order(self, user_id, product_id, quantity, total_amount):
+        """
+        Reserve stock and create a pending single-line order in one transaction.
+        Returns None if there is not enough stock left.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                # Write first so the transaction holds the write lock before it reads
+                cursor.execute('''
+                    INSERT INTO orders (user_id, product_id, quantity, total_amount, status)
+                    VALUES (?, ?, ?, ?, 'pending')
+                ''', (user_id, product_id, quantity, total_amount))
+                order_id = cursor.lastrowid
+                
+                if self._add_order_lines(cursor, order_id, [(product_id, quantity, total_amount / quantity)]):
+                    conn.rollback()
+                    logger.info(f"Not enough stock for product {product_id} (wanted {quantity})")
+                    return None
             return order_id
         except Exception as e:
             logger.error(f"Error creating order: {e}")
             return None
     
-    def update_order_status(self, order_id, status, transaction_id=None):
+    def _add_order_lines(self, cursor, order_id, lines):
+        """
+        Insert an order's line items, given as (product_id, quantity,
+        unit_price), and reserve stock for each inside the caller's
+        transaction. Returns the first product short of stock, or None.
+        """
+        cursor.executemany(
+            "INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?)",
+            [(order_id, product_id, quantity, unit_price) for product_id, quantity, unit_price in lines]
+        )
+        for product_id, quantity, _ in lines:
+            if not self._reserve_stock(cursor, order_id, product_id, quantity):
+                return product_id
+        return None
+    
+    def _reserve_stock(self, cursor, order_id, product_id, quantity):
+        """
+        Reserve `quantity` units of a product for an order inside the caller's
+        transaction. Digital products reserve one free key per unit; the key
+        triggers lower products.stock. Returns False if there is not enough.
+        """
+        cursor.execute("SELECT is_digital FROM products WHERE id = ?", (product_id,))
+        product = cursor.fetchone()
+        if product and product[0]:
+            cursor.execute('''
+                UPDATE digital_keys SET order_id = ?
+                WHERE id IN (
+                    SELECT id FROM digital_keys
+                    WHERE product_id = ? AND order_id IS NULL
+                    ORDER BY id LIMIT ?
+                )
+            ''', (order_id, product_id, quantity))
+            return cursor.rowcount >= quantity
+        # Guarded decrement: the check and the update are one statement,
+        # so concurrent buyers can never push stock below zero
+        cursor.execute('''
+            UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?
+        ''', (quantity, product_id, quantity))
+        return cursor.rowcount > 0
+    
+    def wallet_purchase(self, user_id, product_id, quantity=1):
+        """
+        Buy from the wallet balance: debit the ledger, create the order as
+        completed and reserve and claim its stock, all in one transaction.
+        Returns (order_id, None), or (None, reason) where reason is
+        'invalid_quantity', 'not_found', 'insufficient_funds', 'out_of_stock'
+        or 'error'.
+        """
+        # A negative quantity would credit the wallet instead of debiting it
+        if quantity < 1:
+            return None, "invalid_quantity"
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            if transaction_id:
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT price FROM products WHERE id = ?", (product_id,))
+                product = cursor.fetchone()
+                if product is None:
+                    conn.rollback()
+                    return None, "not_found"
+                price_cents = round(product[0] * 100) * quantity
+                
+                cursor.execute("SELECT balance_cents FROM users WHERE user_id = ?", (user_id,))
+                balance = cursor.fetchone()
+                if balance is None or balance[0] < price_cents:
+                    conn.rollback()
+                    return None, "insufficient_funds"
+                
                 cursor.execute('''
-                    UPDATE orders SET status = ?, khqr_transaction_id = ? WHERE id = ?
-                ''', (status, transaction_id, order_id))
-            else:
+                    INSERT INTO orders (user_id, product_id, quantity, total_amount, status)
+                    VALUES (?, ?, ?, ?, 'completed')
+                ''', (user_id, product_id, quantity, price_cents / 100))
+                order_id = cursor.lastrowid
+                if self._add_order_lines(cursor, order_id, [(product_id, quantity, product[0])]):
+                    conn.rollback()
+                    return None, "out_of_stock"
+                
                 cursor.execute('''
-                    UPDATE orders SET status = ? WHERE id = ?
-                ''', (status, order_id))
-            conn.commit()
-            conn.close()
-            return True
+                    INSERT INTO wallet_ledger (user_id, amount_cents, kind, order_id)
+                    VALUES (?, ?, 'purchase', ?)
+                ''', (user_id, -price_cents, order_id))
+                cursor.execute('''
+                    UPDATE digital_keys SET claimed_at = CURRENT_TIMESTAMP WHERE order_id = ?
+                ''', (order_id,))
+            return order_id, None
+        except Exception as e:
+            logger.error(f"Error buying from wallet: {e}")
+            return None, "error"
+    
+    def get_wallet_balance(self, user_id):
+        """Balance in cents (0 for unknown users)"""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute("SELECT balance_cents FROM users WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except Exception as e:
+            logger.error(f"Error getting wallet balance: {e}")
+            return 0
+    
+    def create_topup(self, user_id, amount_cents):
+        """Record a pending top-up awaiting KHQR payment; returns its id"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "INSERT INTO wallet_topups (user_id, amount_cents) VALUES (?, ?)",
+                    (user_id, amount_cents)
+                )
+                return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Error creating top-up: {e}")
+            return None
+    
+    def get_pending_topups(self):
+        """(id, user_id, None, amount in dollars, created_at) of every unpaid top-up, oldest first"""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('''
+                SELECT id, user_id, NULL, amount_cents / 100.0, created_at
+                FROM wallet_topups WHERE status = 'pending'
+                ORDER BY created_at
+            ''')
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting pending top-ups: {e}")
+            return []
+    
+    def complete_topup(self, topup_id, transaction_id):
+        """
+        Mark a pending top-up paid and credit the wallet in one transaction.
+        Returns the new balance in cents, or None if it was not pending.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE wallet_topups SET status = 'completed', khqr_transaction_id = ?
+                    WHERE id = ? AND status = 'pending'
+                ''', (transaction_id, topup_id))
+                if cursor.rowcount == 0:
+                    return None
+                cursor.execute('''
+                    INSERT INTO wallet_ledger (user_id, amount_cents, kind, topup_id)
+                    SELECT user_id, amount_cents, 'topup', id FROM wallet_topups WHERE id = ?
+                ''', (topup_id,))
+                cursor.execute('''
+                    SELECT u.balance_cents FROM users u
+                    JOIN wallet_topups t ON t.user_id = u.user_id WHERE t.id = ?
+                ''', (topup_id,))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error completing top-up: {e}")
+            return None
+    
+    def fail_topup(self, topup_id):
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "UPDATE wallet_topups SET status = 'failed' WHERE id = ? AND status = 'pending'",
+                    (topup_id,)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error failing top-up: {e}")
+            return False
+    
+    def update_order_status(self, order_id, status, transaction_id=None):
+        """
+        Move a pending order to `status`. Returns True if it moved, False if
+        it was no longer pending (or on error): an order the sweeper expired
+        has handed its stock back and must not be completed.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                if status in RELEASE_STATUSES:
+                    # Only a still-pending order has stock to hand back
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute(
+                        "INSERT INTO temp.releasing_orders (id) VALUES (?)", (order_id,)
+                    )
+                    changed = self._release_orders(conn.cursor(), status)[0] > 0
+                    if transaction_id:
+                        conn.execute('''
+                            UPDATE orders SET khqr_transaction_id = ? WHERE id = ?
+                        ''', (transaction_id, order_id))
+                elif transaction_id:
+                    changed = conn.execute('''
+                        UPDATE orders SET status = ?, khqr_transaction_id = ?
+                        WHERE id = ? AND status = 'pending'
+                    ''', (status, transaction_id, order_id)).rowcount > 0
+                else:
+                    changed = conn.execute('''
+                        UPDATE orders SET status = ? WHERE id = ? AND status = 'pending'
+                    ''', (status, order_id)).rowcount > 0
+                
+                if status == 'completed' and changed:
+                    # The buyer now owns the keys reserved for this order
+                    conn.execute('''
+                        UPDATE digital_keys SET claimed_at = CURRENT_TIMESTAMP
+                        WHERE order_id = ? AND claimed_at IS NULL
+                    ''', (order_id,))
+            return changed
         except Exception as e:
             logger.error(f"Error updating order status: {e}")
             return False
     
-    def get_digital_key(self, product_id):
+    def _release_orders(self, cursor, status):
+        """
+        Move the orders listed in temp.releasing_orders to `status` and hand
+        their reserved stock back: unclaimed keys return to the free pool and
+        physical products get their quantity added back. Orders that are no
+        longer pending are skipped. Runs inside the caller's transaction and
+        empties the id table. Returns (orders, units) released.
+        """
+        cursor.execute('''
+            DELETE FROM temp.releasing_orders WHERE NOT EXISTS (
+                SELECT 1 FROM orders o
+                WHERE o.id = releasing_orders.id AND o.status = 'pending'
+            )
+        ''')
+        # The key triggers raise products.stock for every freed key
+        cursor.execute('''
+            UPDATE digital_keys SET order_id = NULL
+            WHERE order_id IN (SELECT id FROM temp.releasing_orders) AND claimed_at IS NULL
+        ''')
+        units = cursor.rowcount
+        # CROSS JOIN keeps the staged ids as the outer loop, so each order's
+        # lines are found through idx_order_items_order
+        cursor.execute('''
+            SELECT i.product_id, SUM(i.quantity)
+            FROM temp.releasing_orders r
+            CROSS JOIN order_items i ON i.order_id = r.id
+            JOIN products p ON p.id = i.product_id
+            WHERE NOT p.is_digital
+            GROUP BY i.product_id
+        ''')
+        restock = cursor.fetchall()
+        cursor.executemany(
+            "UPDATE products SET stock = stock + ? WHERE id = ?",
+            [(quantity, product_id) for product_id, quantity in restock],
+        )
+        units += sum(quantity for _, quantity in restock)
+        cursor.execute('''
+            UPDATE orders SET status = ? WHERE id IN (SELECT id FROM temp.releasing_orders)
+        ''', (status,))
+        orders = cursor.rowcount
+        cursor.execute("DELETE FROM temp.releasing_orders")
+        return orders, units
+    
+    def expire_pending_orders(self, ttl_seconds, limit=500):
+        """
+        Expire up to `limit` pending orders older than `ttl_seconds` and
+        release their stock in a single transaction.
+        Returns (expired order ids, units released).
+        """
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT digital_key FROM products WHERE id = ?", (product_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result else None
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    INSERT INTO temp.releasing_orders (id)
+                    SELECT id FROM orders
+                    WHERE status = 'pending' AND created_at < datetime('now', ?)
+                    ORDER BY created_at LIMIT ?
+                ''', (f"-{int(ttl_seconds)} seconds", limit))
+                cursor.execute("SELECT id FROM temp.releasing_orders ORDER BY id")
+                order_ids = [row[0] for row in cursor.fetchall()]
+                _, units = self._release_orders(cursor, 'expired')
+            return order_ids, units
         except Exception as e:
-            logger.error(f"Error getting digital key: {e}")
+            logger.error(f"Error expiring pending orders: {e}")
+            return [], 0
+    
+    def add_digital_keys(self, product_id, keys):
+        """Add one key row per unit; the product's stock rises by len(keys)"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                conn.executemany(
+                    "INSERT INTO digital_keys (product_id, key_value) VALUES (?, ?)",
+                    [(product_id, key) for key in keys]
+                )
+            return len(keys)
+        except Exception as e:
+            logger.error(f"Error adding digital keys: {e}")
+            return 0
+    
+    def get_order_status(self, order_id):
+        """Status of one order, ORDER_MISSING if there is no such order, or None on error"""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
+            row = cursor.fetchone()
+            return row[0] if row else ORDER_MISSING
+        except Exception as e:
+            logger.error(f"Error getting order status: {e}")
             return None
     
-    def get_user_orders(self, user_id):
+    def get_order_items(self, order_id):
+        """(product_id, name, quantity, unit_price) for each line of an order"""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('''
+                SELECT i.product_id, p.name, i.quantity, i.unit_price
+                FROM order_items i JOIN products p ON p.id = i.product_id
+                WHERE i.order_id = ? ORDER BY i.id
+            ''', (order_id,))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting order items: {e}")
+            return []
+    
+    def add_to_cart(self, user_id, product_id, quantity, max_units):
+        """
+        Add units of a product to the user's cart, unless the cart would
+        then hold more than `max_units` in total. Returns False if refused.
+        """
         try:
             conn = self.get_connection()
-            cursor = conn.cursor()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO cart_items (user_id, product_id, quantity)
+                    SELECT ?, ?, ?
+                    WHERE (SELECT COALESCE(SUM(quantity), 0) FROM cart_items WHERE user_id = ?) + ? <= ?
+                    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+                ''', (user_id, product_id, quantity, user_id, quantity, max_units))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error adding to cart: {e}")
+            return False
+    
+    def get_cart(self, user_id):
+        """(product_id, name, price, quantity, stock) for each product in the user's cart"""
+        try:
+            cursor = self.get_connection().cursor()
             cursor.execute('''
-                SELECT o.id, p.name, o.quantity, o.total_amount, o.status, o.created_at 
-                FROM orders o 
-                JOIN products p ON o.product_id = p.id 
-                WHERE o.user_id = ?
-                ORDER BY o.created_at DESC
+                SELECT c.product_id, p.name, p.price, c.quantity, p.stock
+                FROM cart_items c JOIN products p ON p.id = c.product_id
+                WHERE c.user_id = ? ORDER BY c.product_id
             ''', (user_id,))
-            orders = cursor.fetchall()
-            conn.close()
-            return orders
+            return cursor.fetchall()
         except Exception as e:
-            logger.error(f"Error getting user orders: {e}")
+            logger.error(f"Error getting cart: {e}")
             return []
     
-    def get_all_orders(self):
+    def remove_from_cart(self, user_id, product_id):
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "DELETE FROM cart_items WHERE user_id = ? AND product_id = ?", (user_id, product_id)
+                )
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error removing from cart: {e}")
+            return False
+    
+    def clear_cart(self, user_id):
+        try:
+            conn = self.get_connection()
+            with conn:
+                conn.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
+            return True
+        except Exception as e:
+            logger.error(f"Error clearing cart: {e}")
+            return False
+    
+    def checkout_cart(self, user_id):
+        """
+        Turn the user's cart into one pending order in one transaction: lines
+        priced from the catalog, stock reserved for every line and the cart
+        emptied. Returns (order_id, total_amount, None), or (None, None,
+        reason) where reason is 'empty', 'out_of_stock' or 'error'.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    SELECT c.product_id, c.quantity, p.price
+                    FROM cart_items c JOIN products p ON p.id = c.product_id
+                    WHERE c.user_id = ? ORDER BY c.product_id
+                ''', (user_id,))
+                lines = cursor.fetchall()
+                if not lines:
+                    conn.rollback()
+                    return None, None, "empty"
+                # Summed in cents so the total matches what the lines add up to
+                total_amount = sum(round(price * 100) * quantity for _, quantity, price in lines) / 100
+                
+                # orders.product_id and quantity carry the first product and the total units
+                cursor.execute('''
+                    INSERT INTO orders (user_id, product_id, quantity, total_amount, status)
+                    VALUES (?, ?, ?, ?, 'pending')
+                ''', (user_id, lines[0][0], sum(quantity for _, quantity, _ in lines), total_amount))
+                order_id = cursor.lastrowid
+                short = self._add_order_lines(cursor, order_id, lines)
+                if short is not None:
+                    conn.rollback()
+                    logger.info(f"Cart checkout for user {user_id}: not enough stock for product {short}")
+                    return None, None, "out_of_stock"
+                cursor.execute("DELETE FROM cart_items WHERE user_id = ?", (user_id,))
+            return order_id, total_amount, None
+        except Exception as e:
+            logger.error(f"Error checking out cart: {e}")
+            return None, None, "error"
+    
+    def get_order_keys(self, order_id):
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
+            cursor.execute(
+                "SELECT key_value FROM digital_keys WHERE order_id = ? ORDER BY id",
+                (order_id,)
+            )
+            return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting order keys: {e}")
+            return []
+    
+    def get_pending_orders(self):
+        """(id, user_id, product_id, total_amount, created_at) of every unpaid order, oldest first"""
+        try:
+            cursor = self.get_connection().cursor()
+            cursor.execute('''
+                SELECT id, user_id, product_id, total_amount, created_at
+                FROM orders WHERE status = 'pending'
+                ORDER BY created_at
+            ''')
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting pending orders: {e}")
+            return []
+    
+    def create_broadcast(self, text):
+        """Start a broadcast to every user; returns its id, or None if one is already running"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO broadcasts (text, total)
+                    SELECT ?, total_users FROM stats WHERE id = 1
+                ''', (text,))
+                return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            logger.info("A broadcast is already running")
+            return None
+        except Exception as e:
+            logger.error(f"Error creating broadcast: {e}")
+            return None
+    
+    def get_running_broadcast(self):
+        """(id, text, last_user_id, sent, failed, total) of the running broadcast, if any"""
+        try:
+            cursor = self.get_connection().cursor()
             cursor.execute('''
-                SELECT o.id, u.username, p.name, o.total_amount, o.status, o.created_at 
+                SELECT id, text, last_user_id, sent, failed, total
+                FROM broadcasts WHERE status = 'running'
+            ''')
+            return cursor.fetchone()
+        except Exception as e:
+            logger.error(f"Error getting running broadcast: {e}")
+            return None
+    
+    def claim_broadcast_batch(self, broadcast_id, limit=100):
+        """
+        Take the next `limit` user ids after the broadcast's checkpoint, in id
+        order, and move the checkpoint past them in the same transaction.
+        Claimed users are never handed out again, so a crash part-way through
+        a batch can skip some of its users but never message anyone twice
+        (settle_broadcast_claims counts those as failed).
+        Returns [] once every user has been claimed.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    SELECT u.user_id FROM users u
+                    JOIN broadcasts b ON b.id = ? AND b.status = 'running'
+                    WHERE u.user_id > b.last_user_id
+                    ORDER BY u.user_id LIMIT ?
+                ''', (broadcast_id, limit))
+                user_ids = [row[0] for row in cursor.fetchall()]
+                if user_ids:
+                    cursor.execute(
+                        "UPDATE broadcasts SET last_user_id = ?, claimed = claimed + ? WHERE id = ?",
+                        (user_ids[-1], len(user_ids), broadcast_id)
+                    )
+            return user_ids
+        except Exception as e:
+            logger.error(f"Error claiming broadcast batch: {e}")
+            return []
+    
+    def record_broadcast_progress(self, broadcast_id, sent, failed):
+        """Add one batch's delivery counts to the broadcast"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                conn.execute('''
+                    UPDATE broadcasts SET sent = sent + ?, failed = failed + ? WHERE id = ?
+                ''', (sent, failed, broadcast_id))
+            return True
+        except Exception as e:
+            logger.error(f"Error recording broadcast progress: {e}")
+            return False
+    
+    def settle_broadcast_claims(self, broadcast_id):
+        """
+        Count the users a stopped run claimed but never recorded as failed,
+        so sent + failed adds up to everyone claimed. Whether their message
+        went out is unknown; they are not retried. Returns how many.
+        """
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(
+                    "SELECT claimed - sent - failed FROM broadcasts WHERE id = ?", (broadcast_id,)
+                )
+                row = cursor.fetchone()
+                lost = max(row[0], 0) if row else 0
+                if lost:
+                    cursor.execute(
+                        "UPDATE broadcasts SET failed = failed + ? WHERE id = ?", (lost, broadcast_id)
+                    )
+            return lost
+        except Exception as e:
+            logger.error(f"Error settling broadcast claims: {e}")
+            return 0
+    
+    def finish_broadcast(self, broadcast_id, status='completed'):
+        """Mark a running broadcast completed or cancelled; False if it was not running"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'running'
+                ''', (status, broadcast_id))
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error finishing broadcast: {e}")
+            return False
+    
+    def _orders_page(self, sql, params, before_id, after_id, limit):
+        """
+        Run one page of an orders query, newest first, using the order id as
+        the keyset cursor. `sql` must end in a WHERE clause. Only limit + 1
+        rows are read, whatever the size of the table.
+        Returns (rows, has_older, has_newer).
+        """
+        cursor = self.get_connection().cursor()
+        if after_id is not None:
+            # Walking back towards newer orders: read ascending, then flip
+            cursor.execute(sql + " AND o.id > ? ORDER BY o.id ASC LIMIT ?", (*params, after_id, limit + 1))
+            rows = cursor.fetchall()
+            return rows[:limit][::-1], True, len(rows) > limit
+        if before_id is not None:
+            cursor.execute(sql + " AND o.id < ? ORDER BY o.id DESC LIMIT ?", (*params, before_id, limit + 1))
+        else:
+            cursor.execute(sql + " ORDER BY o.id DESC LIMIT ?", (*params, limit + 1))
+        rows = cursor.fetchall()
+        return rows[:limit], len(rows) > limit, before_id is not None
+    
+    def get_user_orders(self, user_id, before_id=None, after_id=None, limit=10):
+        """One page of a user's orders; see _orders_page for the cursor arguments"""
+        try:
+            return self._orders_page('''
+                SELECT o.id, p.name, o.quantity, o.total_amount, o.status, o.created_at,
+                    (SELECT COUNT(*) FROM order_items i WHERE i.order_id = o.id)
+                FROM orders o 
+                JOIN products p ON o.product_id = p.id 
+                WHERE o.user_id = ?
+            ''', (user_id,), before_id, after_id, limit)
+        except Exception as e:
+            logger.error(f"Error getting user orders: {e}")
+            return [], False, False
+    
+    def get_all_orders(self, before_id=None, after_id=None, limit=10):
+        """One page of all orders; see _orders_page for the cursor arguments"""
+        try:
+            return self._orders_page('''
+                SELECT o.id, u.username, p.name, o.total_amount, o.status, o.created_at,
+                    (SELECT COUNT(*) FROM order_items i WHERE i.order_id = o.id)
                 FROM orders o 
                 JOIN users u ON o.user_id = u.user_id 
                 JOIN products p ON o.product_id = p.id
-                ORDER BY o.created_at DESC
-            ''')
-            orders = cursor.fetchall()
-            conn.close()
-            return orders
+                WHERE 1 = 1
+            ''', (), before_id, after_id, limit)
         except Exception as e:
             logger.error(f"Error getting all orders: {e}")
-            return []
\ No newline at end of file
+            return [], False, False
+    
+    def get_orders_chunk(self, after_id=0, limit=1000, since=None, until=None, status=None):
+        """
+        Up to `limit` orders with id > after_id, oldest first, for exports:
+        (id, created_at, user_id, username, status, quantity, total_amount,
+        khqr_transaction_id, items). `since`/`until` are inclusive
+        'YYYY-MM-DD' dates and `status` an exact status; None means no filter.
+        Walks the rowid b-tree from the cursor, so each chunk costs the same
+        however far into the table it is. Returns None on error, so a failed
+        read cannot pass for the end of the export.
+        """
+        try:
+            cursor = self.get_connection().cursor()
+            # Unary + keeps the planner on the id range instead of
+            # idx_orders_status_created, which would need a sort per chunk
+            cursor.execute('''
+                SELECT o.id, o.created_at, o.user_id, u.username, o.status, o.quantity,
+                    o.total_amount, o.khqr_transaction_id,
+                    (SELECT group_concat(p.name || ' x' || i.quantity, '; ')
+                     FROM order_items i JOIN products p ON p.id = i.product_id
+                     WHERE i.order_id = o.id)
+                FROM orders o
+                LEFT JOIN users u ON u.user_id = o.user_id
+                WHERE o.id > ?
+                AND (? IS NULL OR +o.created_at >= ?)
+                AND (? IS NULL OR +o.created_at < date(?, '+1 day'))
+                AND (? IS NULL OR +o.status = ?)
+                ORDER BY o.id LIMIT ?
+            ''', (after_id, since, since, until, until, status, status, limit))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error getting orders chunk: {e}")
+            return None
+    
+    def get_stats(self):
+        """Return (total_users, total_orders, completed_orders, total_revenue)"""
+        try:
+            cursor = self.get_connection().cursor()
+            # Counters are maintained by triggers, so this is a single-row read
+            cursor.execute('''
+                SELECT total_users, total_orders, completed_orders, total_revenue
+                FROM stats WHERE id = 1
+            ''')
+            return cursor.fetchone() or (0, 0, 0, 0)
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            return 0, 0, 0, 0
+    
+    def rebuild_stats(self):
+        """Recount the stats row from the base tables (repair tool, scans everything)"""
+        try:
+            conn = self.get_connection()
+            with conn:
+                conn.execute(STATS_REBUILD_SQL)
+            logger.info("Business statistics rebuilt")
+            return self.get_stats()
+        except Exception as e:
+            logger.error(f"Error rebuilding stats: {e}")
+            return None
+
+# get_connection runs inside every other method; timing it too would only add overhead
+instrument(Database, DB_QUERY, include=("_load_catalog",), exclude=("get_connection", "close"))
\ No newline at end of file
@@ -1,73 +1,137 @@
-import qrcode
-import requests
+# qrcode (with PIL), requests and httpx are imported where they are first
+# needed: most processes never render a QR or call the bank, and importing
+# them up front is most of this module's load time
 import json
 import logging
 import os
-from config import KHQR_MERCHANT_ID, KHQR_API_KEY, KHQR_BASE_URL
+import io
+import asyncio
+import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import (
+    KHQR_MERCHANT_ID, KHQR_API_KEY, KHQR_BASE_URL, KHQR_MERCHANT_NAME, KHQR_MERCHANT_CITY,
+    QR_RENDER_WORKERS, KHQR_VERIFY_TIMEOUT, KHQR_VERIFY_CONCURRENCY, KHQR_VERIFY_RETRIES,
+    KHQR_VERIFY_BACKOFF,
+)
+from khqr_payload import KHQRMerchantTemplate
+from metrics import KHQR, instrument
 
 logger = logging.getLogger(__name__)
 
+# Responses worth another attempt: rate limiting and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+_render_pool = None
+
+def render_qr_png(data):
+    """Render `data` as a QR code and return the PNG bytes"""
+    import qrcode
+    
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def get_render_pool():
+    """
+    Process pool for QR rendering, started on first use.
+    qrcode/PIL work is CPU-bound Python, so separate processes keep it off the
+    event loop and let several checkouts render in parallel. Workers are
+    spawned rather than forked because the bot already runs threads.
+    """
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(
+            max_workers=QR_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _render_pool
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True)
+        _render_pool = None
+
+# Measured from the bot's side, so it includes any wait for a free worker
+@KHQR.timed("render_qr")
+async def render_qr_async(data):
+    """Render a QR code on the worker pool and return it as an in-memory PNG"""
+    loop = asyncio.get_running_loop()
+    png = await loop.run_in_executor(get_render_pool(), render_qr_png, data)
+    buffer = io.BytesIO(png)
+    buffer.name = "khqr.png"
+    return buffer
+
 class KHQRPayment:
     def __init__(self):
         self.merchant_id = KHQR_MERCHANT_ID
         self.api_key = KHQR_API_KEY
         self.base_url = KHQR_BASE_URL
+        # Static merchant fields are encoded once, at startup
+        self.template = KHQRMerchantTemplate(
+            bakong_account_id=KHQR_MERCHANT_ID,
+            merchant_name=KHQR_MERCHANT_NAME,
+            merchant_city=KHQR_MERCHANT_CITY,
+        )
+        self.verify_timeout = KHQR_VERIFY_TIMEOUT
+        self.verify_concurrency = KHQR_VERIFY_CONCURRENCY
+        self.verify_retries = KHQR_VERIFY_RETRIES
+        self.verify_backoff = KHQR_VERIFY_BACKOFF
+        # Created on first use, inside the running event loop
+        self._http = None
+        self._verify_slots = None
         logger.info("KHQR Payment initialized")
     
+    def build_payment_string(self, amount, order_id, currency="USD"):
+        """EMV KHQR payload for one order; only the per-order fields are encoded here"""
+        return self.template.encode(amount, currency, bill_number=str(order_id))
+    
     def generate_payment_qr(self, amount, order_id, currency="USD"):
         """
-        Generate KHQR payment QR code
-        Note: This is a simplified implementation. 
-        You'll need to integrate with actual KHQR API from your bank.
+        Generate KHQR payment QR code as an in-memory PNG.
+        Returns (png_buffer, qr_string), or (None, None) on error.
         """
         try:
-            # KHQR payload structure (simplified)
-            khqr_data = {
-                "merchant_id": self.merchant_id,
-                "amount": f"{amount:.2f}",
-                "currency": currency,
-                "order_id": str(order_id),
-                "description": f"Order #{order_id}",
-                "terminal_id": "001",
-                "country_code": "KH",
-                "city": "Phnom Penh"
-            }
-            
-            # Convert to KHQR string format
-            qr_string = self._format_khqr_string(khqr_data)
-            
-            # Generate QR code
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_string)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            qr_filename = f"khqr_{order_id}.png"
-            img.save(qr_filename)
-            
+            qr_string = self.build_payment_string(amount, order_id, currency)
+            buffer = io.BytesIO(render_qr_png(qr_string))
+            buffer.name = "khqr.png"
             logger.info(f"KHQR generated for order {order_id}")
-            return qr_filename, qr_string
+            return buffer, qr_string
             
         except Exception as e:
             logger.error(f"Error generating KHQR: {e}")
             return None, None
     
-    def _format_khqr_string(self, data):
-        """Format data into KHQR standard string"""
-        # This is a simplified version. Actual KHQR format is more complex.
-        # Format: KHQR|MerchantID|Amount|Currency|OrderID|Description
-        return f"KHQR|{data['merchant_id']}|{data['amount']}|{data['currency']}|{data['order_id']}|{data['description']}"
+    async def generate_payment_qr_async(self, amount, order_id, currency="USD"):
+        """Same as generate_payment_qr, but renders on the QR worker pool"""
+        try:
+            qr_string = self.build_payment_string(amount, order_id, currency)
+            buffer = await render_qr_async(qr_string)
+            logger.info(f"KHQR generated for order {order_id}")
+            return buffer, qr_string
+            
+        except Exception as e:
+            logger.error(f"Error generating KHQR: {e}")
+            return None, None
     
     def verify_payment(self, transaction_id):
         """
         Verify payment status with KHQR API
         You need to implement this based on your bank's API documentation
         """
+        import requests
+        
         try:
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -92,32 +156,102 @@ class KHQRPayment:
         except Exception as e:
             logger.error(f"Error verifying payment: {e}")
             return None
+    
+    def _get_http_client(self):
+        if self._http is None:
+            import httpx
+            
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                timeout=httpx.Timeout(self.verify_timeout),
+                # Keep-alive pool sized to the concurrency cap
+                limits=httpx.Limits(
+                    max_connections=self.verify_concurrency,
+                    max_keepalive_connections=self.verify_concurrency,
+                ),
+            )
+            self._verify_slots = asyncio.Semaphore(self.verify_concurrency)
+        return self._http
+    
+    async def verify_payment_async(self, transaction_id):
+        """
+        Verify payment status without blocking the event loop.
+        Requests share one keep-alive connection pool, at most
+        verify_concurrency are in flight, and timeouts, connection errors
+        and retryable statuses are retried with jittered exponential backoff.
+        Returns the API result, or None if the payment could not be verified.
+        """
+        client = self._get_http_client()
+        # Already loaded by _get_http_client, so this is a dict lookup
+        import httpx
+        
+        for attempt in range(self.verify_retries + 1):
+            try:
+                async with self._verify_slots:
+                    response = await client.get(f"/transactions/{transaction_id}")
+                
+                if response.status_code == 200:
+                    logger.info(f"Payment verification successful for {transaction_id}")
+                    return response.json()
+                if response.status_code not in RETRYABLE_STATUS:
+                    logger.error(f"Payment verification failed: {response.status_code}")
+                    return None
+                reason = f"status {response.status_code}"
+            except httpx.TransportError as e:
+                # Timeouts and connection failures
+                reason = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                logger.error(f"Error verifying payment: {e}")
+                return None
+            
+            if attempt < self.verify_retries:
+                # Full jitter keeps retries from many orders from lining up
+                delay = random.uniform(0, self.verify_backoff * 2 ** attempt)
+                logger.warning(f"Payment verification for {transaction_id} got {reason}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"Payment verification for {transaction_id} gave up after {reason}")
+        return None
+    
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+instrument(KHQRPayment, KHQR, exclude=("aclose",))
 
 # For testing without real KHQR integration
 class MockKHQRPayment:
     def __init__(self):
         logger.info("Mock KHQR Payment initialized (for testing)")
     
+    def build_payment_string(self, amount, order_id, currency="USD"):
+        return f"MOCK_KHQR|ORDER_{order_id}|AMOUNT_{amount}|{currency}|TIMESTAMP_{os.urandom(4).hex()}"
+    
     def generate_payment_qr(self, amount, order_id, currency="USD"):
         """Mock KHQR implementation for testing"""
         try:
-            qr_data = f"MOCK_KHQR|ORDER_{order_id}|AMOUNT_{amount}|{currency}|TIMESTAMP_{os.urandom(4).hex()}"
-            
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            qr_filename = f"khqr_{order_id}.png"
-            img.save(qr_filename)
+            qr_data = self.build_payment_string(amount, order_id, currency)
+            buffer = io.BytesIO(render_qr_png(qr_data))
+            buffer.name = "khqr.png"
+            logger.info(f"Mock KHQR generated for order {order_id}")
+            return buffer, qr_data
             
+        except Exception as e:
+            logger.error(f"Error generating mock KHQR: {e}")
+            return None, None
+    
+    async def generate_payment_qr_async(self, amount, order_id, currency="USD"):
+        """Same as generate_payment_qr, but renders on the QR worker pool"""
+        try:
+            qr_data = self.build_payment_string(amount, order_id, currency)
+            buffer = await render_qr_async(qr_data)
             logger.info(f"Mock KHQR generated for order {order_id}")
-            return qr_filename, qr_data
+            return buffer, qr_data
             
         except Exception as e:
             logger.error(f"Error generating mock KHQR: {e}")
@@ -126,4 +260,12 @@ class MockKHQRPayment:
     def verify_payment(self, transaction_id):
         """Mock payment verification - always returns success for testing"""
         logger.info(f"Mock payment verification for {transaction_id}")
-        return {"status": "success", "transaction_id": transaction_id, "amount": "15.99", "currency": "USD"}
\ No newline at end of file
+        return {"status": "success", "transaction_id": transaction_id, "amount": "15.99", "currency": "USD"}
+    
+    async def verify_payment_async(self, transaction_id):
+        return self.verify_payment(transaction_id)
+    
+    async def aclose(self):
+        pass
+
+instrument(MockKHQRPayment, KHQR, exclude=("aclose",))
\ No newline at end of file
@@ -0,0 +1,106 @@
+"""
+EMVCo merchant-presented QR payloads as used by Bakong KHQR.
+
+A payload is a flat run of TLV fields: a 2-digit tag, a 2-digit length and
+the value. Template fields (merchant account info, additional data, the
+timestamp template) nest further TLV fields inside their value. The last
+field is always tag 63, a CRC-16/CCITT-FALSE checksum over everything
+before it including the "6304" header.
+"""
+import binascii
+import time
+
+CURRENCY_CODES = {"KHR": "116", "USD": "840"}
+
+# Tags whose value is itself a list of TLV fields
+TEMPLATE_TAGS = {f"{tag:02d}" for tag in range(26, 52)} | {"62", "64"} | {f"{tag:02d}" for tag in range(80, 100)}
+
+def crc16_ccitt(data, crc=0xFFFF):
+    """
+    CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) of `data`.
+    binascii.crc_hqx is the stdlib's table-driven CRC-CCITT; passing a
+    previous result as `crc` continues the checksum over more bytes.
+    """
+    return binascii.crc_hqx(data, crc)
+
+def tlv(tag, value):
+    value = str(value)
+    if len(value) > 99:
+        raise ValueError(f"Value for tag {tag} is longer than 99 characters")
+    return f"{tag}{len(value):02d}{value}"
+
+def decode_tlvs(data):
+    """Split a TLV string into {tag: value}, recursing into template tags"""
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        if pos + 4 > len(data):
+            raise ValueError(f"Truncated TLV header at position {pos}")
+        tag = data[pos:pos + 2]
+        length = data[pos + 2:pos + 4]
+        if not (tag.isdigit() and length.isdigit()):
+            raise ValueError(f"Malformed TLV header {data[pos:pos + 4]!r} at position {pos}")
+        end = pos + 4 + int(length)
+        if end > len(data):
+            raise ValueError(f"Value for tag {tag} runs past the end of the payload")
+        value = data[pos + 4:end]
+        fields[tag] = decode_tlvs(value) if tag in TEMPLATE_TAGS else value
+        pos = end
+    return fields
+
+def decode_payload(payload):
+    """Check the CRC of a KHQR payload and return its decoded fields"""
+    if len(payload) < 8 or payload[-8:-4] != "6304":
+        raise ValueError("Payload does not end with a CRC field")
+    expected = f"{crc16_ccitt(payload[:-4].encode('utf-8')):04X}"
+    if payload[-4:].upper() != expected:
+        raise ValueError(f"CRC mismatch: payload has {payload[-4:]}, expected {expected}")
+    return decode_tlvs(payload)
+
+class KHQRMerchantTemplate:
+    """
+    Pre-encoded static part of a merchant's KHQR payload.
+    Everything that is the same for every order (format indicator, merchant
+    account info, category code, country, name, city) is encoded once, and
+    the CRC over the leading static fields is computed up front. encode()
+    then only formats the per-order fields and finishes the checksum.
+    """
+    def __init__(self, bakong_account_id, merchant_name, merchant_city,
+                 merchant_id=None, acquiring_bank=None, category_code="5999",
+                 country_code="KH"):
+        if merchant_id:
+            # Tag 30: merchant account (account id, merchant id, bank)
+            account = tlv("00", bakong_account_id) + tlv("01", merchant_id)
+            if acquiring_bank:
+                account += tlv("02", acquiring_bank)
+            account_info = tlv("30", account)
+        else:
+            # Tag 29: individual account
+            account = tlv("00", bakong_account_id)
+            if acquiring_bank:
+                account += tlv("02", acquiring_bank)
+            account_info = tlv("29", account)
+        
+        # 01 = 12 marks a dynamic QR (amount is part of the payload)
+        self.prefix = tlv("00", "01") + tlv("01", "12") + account_info + tlv("52", category_code)
+        self.prefix_crc = crc16_ccitt(self.prefix.encode("utf-8"))
+        self.middle = tlv("58", country_code) + tlv("59", merchant_name) + tlv("60", merchant_city)
+        self.currency_fields = {currency: tlv("53", code) for currency, code in CURRENCY_CODES.items()}
+    
+    def encode(self, amount, currency="USD", bill_number=None, timestamp_ms=None):
+        currency_field = self.currency_fields.get(currency)
+        if currency_field is None:
+            raise ValueError(f"Unsupported currency {currency}")
+        # Riel has no minor unit
+        amount_value = f"{amount:.2f}" if currency == "USD" else f"{round(amount):d}"
+        
+        additional = tlv("62", tlv("01", bill_number)) if bill_number is not None else ""
+        if timestamp_ms is None:
+            timestamp_ms = time.time_ns() // 1_000_000
+        
+        dynamic = (
+            currency_field + tlv("54", amount_value) + self.middle + additional
+            + tlv("99", tlv("00", timestamp_ms)) + "6304"
+        )
+        crc = crc16_ccitt(dynamic.encode("utf-8"), self.prefix_crc)
+        return f"{self.prefix}{dynamic}{crc:04X}"
@@ -0,0 +1,337 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+
+try:
+    from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+except ImportError:
+    # Nothing raises these without python-telegram-bot; an empty tuple matches no exception
+    BadRequest = Forbidden = NetworkError = RetryAfter = ()
+
+logger = logging.getLogger(__name__)
+
+# Lower sorts first: key deliveries and other customer messages go before admin
+# traffic, and bulk broadcasts only use what capacity is left
+CUSTOMER = 0
+ADMIN = 1
+BROADCAST = 2
+
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+
+class TokenBucket:
+    """Allows `rate` sends per second on average, with bursts of up to `capacity`"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def delay(self, now):
+        """Seconds until a token is available (0 when one is available now)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+    
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "seq", "attempts", "result")
+    
+    def __init__(self, chat_id, text, kwargs, priority, seq, result):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        # Resolved True once sent, False once given up on
+        self.result = result
+    
+    def resolve(self, sent):
+        if not self.result.done():
+            self.result.set_result(sent)
+
+class MessageDispatcher:
+    """
+    Single outbound queue for messages the bot sends on its own (deliveries,
+    failure notices, admin notifications) rather than as a direct reply.
+    Sends respect a global token bucket and one per chat, customer messages
+    always go before admin ones, and messages to the same chat go out in
+    order, one at a time. A RetryAfter from Telegram pauses every send for
+    the time it asks for and the message is queued again.
+    
+    Admin notifications are sent one by one while they are rare. Once more
+    than `digest_threshold` arrive within `digest_window` seconds they are
+    collected and sent as one digest every `digest_interval` seconds.
+    """
+    def __init__(self, admin_chat_id, global_rate=30, chat_rate=1, chat_burst=1, concurrency=8,
+                 max_retries=3, digest_threshold=10, digest_window=60, digest_interval=60):
+        self.admin_chat_id = admin_chat_id
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.digest_threshold = digest_threshold
+        self.digest_window = digest_window
+        self.digest_interval = digest_interval
+        self.bot = None
+        # No burst allowance: sends are spaced evenly so no one-second window goes over the limit
+        self._global = TokenBucket(global_rate, 1, time.monotonic())
+        self._chats = {}
+        self._seq = itertools.count()
+        # (priority, seq, message) ready to go once the buckets allow
+        self._queue = []
+        # (ready at, seq, message) held back by their chat's bucket or a retry backoff
+        self._deferred = []
+        # chat id -> messages waiting for the one in flight to that chat
+        self._busy = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._admin_times = deque()
+        self._digest = []
+        self._in_flight = set()
+        self._counts = Counter()
+        self._task = None
+        self._digest_task = None
+    
+    def start(self, bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+        self._digest_task = asyncio.create_task(self._run_digest())
+    
+    async def stop(self, timeout=5.0):
+        """Flush the digest, give queued messages up to `timeout` seconds to go out, then stop"""
+        if self._digest_task is not None:
+            self._digest_task.cancel()
+            self._digest_task = None
+        self.flush_digest()
+        
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.pending():
+            logger.warning(f"Dropping {self.pending()} unsent messages on shutdown")
+            for message in self._unsent():
+                message.resolve(False)
+        
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._in_flight:
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+    
+    def send(self, chat_id, text, priority=CUSTOMER, **kwargs):
+        """
+        Queue a message; send_message keyword arguments (parse_mode etc.) pass
+        through. Returns a future that resolves to whether it was sent, which
+        callers are free to ignore.
+        """
+        result = asyncio.get_running_loop().create_future()
+        message = OutboundMessage(chat_id, text, kwargs, priority, next(self._seq), result)
+        self._counts["queued"] += 1
+        self._enqueue(message)
+        return result
+    
+    def notify_admin(self, kind, text, summary, **kwargs):
+        """
+        Send an admin notification, or fold it into the next digest when
+        notifications are arriving faster than the threshold. `kind` groups
+        it in the digest and `summary` is its one-line digest entry.
+        """
+        now = time.monotonic()
+        self._admin_times.append(now)
+        while self._admin_times and self._admin_times[0] <= now - self.digest_window:
+            self._admin_times.popleft()
+        
+        if len(self._admin_times) > self.digest_threshold:
+            self._digest.append((kind, summary))
+            self._counts["digested"] += 1
+        else:
+            self.send(self.admin_chat_id, text, priority=ADMIN, **kwargs)
+    
+    def flush_digest(self):
+        if not self._digest:
+            return
+        entries, self._digest = self._digest, []
+        kinds = Counter(kind for kind, _ in entries)
+        
+        header = "📋 *Admin Digest*\n\n" + "\n".join(f"{kind}: {count}" for kind, count in kinds.items()) + "\n"
+        lines = [header]
+        length = len(header)
+        for shown, (_, summary) in enumerate(entries):
+            # Leave room for the "...and N more" line
+            if length + len(summary) + 1 > MAX_MESSAGE_LENGTH - 32:
+                lines.append(f"...and {len(entries) - shown} more")
+                break
+            lines.append(summary)
+            length += len(summary) + 1
+        
+        self.send(self.admin_chat_id, "\n".join(lines), priority=ADMIN, parse_mode='Markdown')
+    
+    def _unsent(self):
+        yield from (entry[-1] for entry in self._queue)
+        yield from (entry[-1] for entry in self._deferred)
+        for waiting in self._busy.values():
+            yield from waiting
+    
+    def pending(self):
+        return len(self._queue) + len(self._deferred) + sum(map(len, self._busy.values())) + len(self._in_flight)
+    
+    def stats(self):
+        return {
+            "queued": len(self._queue) + len(self._deferred) + sum(map(len, self._busy.values())),
+            "in_flight": len(self._in_flight),
+            "sent": self._counts["sent"],
+            "retried": self._counts["retried"],
+            "dropped": self._counts["dropped"],
+            "digested": self._counts["digested"],
+            "awaiting_digest": len(self._digest),
+        }
+    
+    def _enqueue(self, message):
+        waiting = self._busy.get(message.chat_id)
+        if waiting is not None:
+            waiting.append(message)
+        else:
+            heapq.heappush(self._queue, (message.priority, message.seq, message))
+        self._wakeup.set()
+    
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Forget chats that have been idle long enough to refill
+                self._chats = {chat: b for chat, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+    
+    async def _next(self):
+        """Wait for the next message that the global and per-chat limits allow"""
+        while True:
+            now = time.monotonic()
+            while self._deferred and self._deferred[0][0] <= now:
+                _, _, message = heapq.heappop(self._deferred)
+                self._enqueue(message)
+            
+            wait = max(self._paused_until - now, self._global.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            
+            if not self._queue:
+                timeout = self._deferred[0][0] - now if self._deferred else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, _, message = heapq.heappop(self._queue)
+            if message.chat_id in self._busy:
+                # A message to this chat went out after this one was queued
+                self._busy[message.chat_id].append(message)
+                continue
+            bucket = self._chat_bucket(message.chat_id, now)
+            delay = bucket.delay(now)
+            if delay > 0:
+                heapq.heappush(self._deferred, (now + delay, message.seq, message))
+                continue
+            
+            bucket.take(now)
+            self._global.take(now)
+            return message
+    
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            try:
+                await slots.acquire()
+                try:
+                    message = await self._next()
+                except BaseException:
+                    slots.release()
+                    raise
+                self._busy[message.chat_id] = deque()
+                task = asyncio.create_task(self._deliver(message, slots))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Message dispatcher failed: {e}")
+                await asyncio.sleep(1)
+    
+    async def _deliver(self, message, slots):
+        retry_at = None
+        try:
+            await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+            self._counts["sent"] += 1
+            message.resolve(True)
+        except RetryAfter as e:
+            # Flood control applies to the whole bot: hold every send, not just this chat
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning(f"Telegram asked to retry after {e.retry_after}s, pausing outbound messages")
+            self._counts["retried"] += 1
+            retry_at = 0.0
+        except (BadRequest, Forbidden) as e:
+            logger.error(f"Could not send message to {message.chat_id}: {e}")
+            self._counts["dropped"] += 1
+            message.resolve(False)
+        except NetworkError as e:
+            message.attempts += 1
+            if message.attempts > self.max_retries:
+                logger.error(f"Giving up on message to {message.chat_id} after {message.attempts} attempts: {e}")
+                self._counts["dropped"] += 1
+                message.resolve(False)
+            else:
+                self._counts["retried"] += 1
+                retry_at = time.monotonic() + 2 ** message.attempts
+        except asyncio.CancelledError:
+            message.resolve(False)
+            raise
+        except Exception as e:
+            logger.error(f"Could not send message to {message.chat_id}: {e}")
+            self._counts["dropped"] += 1
+            message.resolve(False)
+        finally:
+            # Release the chat. A retried message keeps its place: the messages
+            # queued behind it wait for the retry too, so the chat stays in order
+            waiting = self._busy.pop(message.chat_id, ())
+            if retry_at is not None:
+                for queued in (message, *waiting):
+                    heapq.heappush(self._deferred, (retry_at, queued.seq, queued))
+            else:
+                for queued in waiting:
+                    heapq.heappush(self._queue, (queued.priority, queued.seq, queued))
+            self._wakeup.set()
+            slots.release()
+    
+    async def _run_digest(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            try:
+                self.flush_digest()
+            except Exception as e:
+                logger.error(f"Admin digest failed: {e}")
@@ -0,0 +1,166 @@
+"""
+In-process latency histograms and error counters, served in the Prometheus
+text exposition format.
+
+Timing a call costs two perf_counter() reads, a bisect and a few attribute
+updates. Updates are not locked: Database methods are timed from the
+executor threads, and losing the odd increment to a thread switch is an
+acceptable price for keeping the hot path free of locks.
+
+Database imports this module, so it avoids importing asyncio and inspect at
+load time; they would be most of a cold start's import cost.
+"""
+import functools
+import logging
+import time
+from bisect import bisect_left
+from types import FunctionType
+
+logger = logging.getLogger(__name__)
+
+# inspect.CO_COROUTINE: set on the code object of every `async def` function
+CO_COROUTINE = 0x80
+
+def is_coroutine_function(func):
+    return isinstance(func, FunctionType) and bool(func.__code__.co_flags & CO_COROUTINE)
+
+# Upper bounds in seconds, from a cached catalog read to a slow bank round-trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Latency histogram for one label value, plus a count of calls that raised"""
+    __slots__ = ("bounds", "counts", "sum", "errors")
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; cumulated only when exported
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.errors = 0
+
+class Family:
+    """Histograms sharing a metric name, one per value of a single label"""
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.children = {}
+    
+    def child(self, value):
+        histogram = self.children.get(value)
+        if histogram is None:
+            histogram = self.children[value] = Histogram(self.buckets)
+        return histogram
+    
+    def timed(self, value):
+        """Decorator recording each call of a sync or async function under `value`"""
+        histogram = self.child(value)
+        # Bound to locals so the wrappers do no lookups beyond the histogram's own fields
+        clock = time.perf_counter
+        bounds = histogram.bounds
+        counts = histogram.counts
+        
+        def decorate(func):
+            if is_coroutine_function(func):
+                @functools.wraps(func)
+                async def timed_async(*args, **kwargs):
+                    started = clock()
+                    try:
+                        return await func(*args, **kwargs)
+                    except BaseException:
+                        histogram.errors += 1
+                        raise
+                    finally:
+                        elapsed = clock() - started
+                        counts[bisect_left(bounds, elapsed)] += 1
+                        histogram.sum += elapsed
+                return timed_async
+            
+            @functools.wraps(func)
+            def timed_sync(*args, **kwargs):
+                started = clock()
+                try:
+                    return func(*args, **kwargs)
+                except BaseException:
+                    histogram.errors += 1
+                    raise
+                finally:
+                    elapsed = clock() - started
+                    counts[bisect_left(bounds, elapsed)] += 1
+                    histogram.sum += elapsed
+            return timed_sync
+        return decorate
+    
+    def render(self, lines):
+        lines.append(f"# HELP {self.name}_seconds {self.help_text}")
+        lines.append(f"# TYPE {self.name}_seconds histogram")
+        for value, histogram in sorted(self.children.items()):
+            label = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += histogram.counts[-1]
+            lines.append(f'{self.name}_seconds_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_seconds_sum{{{label}}} {histogram.sum}")
+            lines.append(f"{self.name}_seconds_count{{{label}}} {cumulative}")
+        lines.append(f"# HELP {self.name}_errors_total Calls that raised, by {self.label}")
+        lines.append(f"# TYPE {self.name}_errors_total counter")
+        for value, histogram in sorted(self.children.items()):
+            lines.append(f'{self.name}_errors_total{{{self.label}="{value}"}} {histogram.errors}')
+
+HANDLER = Family("jomnenh_handler", "Bot handler latency", "handler")
+DB_QUERY = Family("jomnenh_db_query", "Database method latency, measured on the executor thread", "method")
+KHQR = Family("jomnenh_khqr", "KHQR payload, QR render and payment verification latency", "call")
+FAMILIES = (HANDLER, DB_QUERY, KHQR)
+
+def instrument(cls, family, coroutines_only=False, include=(), exclude=()):
+    """Time every public method defined on `cls`, plus the private ones named in `include`"""
+    for name, func in list(vars(cls).items()):
+        if not isinstance(func, FunctionType) or name in exclude:
+            continue
+        if name.startswith("_") and name not in include:
+            continue
+        if coroutines_only and not is_coroutine_function(func):
+            continue
+        setattr(cls, name, family.timed(name)(func))
+    return cls
+
+def render():
+    """Every family in Prometheus text exposition format"""
+    lines = []
+    for family in FAMILIES:
+        family.render(lines)
+    return "\n".join(lines) + "\n"
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Drain the headers; the request body, if any, is ignored
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.error(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+async def start_server(host="127.0.0.1", port=9464):
+    """Serve GET /metrics on host:port from the running event loop; returns the asyncio server"""
+    import asyncio
+    
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
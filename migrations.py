@@ -0,0 +1,508 @@
+"""
+Versioned schema migrations.
+
+The schema version lives in SQLite's PRAGMA user_version. Each migration
+runs in its own transaction together with the version bump, so a crash
+part-way through leaves the database at the last fully applied version.
+Append new migrations to MIGRATIONS; never edit one that has shipped.
+Statements use IF NOT EXISTS so databases created before versioning
+(user_version 0 with tables already present) upgrade cleanly.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+def initial_schema(cursor):
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            balance REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Products table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            category TEXT,
+            stock INTEGER DEFAULT 0,
+            is_digital BOOLEAN DEFAULT FALSE,
+            digital_key TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Orders table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER DEFAULT 1,
+            total_amount REAL,
+            khqr_transaction_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    ''')
+
+def digital_key_inventory(cursor):
+    # Digital key inventory: one row per sellable unit.
+    # order_id is NULL while the key is free, set when an order reserves it,
+    # and claimed_at is stamped when the key is delivered.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS digital_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            key_value TEXT NOT NULL,
+            order_id INTEGER,
+            claimed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (product_id) REFERENCES products (id),
+            FOREIGN KEY (order_id) REFERENCES orders (id)
+        )
+    ''')
+    # Only free keys live in this index, so finding the next one is a
+    # single seek no matter how many keys have been sold
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_digital_keys_free
+        ON digital_keys (product_id, id) WHERE order_id IS NULL
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_digital_keys_order
+        ON digital_keys (order_id) WHERE order_id IS NOT NULL
+    ''')
+    
+    # products.stock of a digital product is the number of free keys.
+    # These triggers keep it in step with every key insert/reserve/release.
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_digital_keys_insert
+        AFTER INSERT ON digital_keys WHEN NEW.order_id IS NULL
+        BEGIN
+            UPDATE products SET stock = stock + 1 WHERE id = NEW.product_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_digital_keys_delete
+        AFTER DELETE ON digital_keys WHEN OLD.order_id IS NULL
+        BEGIN
+            UPDATE products SET stock = stock - 1 WHERE id = OLD.product_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_digital_keys_reserve
+        AFTER UPDATE OF order_id ON digital_keys
+        WHEN OLD.order_id IS NULL AND NEW.order_id IS NOT NULL
+        BEGIN
+            UPDATE products SET stock = stock - 1 WHERE id = NEW.product_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_digital_keys_release
+        AFTER UPDATE OF order_id ON digital_keys
+        WHEN OLD.order_id IS NOT NULL AND NEW.order_id IS NULL
+        BEGIN
+            UPDATE products SET stock = stock + 1 WHERE id = NEW.product_id;
+        END
+    ''')
+    
+    # Databases created before per-unit keys hold one shared key per
+    # product; turn its remaining stock into that many free key rows
+    cursor.execute('''
+        SELECT id, stock, digital_key FROM products p
+        WHERE is_digital AND digital_key IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM digital_keys k WHERE k.product_id = p.id)
+    ''')
+    for product_id, stock, digital_key in cursor.fetchall():
+        stock = max(stock or 0, 0)
+        cursor.execute("UPDATE products SET stock = 0 WHERE id = ?", (product_id,))
+        cursor.executemany(
+            "INSERT INTO digital_keys (product_id, key_value) VALUES (?, ?)",
+            [(product_id, digital_key)] * stock
+        )
+        # Pending orders already took their units out of stock: give each one
+        # key per unit, reserved to it, so paying delivers them and expiring
+        # returns them. Reserved inserts leave stock alone.
+        cursor.execute('''
+            SELECT id, COALESCE(quantity, 1) FROM orders
+            WHERE product_id = ? AND status = 'pending'
+        ''', (product_id,))
+        reserved = [
+            (product_id, digital_key, order_id)
+            for order_id, quantity in cursor.fetchall() for _ in range(quantity)
+        ]
+        cursor.executemany(
+            "INSERT INTO digital_keys (product_id, key_value, order_id) VALUES (?, ?, ?)",
+            reserved
+        )
+        logger.info(
+            f"Moved {stock} units of product {product_id} into digital_keys, "
+            f"{len(reserved)} reserved for pending orders"
+        )
+
+def hot_path_indexes(cursor):
+    # get_user_orders: WHERE user_id = ? with keyset paging on id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, id)")
+
+STATS_REBUILD_SQL = '''
+    UPDATE stats SET
+        total_users = (SELECT COUNT(*) FROM users),
+        total_orders = (SELECT COUNT(*) FROM orders),
+        completed_orders = (SELECT COUNT(*) FROM orders WHERE status = 'completed'),
+        total_revenue = (SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE status = 'completed')
+    WHERE id = 1
+'''
+
+def business_stats(cursor):
+    # Single-row counters for the admin statistics panel, kept current by
+    # triggers in the same transaction as the write that changes them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            total_orders INTEGER NOT NULL DEFAULT 0,
+            completed_orders INTEGER NOT NULL DEFAULT 0,
+            total_revenue REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO stats (id) VALUES (1)")
+    cursor.execute(STATS_REBUILD_SQL)
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE stats SET total_users = total_users + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_delete
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE stats SET total_users = total_users - 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_order_insert
+        AFTER INSERT ON orders
+        BEGIN
+            UPDATE stats SET
+                total_orders = total_orders + 1,
+                completed_orders = completed_orders + (NEW.status = 'completed'),
+                total_revenue = total_revenue
+                    + CASE WHEN NEW.status = 'completed' THEN NEW.total_amount ELSE 0 END
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_order_update
+        AFTER UPDATE OF status, total_amount ON orders
+        BEGIN
+            UPDATE stats SET
+                completed_orders = completed_orders
+                    + (NEW.status = 'completed') - (OLD.status = 'completed'),
+                total_revenue = total_revenue
+                    + CASE WHEN NEW.status = 'completed' THEN NEW.total_amount ELSE 0 END
+                    - CASE WHEN OLD.status = 'completed' THEN OLD.total_amount ELSE 0 END
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_order_delete
+        AFTER DELETE ON orders
+        BEGIN
+            UPDATE stats SET
+                total_orders = total_orders - 1,
+                completed_orders = completed_orders - (OLD.status = 'completed'),
+                total_revenue = total_revenue
+                    - CASE WHEN OLD.status = 'completed' THEN OLD.total_amount ELSE 0 END
+            WHERE id = 1;
+        END
+    ''')
+
+def pending_order_index(cursor):
+    # Pending orders by age: payment poller start-up and expiry scans
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)")
+
+def broadcasts(cursor):
+    # Admin broadcasts. last_user_id is the checkpoint: every user up to it
+    # has been handed a message, so a resumed broadcast carries on after it.
+    # claimed counts those users; any not in sent or failed were lost to a
+    # crash and are counted as failed when the broadcast resumes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            claimed INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    # At most one broadcast runs at a time
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_broadcasts_running
+        ON broadcasts (status) WHERE status = 'running'
+    ''')
+
+def wallet_ledger(cursor):
+    # Prepaid wallet. Money is integer cents. wallet_ledger is append-only:
+    # top-ups are positive rows, purchases negative ones, and
+    # users.balance_cents is a running total kept by the insert trigger,
+    # which also refuses any row that would take a balance below zero.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            order_id INTEGER,
+            topup_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (order_id) REFERENCES orders (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_user ON wallet_ledger (user_id, id)")
+    # Top-ups waiting for their KHQR payment, polled like pending orders
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_topups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            khqr_transaction_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_wallet_topups_status_created
+        ON wallet_topups (status, created_at)
+    ''')
+    
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(users)")}
+    if "balance_cents" not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN balance_cents INTEGER NOT NULL DEFAULT 0")
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_wallet_ledger_insert
+        BEFORE INSERT ON wallet_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'insufficient wallet balance')
+            WHERE COALESCE((SELECT balance_cents FROM users WHERE user_id = NEW.user_id), 0)
+                + NEW.amount_cents < 0;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_wallet_ledger_balance
+        AFTER INSERT ON wallet_ledger
+        BEGIN
+            UPDATE users SET balance_cents = balance_cents + NEW.amount_cents
+            WHERE user_id = NEW.user_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_wallet_ledger_no_update
+        BEFORE UPDATE ON wallet_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'wallet_ledger is append-only');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_wallet_ledger_no_delete
+        BEFORE DELETE ON wallet_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'wallet_ledger is append-only');
+        END
+    ''')
+    
+    # Carry any balance held in the old REAL column over as an opening entry
+    cursor.execute('''
+        INSERT INTO wallet_ledger (user_id, amount_cents, kind)
+        SELECT user_id, CAST(ROUND(balance * 100) AS INTEGER), 'opening'
+        FROM users WHERE CAST(ROUND(balance * 100) AS INTEGER) > 0
+    ''')
+
+def order_items_and_carts(cursor):
+    # Line items: an order may now hold several products. orders.product_id
+    # and orders.quantity keep the first product and the total units, so
+    # listings that join on them still work.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders (id),
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+    # Every existing order becomes a single line
+    cursor.execute('''
+        INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+        SELECT id, product_id, COALESCE(quantity, 1), COALESCE(total_amount, 0) / MAX(COALESCE(quantity, 1), 1)
+        FROM orders o
+        WHERE product_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id)
+    ''')
+    
+    # Per-user cart, one row per product; checkout turns it into one order
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            user_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL CHECK (quantity > 0),
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+def product_search(cursor):
+    # Full-text index over product names and descriptions. It is an
+    # external-content table: products holds the text, products_fts only the
+    # index, and the triggers below keep the two in step. prefix='2 3' indexes
+    # short prefixes so search-as-you-type queries ("win*") stay cheap.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert
+        AFTER INSERT ON products
+        BEGIN
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (NEW.id, NEW.name, NEW.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete
+        AFTER DELETE ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.description);
+        END
+    ''')
+    # Only text changes touch the index; stock updates on every sale do not
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+        AFTER UPDATE OF name, description ON products
+        BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', OLD.id, OLD.name, OLD.description);
+            INSERT INTO products_fts (rowid, name, description)
+            VALUES (NEW.id, NEW.name, NEW.description);
+        END
+    ''')
+
+def drop_unused_indexes(cursor):
+    # Development builds of migration 3 also indexed orders by status and
+    # products by category. Status counts come from the stats table and
+    # category listings from the catalog cache, so on databases that have
+    # them these indexes only slow down every write.
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_status")
+    cursor.execute("DROP INDEX IF EXISTS idx_products_category")
+
+def catalog_version(cursor):
+    # Products and keys are loaded by scripts over their own connections, so
+    # the catalog cache takes its version from here rather than counting its
+    # own writes. Every products write bumps `version` (key inserts and
+    # reservations reach it through the stock triggers); writes that can
+    # change a name or description also bump `text_version`.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0,
+            text_version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id) VALUES (1)")
+    for event in ("INSERT", "DELETE"):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_catalog_version_{event.lower()}
+            AFTER {event} ON products
+            BEGIN
+                UPDATE catalog_version SET version = version + 1, text_version = text_version + 1
+                WHERE id = 1;
+            END
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_version_update
+        AFTER UPDATE ON products
+        BEGIN
+            UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_version_text
+        AFTER UPDATE OF name, description ON products
+        BEGIN
+            UPDATE catalog_version SET text_version = text_version + 1 WHERE id = 1;
+        END
+    ''')
+
+# (version, description, function) in the order they must be applied
+MIGRATIONS = [
+    (1, "initial schema", initial_schema),
+    (2, "per-unit digital key inventory", digital_key_inventory),
+    (3, "hot-path indexes", hot_path_indexes),
+    (4, "incrementally maintained business stats", business_stats),
+    (5, "pending order index", pending_order_index),
+    (6, "admin broadcasts", broadcasts),
+    (7, "prepaid wallet ledger", wallet_ledger),
+    (8, "order line items and carts", order_items_and_carts),
+    (9, "product full-text search", product_search),
+    (10, "drop unused indexes", drop_unused_indexes),
+    (11, "database-side catalog version", catalog_version),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Apply every pending migration and return the resulting schema version"""
+    version = get_version(conn)
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        if get_version(conn) >= target:
+            # Another process applied it while we waited for the write lock
+            conn.rollback()
+            version = target
+            continue
+        try:
+            apply(cursor)
+            # PRAGMA does not take bound parameters; target is an int we own
+            cursor.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {target}: {description}")
+        version = target
+    return version
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class OrderSweeper:
+    """
+    Periodically expires pending orders older than `ttl` and hands their
+    reserved stock back. Each sweep is one transaction covering up to
+    `batch_size` orders; a full batch is followed straight away by another
+    sweep so a large backlog drains without waiting for the next interval.
+    `on_expired` receives the ids of every batch that was expired.
+    """
+    def __init__(self, db, ttl=3600, interval=60, batch_size=500, on_expired=None):
+        self.db = db
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_expired = on_expired
+        self.expired_orders = 0
+        self.released_units = 0
+        self._task = None
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def sweep(self):
+        """Run sweeps until the backlog is drained; returns (orders, units) released"""
+        orders = units = 0
+        while True:
+            order_ids, released = await self.db.expire_pending_orders(self.ttl, self.batch_size)
+            if order_ids and self.on_expired:
+                self.on_expired(order_ids)
+            orders += len(order_ids)
+            units += released
+            if len(order_ids) < self.batch_size:
+                break
+        if orders:
+            self.expired_orders += orders
+            self.released_units += units
+            logger.info(f"Expired {orders} abandoned orders, released {units} units of stock")
+        return orders, units
+    
+    def stats(self):
+        return {"expired_orders": self.expired_orders, "released_units": self.released_units}
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Order sweep failed: {e}")
+            await asyncio.sleep(self.interval)
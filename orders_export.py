@@ -0,0 +1,77 @@
+import csv
+import gzip
+import io
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+HEADER = (
+    "order_id", "created_at", "user_id", "username", "status", "quantity",
+    "total_amount", "transaction_id", "items",
+)
+# Largest document a bot may upload
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+async def export_orders(db, since=None, until=None, status=None, compress=False,
+                        chunk_size=1000, spool_size=1024 * 1024, part_size=10 * 1024 * 1024):
+    """
+    Write the orders matching the filters as CSV, gzip-compressed if
+    `compress`, yielding (file, rows) for each part with the file rewound.
+    Orders are read `chunk_size` at a time through the id keyset cursor of
+    Database.get_orders_chunk and written as each chunk arrives. Output goes
+    to a SpooledTemporaryFile that moves to disk past `spool_size` bytes.
+    A part ends at the first chunk that takes it past `part_size` bytes and
+    the next one starts with its own header, so each part is a complete file:
+    uploading a document reads it into memory whole, and parts keep that to
+    about `part_size` bytes whatever the number of orders. The caller closes
+    each file.
+    """
+    after_id = 0
+    parts = 0
+    finished = False
+    while not finished:
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        try:
+            raw = gzip.GzipFile(fileobj=spool, mode="wb") if compress else spool
+            text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(HEADER)
+            rows = 0
+            while True:
+                chunk = await db.get_orders_chunk(after_id, chunk_size, since, until, status)
+                if chunk is None:
+                    raise RuntimeError(f"could not read orders after id {after_id}")
+                writer.writerows(chunk)
+                rows += len(chunk)
+                if len(chunk) < chunk_size:
+                    finished = True
+                    break
+                after_id = chunk[-1][0]
+                text.flush()
+                if spool.tell() >= part_size:
+                    break
+            
+            text.flush()
+            # Hand the stream back without closing it
+            text.detach()
+            if compress:
+                # Writes the gzip trailer; GzipFile leaves a passed-in fileobj open
+                raw.close()
+            spool.seek(0)
+        except Exception:
+            spool.close()
+            raise
+        if parts and not rows:
+            # The previous part ended exactly on the last order
+            spool.close()
+            break
+        parts += 1
+        logger.info(f"Exported part {parts}: {rows} orders ({spool_bytes(spool)} bytes)")
+        yield spool, rows
+
+def spool_bytes(spool):
+    """Size of a rewound spooled export"""
+    size = spool.seek(0, io.SEEK_END)
+    spool.seek(0)
+    return size
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+class PendingPayment:
+    __slots__ = ("order_id", "user_id", "product_id", "total_amount", "created_at", "attempts", "next_check")
+    
+    def __init__(self, order_id, user_id, product_id, total_amount, created_at, next_check):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.product_id = product_id
+        self.total_amount = total_amount
+        # Wall-clock creation time (epoch seconds), used for the payment timeout
+        self.created_at = created_at
+        self.attempts = 0
+        # time.monotonic() deadline for the next verification
+        self.next_check = next_check
+
+class PaymentPoller:
+    """
+    Single scheduler for every pending KHQR payment.
+    Pending orders are loaded from the orders table on start, so nothing is
+    lost across restarts. Each tick takes up to `batch_size` due orders and
+    verifies them together, with at most `concurrency` requests in flight.
+    An order that is still unpaid is checked again after a delay that
+    grows with each attempt, and is failed once it is older than `timeout`.
+    `load_pending` and `txn_prefix` let the same scheduler poll other KHQR
+    bills, such as wallet top-ups, from their own table.
+    """
+    def __init__(self, db, khqr, on_paid, on_failed, initial_delay=10, min_interval=5,
+                 max_interval=60, timeout=900, batch_size=50, concurrency=10, tick=1.0,
+                 load_pending=None, txn_prefix="txn_"):
+        self.db = db
+        self.load_pending = load_pending or db.get_pending_orders
+        self.txn_prefix = txn_prefix
+        self.khqr = khqr
+        self.on_paid = on_paid
+        self.on_failed = on_failed
+        self.initial_delay = initial_delay
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.tick = tick
+        self._pending = {}
+        self._schedule = []
+        self._in_flight = 0
+        self._task = None
+    
+    async def start(self):
+        rows = await self.load_pending()
+        now = time.monotonic()
+        for order_id, user_id, product_id, total_amount, created_at in rows:
+            created = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+            # Resumed orders were waiting already, check them straight away
+            self._push(PendingPayment(order_id, user_id, product_id, total_amount, created, now))
+        logger.info(f"Payment poller started with {len(rows)} pending orders")
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def add(self, order_id, user_id, product_id, total_amount):
+        """Track a newly created order; its first check runs after initial_delay"""
+        self._push(PendingPayment(
+            order_id, user_id, product_id, total_amount, time.time(), time.monotonic() + self.initial_delay
+        ))
+    
+    def discard(self, order_ids):
+        """Stop tracking orders settled elsewhere, e.g. expired by the sweeper"""
+        for order_id in order_ids:
+            self._pending.pop(order_id, None)
+    
+    def stats(self):
+        """Queue depth, in-flight checks and how far the most overdue order is behind schedule"""
+        now = time.monotonic()
+        lag = 0.0
+        while self._schedule and self._schedule[0][1] not in self._pending:
+            heapq.heappop(self._schedule)
+        if self._schedule:
+            lag = max(0.0, now - self._schedule[0][0])
+        return {"queue_depth": len(self._pending), "in_flight": self._in_flight, "lag_seconds": lag}
+    
+    def _push(self, payment):
+        self._pending[payment.order_id] = payment
+        heapq.heappush(self._schedule, (payment.next_check, payment.order_id))
+    
+    def _due(self, now):
+        batch = []
+        while self._schedule and len(batch) < self.batch_size and self._schedule[0][0] <= now:
+            next_check, order_id = heapq.heappop(self._schedule)
+            payment = self._pending.get(order_id)
+            # Skip heap entries left behind by a reschedule or a finished order
+            if payment is not None and payment.next_check == next_check:
+                batch.append(payment)
+        return batch
+    
+    async def _run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            try:
+                batch = self._due(time.monotonic())
+                if batch:
+                    self._in_flight += len(batch)
+                    await asyncio.gather(*(self._check(payment, slots) for payment in batch))
+                    # A full batch means more may be due: go again without sleeping
+                    if len(batch) == self.batch_size:
+                        continue
+                await asyncio.sleep(self.tick)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Payment poller tick failed: {e}")
+                await asyncio.sleep(self.tick)
+    
+    async def _check(self, payment, slots):
+        try:
+            async with slots:
+                result = await self.khqr.verify_payment_async(f"{self.txn_prefix}{payment.order_id}")
+            status = result.get("status") if result else None
+            
+            if payment.order_id not in self._pending:
+                # Discarded while the check was in flight
+                return
+            if status == "success":
+                await self.on_paid(payment, result)
+                self._pending.pop(payment.order_id, None)
+            elif status == "failed" or time.time() - payment.created_at > self.timeout:
+                await self.on_failed(payment)
+                self._pending.pop(payment.order_id, None)
+            else:
+                # Not paid yet: back off, fresh orders are checked most often
+                payment.attempts += 1
+                delay = min(self.max_interval, self.min_interval * 1.5 ** payment.attempts)
+                payment.next_check = time.monotonic() + delay
+                heapq.heappush(self._schedule, (payment.next_check, payment.order_id))
+        except Exception as e:
+            logger.error(f"Error checking payment for order {payment.order_id}: {e}")
+            # Still tracked (the callback failed or verification raised): retry later
+            if payment.order_id in self._pending:
+                payment.next_check = time.monotonic() + self.min_interval
+                heapq.heappush(self._schedule, (payment.next_check, payment.order_id))
+        finally:
+            self._in_flight -= 1
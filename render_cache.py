@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+class RenderCache:
+    """
+    LRU cache of finished catalog views (message text + keyboard).
+    Entries are tagged with the catalog version they were rendered from and
+    are ignored once the catalog has moved on. Only used from the event loop,
+    so no locking is needed.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, version):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, key, version, view):
+        self._entries[key] = (version, view)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
@@ -4,9 +4,10 @@ import os
 
 def install_packages():
     packages = [
-        "python-telegram-bot==20.7",
+        "python-telegram-bot[webhooks]==20.7",
         "qrcode[pil]==7.4.2", 
         "requests==2.31.0",
+        "httpx==0.25.2",
         "python-dotenv==1.0.0",
         "Pillow==10.0.1"
     ]
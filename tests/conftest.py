@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the bot's modules the way the benchmarks do, from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+@pytest.fixture
+def db(tmp_path):
+    """A fresh database with customer 1 and two extra keys for product 1"""
+    db = Database(str(tmp_path / "bot.db"))
+    db.add_user(1, "alice", "Alice", "A")
+    db.add_digital_keys(1, ["KEY-1", "KEY-2"])
+    yield db
+    db.close()
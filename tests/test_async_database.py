@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import Database
+
+@pytest.fixture
+def adb(tmp_path):
+    adb = AsyncDatabase(Database(str(tmp_path / "async.db")), max_workers=4)
+    yield adb
+    adb.close()
+
+def test_slow_query_does_not_delay_other_handlers(adb):
+    release = threading.Event()
+    
+    def slow_query(db):
+        # Holds its worker the way a long query or a locked database would
+        db.get_connection().execute("SELECT 1").fetchone()
+        release.wait(10)
+        return "slow"
+    
+    async def scenario():
+        slow = asyncio.create_task(adb.run(slow_query, adb.sync))
+        await asyncio.sleep(0)
+        # Every other handler finishes while the slow query is still running
+        results = await asyncio.wait_for(asyncio.gather(*(adb.get_user_orders(1) for _ in range(50))), 5)
+        assert not slow.done()
+        release.set()
+        return results, await slow
+    
+    try:
+        results, slow = asyncio.run(scenario())
+    finally:
+        release.set()
+    assert [orders for orders, _, _ in results] == [[]] * 50
+    assert slow == "slow"
+
+def test_event_loop_keeps_running_during_a_query(adb):
+    release = threading.Event()
+    
+    async def scenario():
+        query = asyncio.create_task(adb.run(lambda: release.wait(10)))
+        ticks = 0
+        for _ in range(20):
+            await asyncio.sleep(0.001)
+            ticks += 1
+        release.set()
+        await query
+        return ticks
+    
+    try:
+        assert asyncio.run(scenario()) == 20
+    finally:
+        release.set()
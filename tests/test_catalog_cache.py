@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+
+from database import Database
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "catalog.db"))
+    yield db
+    db.close()
+
+@pytest.fixture
+def script(db):
+    """A second connection, like a script loading products and keys"""
+    conn = sqlite3.connect(db.db_name)
+    yield conn
+    conn.close()
+
+def test_products_added_by_another_connection_are_listed(db, script):
+    before = len(db.get_products())
+    with script:
+        script.execute(
+            "INSERT INTO products (name, description, price, category, stock, is_digital) "
+            "VALUES ('Xbox Game Pass', '', 9.99, 'games', 5, 0)"
+        )
+    names = [row[1] for row in db.get_products()]
+    assert len(names) == before + 1
+    assert "Xbox Game Pass" in names
+    assert db.search_products("xbox")[0][1] == "Xbox Game Pass"
+
+def test_keys_added_by_another_connection_restock(db, script):
+    product_id = db.get_products()[0][0]
+    stock = db.get_product(product_id)[5]
+    with script:
+        script.executemany(
+            "INSERT INTO digital_keys (product_id, key_value) VALUES (?, ?)",
+            [(product_id, f"SCRIPT-{n}") for n in range(3)]
+        )
+    assert db.get_product(product_id)[5] == stock + 3
+
+def test_stock_changes_keep_the_text_version(db):
+    version, text_version = db.catalog.version(), db.catalog.text_version()
+    assert db.create_order(1, 1, 1, 15.99) is not None
+    assert db.catalog.version() > version
+    assert db.catalog.text_version() == text_version
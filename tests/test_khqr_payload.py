@@ -0,0 +1,77 @@
+import pytest
+
+from khqr_payload import KHQRMerchantTemplate, crc16_ccitt, decode_payload, decode_tlvs, tlv
+
+TIMESTAMP_MS = 1700000000000
+
+INDIVIDUAL = KHQRMerchantTemplate("jomnenh@aclb", "JomNenh Store", "Phnom Penh")
+MERCHANT = KHQRMerchantTemplate(
+    "jomnenh@aclb", "JomNenh Store", "Phnom Penh", merchant_id="123456", acquiring_bank="ACLEDA"
+)
+
+def test_crc_check_value():
+    # Standard check value for CRC-16/CCITT-FALSE
+    assert crc16_ccitt(b"123456789") == 0x29B1
+    # Continuing from a previous result gives the CRC of the concatenation
+    assert crc16_ccitt(b"56789", crc16_ccitt(b"1234")) == 0x29B1
+
+@pytest.mark.parametrize("template, account_tag", [(INDIVIDUAL, "29"), (MERCHANT, "30")])
+@pytest.mark.parametrize("amount, currency, expected_amount, expected_currency", [
+    (15.99, "USD", "15.99", "840"),
+    (0.5, "USD", "0.50", "840"),
+    (40000, "KHR", "40000", "116"),
+    (40000.4, "KHR", "40000", "116"),
+])
+def test_round_trip(template, account_tag, amount, currency, expected_amount, expected_currency):
+    payload = template.encode(amount, currency, bill_number="42", timestamp_ms=TIMESTAMP_MS)
+    fields = decode_payload(payload)
+    assert fields["54"] == expected_amount
+    assert fields["53"] == expected_currency
+    assert fields["62"] == {"01": "42"}
+    assert fields["99"] == {"00": str(TIMESTAMP_MS)}
+    assert fields[account_tag]["00"] == "jomnenh@aclb"
+    assert fields["58"] == "KH"
+    assert list(fields)[-1] == "63"
+
+def test_merchant_account_fields():
+    fields = decode_payload(MERCHANT.encode(1, bill_number="1", timestamp_ms=TIMESTAMP_MS))
+    assert fields["30"] == {"00": "jomnenh@aclb", "01": "123456", "02": "ACLEDA"}
+
+def test_template_matches_a_full_encode():
+    payload = (
+        tlv("00", "01") + tlv("01", "12") + tlv("29", tlv("00", "jomnenh@aclb")) + tlv("52", "5999")
+        + tlv("53", "840") + tlv("54", "15.99") + tlv("58", "KH")
+        + tlv("59", "JomNenh Store") + tlv("60", "Phnom Penh")
+        + tlv("62", tlv("01", "42")) + tlv("99", tlv("00", TIMESTAMP_MS)) + "6304"
+    )
+    payload += f"{crc16_ccitt(payload.encode('utf-8')):04X}"
+    assert INDIVIDUAL.encode(15.99, "USD", bill_number="42", timestamp_ms=TIMESTAMP_MS) == payload
+
+def test_unsupported_currency():
+    with pytest.raises(ValueError):
+        INDIVIDUAL.encode(1, "EUR")
+
+def test_corrupted_payload_fails_the_crc_check():
+    payload = INDIVIDUAL.encode(15.99, "USD", bill_number="42", timestamp_ms=TIMESTAMP_MS)
+    with pytest.raises(ValueError, match="CRC mismatch"):
+        decode_payload(payload.replace("15.99", "15.98"))
+
+@pytest.mark.parametrize("payload", ["", "000201", "0002016305ABCD"])
+def test_payload_without_crc_field(payload):
+    with pytest.raises(ValueError, match="CRC field"):
+        decode_payload(payload)
+
+@pytest.mark.parametrize("data, message", [
+    ("000", "Truncated TLV header"),
+    ("AB0201", "Malformed TLV header"),
+    ("00X201", "Malformed TLV header"),
+    ("0005012", "runs past the end"),
+    ("2906000501", "runs past the end"),
+])
+def test_malformed_tlv(data, message):
+    with pytest.raises(ValueError, match=message):
+        decode_tlvs(data)
+
+def test_overlong_value():
+    with pytest.raises(ValueError):
+        tlv("59", "x" * 100)
@@ -0,0 +1,41 @@
+import sqlite3
+
+from database import Database
+from migrations import initial_schema
+
+def legacy_db(path):
+    """A database from before schema versioning: one shared key per product"""
+    conn = sqlite3.connect(path)
+    initial_schema(conn.cursor())
+    conn.execute('''
+        INSERT INTO products (id, name, price, stock, is_digital, digital_key)
+        VALUES (1, 'Legacy Key', 9.99, 5, 1, 'LEGACY-KEY')
+    ''')
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'alice')")
+    # Two units already taken out of stock by an unpaid order
+    for order_id in (1, 2):
+        conn.execute('''
+            INSERT INTO orders (id, user_id, product_id, quantity, total_amount, status)
+            VALUES (?, 1, 1, 2, 19.98, 'pending')
+        ''', (order_id,))
+    conn.commit()
+    conn.close()
+    return Database(path)
+
+def test_legacy_pending_orders_get_reserved_keys(tmp_path):
+    db = legacy_db(str(tmp_path / "legacy.db"))
+    try:
+        # Free stock is untouched; each pending order holds its own units
+        assert db.get_product(1)[5] == 5
+        assert db.get_order_keys(1) == ["LEGACY-KEY", "LEGACY-KEY"]
+        
+        # Paying delivers the reserved keys
+        assert db.update_order_status(1, "completed", "txn_1") is True
+        assert db.get_order_keys(1) == ["LEGACY-KEY", "LEGACY-KEY"]
+        
+        # Expiring hands the units back to the catalog
+        assert db.update_order_status(2, "expired") is True
+        assert db.get_order_keys(2) == []
+        assert db.get_product(1)[5] == 7
+    finally:
+        db.close()
@@ -0,0 +1,33 @@
+from database import ORDER_MISSING
+
+def test_pending_order_completes_and_claims_its_keys(db):
+    order_id = db.create_order(1, 1, 1, 15.99)
+    assert db.update_order_status(order_id, "completed", f"txn_{order_id}") is True
+    assert db.get_order_status(order_id) == "completed"
+    assert db.get_order_keys(order_id)
+
+def test_expired_order_is_not_completed(db):
+    order_id = db.create_order(1, 1, 1, 15.99)
+    stock = db.get_product(1)[5]
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE orders SET created_at = datetime('now', '-1 hour') WHERE id = ?", (order_id,))
+    db.expire_pending_orders(60)
+    assert db.get_order_status(order_id) == "expired"
+    
+    assert db.update_order_status(order_id, "completed", f"txn_{order_id}") is False
+    assert db.get_order_status(order_id) == "expired"
+    # The released stock stays with the catalog
+    assert db.get_product(1)[5] == stock + 1
+
+def test_settled_order_is_not_failed_twice(db):
+    order_id = db.create_order(1, 1, 1, 15.99)
+    assert db.update_order_status(order_id, "completed") is True
+    assert db.update_order_status(order_id, "failed") is False
+    assert db.get_order_status(order_id) == "completed"
+
+def test_missing_order_is_told_apart_from_an_error(db):
+    assert db.get_order_status(999) == ORDER_MISSING
+    db.close()
+    db.db_name = "/nonexistent/dir/orders.db"
+    assert db.get_order_status(1) is None
@@ -0,0 +1,56 @@
+import pytest
+
+from database import Database
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "search.db"))
+    conn = db.get_connection()
+    with conn:
+        conn.execute("DELETE FROM products")
+        conn.executemany(
+            "INSERT INTO products (name, description, price, category, stock, is_digital) VALUES (?, ?, 1, 'games', ?, 0)",
+            # Name matches rank above description matches; the first five are sold out
+            [(f"Steam Gift Card {n}", "steam steam", 0 if n < 5 else 1) for n in range(30)]
+            + [(f"Voucher {n}", "steam", 1) for n in range(30)]
+        )
+    yield db
+    db.close()
+
+def ranked_in_stock(db, match, limit):
+    return db.get_connection().execute('''
+        SELECT p.* FROM products_fts f JOIN products p ON p.id = f.rowid
+        WHERE products_fts MATCH ? AND p.stock > 0
+        ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ?
+    ''', (match, limit)).fetchall()
+
+def test_results_are_the_best_in_stock_matches(db):
+    results = db.search_products("steam", limit=10)
+    assert results == ranked_in_stock(db, '"steam"*', 10)
+    assert all(row[5] > 0 for row in results)
+
+def test_stock_changes_apply_to_cached_rankings(db):
+    first = db.search_products("steam gift", limit=3)
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE products SET stock = 0 WHERE id = ?", (first[0][0],))
+    assert db.search_products("steam gift", limit=3) == ranked_in_stock(db, '"steam"* "gift"*', 3)
+
+def test_sold_out_best_matches_fall_back_to_full_ranking(db):
+    conn = db.get_connection()
+    with conn:
+        conn.execute("UPDATE products SET stock = 0 WHERE name LIKE 'Steam%'")
+    results = db.search_products("steam", limit=5)
+    assert len(results) == 5
+    assert all(row[1].startswith("Voucher") for row in results)
+
+def test_text_changes_refresh_the_ranking(db):
+    db.search_products("zebra")
+    conn = db.get_connection()
+    with conn:
+        conn.execute("INSERT INTO products (name, description, price, category, stock, is_digital) VALUES ('Zebra Pass', '', 1, 'games', 1, 0)")
+    assert [row[1] for row in db.search_products("zebra")] == ["Zebra Pass"]
+
+@pytest.mark.parametrize("query", ['"', "steam OR", "NEAR(a b)", "col:steam", "*", "   "])
+def test_fts_syntax_in_queries_is_literal(db, query):
+    assert isinstance(db.search_products(query), list)
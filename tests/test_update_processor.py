@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+telegram = pytest.importorskip("telegram")
+
+from update_processor import PerUserUpdateProcessor
+
+def callback_update(update_id, user_id):
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return telegram.Update.de_json({
+        "update_id": update_id,
+        "callback_query": {"id": str(update_id), "from": user, "chat_instance": str(user_id), "data": "x"},
+    }, None)
+
+def test_one_users_backlog_does_not_block_other_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(4)
+        finished = []
+        
+        async def handle(user_id, sequence, delay):
+            await asyncio.sleep(delay)
+            finished.append((user_id, sequence, time.perf_counter()))
+        
+        started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(processor.process_update(callback_update(n, 1), handle(1, n, 0.1)))
+            for n in range(8)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(callback_update(100, 2), handle(2, 0, 0))))
+        await asyncio.gather(*tasks)
+        return started, finished
+    
+    started, finished = asyncio.run(scenario())
+    other = next(done for user_id, _, done in finished if user_id == 2)
+    assert other - started < 0.05
+    assert [sequence for user_id, sequence, _ in finished if user_id == 1] == list(range(8))
+
+def test_updates_without_a_user_still_take_a_slot():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        running = 0
+        peak = 0
+        
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+        
+        await asyncio.gather(*(processor.process_update(object(), handle()) for _ in range(6)))
+        return peak
+    
+    assert asyncio.run(scenario()) == 2
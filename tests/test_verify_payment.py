@@ -0,0 +1,91 @@
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from khqr import KHQRPayment
+
+SLOW_REPLY = 0.5
+
+class StubBankHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    hits = Counter()
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        transaction_id = self.path.rsplit("/", 1)[-1]
+        self.hits[transaction_id] += 1
+        kind = transaction_id.split("_", 1)[0]
+        
+        if kind == "flaky" and self.hits[transaction_id] <= 2:
+            return self.reply(503, {"error": "try again"})
+        if kind == "missing":
+            return self.reply(404, {"error": "not found"})
+        if kind == "slow":
+            time.sleep(SLOW_REPLY)
+        self.reply(200, {"status": "success", "transaction_id": transaction_id})
+    
+    def reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+class StubBankServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Timed-out clients hang up before the slow handler replies
+        pass
+
+@pytest.fixture(scope="module")
+def bank_url():
+    server = StubBankServer(("127.0.0.1", 0), StubBankHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def verify(bank_url, transaction_id):
+    """Run one verification with short timeouts and two retries; returns (result, seconds)"""
+    async def run():
+        khqr = KHQRPayment()
+        khqr.base_url = bank_url
+        khqr.verify_timeout = 0.2
+        khqr.verify_retries = 2
+        khqr.verify_backoff = 0.01
+        started = time.perf_counter()
+        try:
+            return await khqr.verify_payment_async(transaction_id), time.perf_counter() - started
+        finally:
+            await khqr.aclose()
+    return asyncio.run(run())
+
+def test_success(bank_url):
+    result, _ = verify(bank_url, "ok_1")
+    assert result == {"status": "success", "transaction_id": "ok_1"}
+    assert StubBankHandler.hits["ok_1"] == 1
+
+def test_retries_503_until_success(bank_url):
+    result, _ = verify(bank_url, "flaky_1")
+    assert result["status"] == "success"
+    assert StubBankHandler.hits["flaky_1"] == 3
+
+def test_does_not_retry_404(bank_url):
+    result, _ = verify(bank_url, "missing_1")
+    assert result is None
+    assert StubBankHandler.hits["missing_1"] == 1
+
+def test_each_attempt_times_out(bank_url):
+    result, elapsed = verify(bank_url, "slow_1")
+    assert result is None
+    assert StubBankHandler.hits["slow_1"] == 3
+    # Three attempts cut off at 0.2s each, well before the 0.5s replies
+    assert elapsed < 3 * SLOW_REPLY
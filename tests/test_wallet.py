@@ -0,0 +1,22 @@
+import pytest
+
+@pytest.fixture
+def db(db):
+    # The shared database with $50.00 in customer 1's wallet
+    topup_id = db.create_topup(1, 5000)
+    db.complete_topup(topup_id, f"topup_{topup_id}")
+    return db
+
+@pytest.mark.parametrize("quantity", [0, -1, -100])
+def test_non_positive_quantity_is_rejected(db, quantity):
+    stock = db.get_product(1)[5]
+    assert db.wallet_purchase(1, 1, quantity) == (None, "invalid_quantity")
+    assert db.get_wallet_balance(1) == 5000
+    assert db.get_product(1)[5] == stock
+
+def test_purchase_debits_the_wallet(db):
+    price_cents = round(db.get_product(1)[3] * 100)
+    order_id, error = db.wallet_purchase(1, 1)
+    assert error is None
+    assert db.get_order_status(order_id) == "completed"
+    assert db.get_wallet_balance(1) == 5000 - price_cents
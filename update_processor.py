@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import sys
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+UNBOUNDED_UPDATES = sys.maxsize
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates at once while keeping
+    the updates of any one user in arrival order: each user's update waits
+    for that user's previous one to finish, without holding a slot while it
+    waits. Updates without a user (channel posts and the like) run unordered.
+    """
+    __slots__ = ("_tails", "_slots")
+    
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # The base class takes its slot before do_process_update can tell
+        # whose update it is, so a user's backlog would hold every slot while
+        # waiting its turn. Its limit is set so it never binds; the real one
+        # is _slots, taken once the user's previous update has finished.
+        super().__init__(UNBOUNDED_UPDATES)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user id -> future resolved when that user's latest update is done
+        self._tails = {}
+    
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+    
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        
+        # Claim the tail before the first await so arrival order is kept
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                try:
+                    # Shielded: cancelling this update must not cancel the previous one
+                    await asyncio.shield(previous)
+                except asyncio.CancelledError:
+                    coroutine.close()
+                    raise
+            async with self._slots:
+                await coroutine
+        finally:
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pending = list(self._tails.values())
+        if pending:
+            logger.info(f"Waiting for {len(pending)} users' updates to finish")
+            await asyncio.gather(*pending)